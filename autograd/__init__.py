@@ -1 +1,8 @@
-from .differential_operators import make_vjp, grad
+from .differential_operators import (make_vjp, grad, jacobian, compiled_grad,
+                                     hessian_vector_product, hessian, checkpoint,
+                                     per_example_grad, taylor, accumulate_grad,
+                                     fuse, value_and_grad)
+from .batching import vmap
+from .flatten import flatten
+from .forward_mode import make_jvp
+from .parallel import parallel_grad
@@ -0,0 +1,150 @@
+"""Vectorized Batching.
+
+Apply a function written for a single example to a whole batch of examples in
+one pass. Like forward mode, nothing is recorded: each node computes the
+results for all examples, stacked along a leading batch axis, as soon as it is
+created. With this library, one can,
+
+- Map a function over the leading axis of some of its arguments. (vmap)
+- Compute the gradient of a function for every example of a batch. (composing
+  vmap() with grad(), see per_example_grad())
+- Register batching rules for any primitive function. (defbatch)
+
+Each box of a batching trace holds the value of the first example, which the
+function sees as a stand-in for all of them. Shapes and dtypes are therefore
+those of a single example, but Python control flow on traced values (e.g. 'if
+x > 0:') is decided by the first example alone.
+"""
+import numpy as np
+
+from .tracer import Node, new_box, isbox, getval, trace_stack
+from .tape import static_functions
+from .util import subvals
+
+def vmap(fun, argnums=0):
+    """Vectorize a function over the leading axis of some of its arguments.
+
+    Args:
+      fun: function of single examples.
+      argnums: integer or tuple of integers. Indices of the batched arguments.
+        They must have the same length. Other arguments are shared by all
+        examples.
+
+    Returns:
+      batched_fun: function that takes the same args as fun(), but with batches
+        at argnums, and returns fun()'s outputs stacked along a new leading
+        axis.
+    """
+    if isinstance(argnums, int):
+        argnums = (argnums,)
+
+    def batched_fun(*args, **kwargs):
+        batch_size = np.shape(getval(args[argnums[0]]))[0]
+        with trace_stack.new_trace() as trace_id:
+            boxed_args = subvals(args, [
+                (argnum, new_box(args[argnum][0], trace_id,
+                                 BatchNode.new_root(args[argnum])))
+                for argnum in argnums])
+            end_box = fun(*boxed_args, **kwargs)
+        if isbox(end_box) and end_box._trace_id == trace_id:
+            return end_box._node.batched
+        else:
+            # Output seems independent of the batched arguments.
+            end_value = np.asarray(end_box)
+            return np.broadcast_to(end_value, (batch_size,) + end_value.shape).copy()
+    return batched_fun
+
+class BatchNode(Node):
+    """A node carrying its value for every example of a batch.
+
+    Like JVPNodes, BatchNodes don't keep their parents or recipe alive.
+    """
+    __slots__ = ['batched']
+
+    def __init__(self, value, fun, args, kwargs, parent_argnums, parents):
+        self.parents = ()
+        self.recipe = None
+        # Substitute each parent's batched value for its first example.
+        args = subvals(args, [(argnum, parent.batched)
+                              for argnum, parent in zip(parent_argnums, parents)])
+        try:
+            rule = primitive_batchers[fun]
+        except KeyError:
+            rule = batch_by_loop(fun)
+        self.batched = rule(tuple(parent_argnums), *args, **kwargs)
+
+    def initialize_root(self, batched):
+        self.parents = ()
+        self.recipe = None
+        self.batched = batched
+
+    @staticmethod
+    def records_notrace(f_raw):
+        # Comparisons, floor() etc. give a different result for every example.
+        # Shape queries are the same for all of them.
+        return f_raw not in static_functions
+
+def batch_by_loop(fun):
+    """Batching rule that applies fun() to one example at a time.
+
+    Used for primitives without a registered rule. Results are stacked with
+    plain numpy, so this rule doesn't support values traced by a computation
+    enclosing vmap().
+    """
+    def rule(argnums, *args, **kwargs):
+        batch_size = np.shape(args[argnums[0]])[0]
+        return np.stack([
+            fun(*subvals(args, [(argnum, args[argnum][i]) for argnum in argnums]),
+                **kwargs)
+            for i in range(batch_size)])
+    return rule
+
+class BatchRules(dict):
+    """Function -> batching rule.
+
+    Rules registered lazily (see defbatch_lazily()) are added the first time a
+    function they match is batched.
+    """
+
+    def __init__(self):
+        dict.__init__(self)
+        self.lazy = []  # (predicate on functions, function -> rule)
+
+    def __missing__(self, fun):
+        for matches, make_rule in self.lazy:
+            if matches(fun):
+                self[fun] = rule = make_rule(fun)
+                return rule
+        raise KeyError(fun)
+
+primitive_batchers = BatchRules()
+def defbatch(fun, rule):
+    """Register a batching rule.
+
+    Let fun(x, y, ...) = ans be a function. A batching rule computes fun() for
+    every example of a batch at once,
+
+      rule(argnums, x, y, ...) = stack([fun(x[i], y, ...) for i in ...])
+
+    where the arguments at positions 'argnums' (here, only x) have a leading
+    batch axis and the others are shared by all examples. Its result must have
+    the batch axis first as well. Rules should be written with autograd.numpy
+    functions, so that vmap() can itself be differentiated.
+
+    Args:
+      fun: function for which one wants to define a batching rule.
+      rule: function. Batching rule.
+    """
+    primitive_batchers[fun] = rule
+
+def defbatch_lazily(matches, make_rule):
+    """Register batching rules for every function for which 'matches' is true.
+
+    For families of functions that are created on demand, such as the wrapped
+    ufuncs of autograd.numpy, which can't be enumerated up front.
+
+    Args:
+      matches: function. Function -> bool.
+      make_rule: function. Takes a matching function, returns its batching rule.
+    """
+    primitive_batchers.lazy.append((matches, make_rule))
@@ -4,65 +4,251 @@ Construct vector-Jacobian product of a DAG of computation. With this library,
 one can,
 
 - Construct vector-Jacobian product for any single-input single-output function.
-  (make_vjp)
+  The input may be a nested container of arrays. (make_vjp)
+- Construct vector-Jacobian products wrt several inputs of a function, from a
+  single trace and backward pass. (make_multi_vjp)
 - Register vector-Jacobian product functions for any primitive function and
   argument index.
 """
 from collections import defaultdict
 from itertools import count
+import weakref
 import numpy as np
 
-from .tracer import trace, Node
+from . import tracer
+from .tracer import trace, trace_many, Node
+from .cotangents import SparseCotangent, SymbolicZero, is_zero, densify
+from .flatten import flatten, is_container
+from .saved_values import SavedValueStore, PackedNode
 from .util import toposort
 
-def make_vjp(fun, x):
+def make_vjp(fun, x, optimize=False, saved_values=None):
     """Make function for vector-Jacobian product.
 
     Args:
       fun: single-arg function. Jacobian derived from this.
-      x: ndarray. Point to differentiate about.
+      x: ndarray, or nested tuple, list or dict of them. Point to
+        differentiate about. Containers are flattened into one array (see
+        flatten.py), and the vjp returns a container like x whose leaves are
+        views of one flat gradient.
+      optimize: bool. If True, simplify the computation graph before the
+        backward pass (see graph_optimizer.py). What was saved is reported in
+        vjp.optimization_stats.
+      saved_values: SavedValuePolicy or None. How the computation graph stores
+        the values the backward pass needs (see saved_values.py). What was
+        saved is reported in vjp.saved_value_stats.
 
     Returns:
-      vjp: single-arg function. vector -> vector-Jacobian[fun, x] product.
+      vjp: function. vector -> vector-Jacobian[fun, x] product, a SymbolicZero
+        if no gradient reaches x (e.g. if fun() is constant). Frees the
+        computation graph as it goes unless called with retain_graph=True, so
+        by default it may only be called once. Called with n_workers > 1, runs
+        the backward pass on that many threads (see parallel.py).
       end_value: end_value = fun(start_node)
 
     """
-    start_node = Node.new_root()
+    if is_container(x):
+        return make_container_vjp(fun, x, optimize, saved_values)
+    if saved_values is None:
+        start_node = Node.new_root()
+    else:
+        store = SavedValueStore(saved_values)
+        start_node = PackedNode.new_root(store)
     end_value, end_node = trace(start_node, fun, x)
+    stats = None
+    if optimize and end_node is not None:
+        # Imported here because graph_optimizer depends on this module.
+        from .graph_optimizer import optimize_graph
+        end_node, stats = optimize_graph(start_node, end_node)
+
+    def zeros(g):
+        # Keep any leading batch axes of 'g' (see jacobian()).
+        batch_shape = np.shape(g)[:np.ndim(g) - np.ndim(end_value)]
+        return SymbolicZero(batch_shape + np.shape(x), np.result_type(x))
+
     if end_node is None:
-        def vjp(g): return np.zeros_like(x)
+        # Output seems independent of input. Same signature as below, though
+        # there is no graph to retain or to traverse on several threads.
+        def vjp(g, retain_graph=False, n_workers=1):
+            return zeros(g)
+    else:
+        def vjp(g, retain_graph=False, n_workers=1):
+            if end_node.recipe is None:
+                raise RuntimeError(
+                    "The computation graph has already been freed by a previous "
+                    "call. Pass retain_graph=True to call vjp more than once.")
+            if n_workers > 1:
+                # Imported here because parallel depends on this module.
+                from .parallel import parallel_backward_pass
+                result = parallel_backward_pass(g, end_node, n_workers,
+                                                retain_graph)
+            else:
+                result = backward_pass(g, end_node, retain_graph)
+            return zeros(g) if result is None else result
+    vjp.optimization_stats = stats
+    if saved_values is None:
+        vjp.saved_value_stats = None
     else:
-        def vjp(g): return backward_pass(g, end_node)
+        vjp.saved_value_stats = store.stats()
+        # Release what the policy holds for this trace (e.g. a file).
+        weakref.finalize(vjp, store.close)
     return vjp, end_value
 
-def backward_pass(g, end_node):
+def make_container_vjp(fun, x, optimize, saved_values):
+    """make_vjp() wrt the flattened leaves of the container x."""
+    flat, unflatten = flatten(x)
+    flat_vjp, end_value = make_vjp(lambda flat: fun(unflatten(flat)), flat,
+                                   optimize, saved_values)
+    def vjp(g, **kwargs):
+        return unflatten(densify(flat_vjp(g, **kwargs)))
+    vjp.optimization_stats = flat_vjp.optimization_stats
+    vjp.saved_value_stats = flat_vjp.saved_value_stats
+    # Keep the flat vjp, and what its finalizer releases, alive with this one.
+    vjp.flat_vjp = flat_vjp
+    return vjp, end_value
+
+def make_multi_vjp(fun, xs, saved_values=None):
+    """Make function for vector-Jacobian products wrt several arguments.
+
+    Every argument is boxed under the same trace, and a single backward pass
+    computes the products wrt all of them.
+
+    Args:
+      fun: function of len(xs) positional arguments. Jacobians derived from
+        this.
+      xs: list of ndarrays, or nested tuples, lists or dicts of them. Point to
+        differentiate about.
+      saved_values: SavedValuePolicy or None. See make_vjp().
+
+    Returns:
+      vjp: function. vector -> list of vector-Jacobian[fun, x] products, one
+        per x in xs, a SymbolicZero for those that no gradient reaches. Frees
+        the computation graph unless called with retain_graph=True.
+      end_value: end_value = fun(*xs)
+    """
+    xs, unflattens = list(xs), [None] * len(xs)
+    for i, x in enumerate(xs):
+        if is_container(x):
+            xs[i], unflattens[i] = flatten(x)
+    if any(unflatten is not None for unflatten in unflattens):
+        flat_fun = lambda *xs: fun(*[x if unflatten is None else unflatten(x)
+                                     for x, unflatten in zip(xs, unflattens)])
+    else:
+        flat_fun = fun
+    if saved_values is None:
+        start_nodes = [Node.new_root() for _ in xs]
+    else:
+        store = SavedValueStore(saved_values)
+        start_nodes = [PackedNode.new_root(store) for _ in xs]
+    end_value, end_node = trace_many(start_nodes, flat_fun, xs)
+
+    def vjp(g, retain_graph=False):
+        if end_node is None:
+            results = [None] * len(xs)
+        elif end_node.recipe is None:
+            raise RuntimeError(
+                "The computation graph has already been freed by a previous "
+                "call. Pass retain_graph=True to call vjp more than once.")
+        else:
+            results = backward_pass(g, end_node, retain_graph, start_nodes)
+        # Keep any leading batch axes of 'g' (see jacobian()).
+        batch_shape = np.shape(g)[:np.ndim(g) - np.ndim(end_value)]
+        vjps = []
+        for x, unflatten, result in zip(xs, unflattens, results):
+            if result is None:
+                result = SymbolicZero(batch_shape + np.shape(x),
+                                      np.result_type(x))
+            vjps.append(result if unflatten is None
+                        else unflatten(densify(result)))
+        return vjps
+    if saved_values is None:
+        vjp.saved_value_stats = None
+    else:
+        vjp.saved_value_stats = store.stats()
+        weakref.finalize(vjp, store.close)
+    return vjp, end_value
+
+def backward_pass(g, end_node, retain_graph=False, start_nodes=None):
     """Backpropagation.
 
     Traverse computation graph backwards in topological order from the end node.
     For each node, compute local gradient contribution and accumulate.
+
+    Args:
+      g: gradient with respect to the end node's value.
+      end_node: Node to start from.
+      retain_graph: if False, drop each node's recipe (its value and arguments)
+        as soon as its vjps have run, so that memory is released while the
+        backward pass progresses. The graph can't be traversed again.
+      start_nodes: list of root Nodes, for a graph traced from several of them
+        (see trace_many()), or None for a graph with a single root.
+
+    Returns:
+      Gradient with respect to the root node's value, or None if it is zero.
+      Given start_nodes, a list with the gradient wrt each of them instead.
     """
     outgrads = {end_node: g}
+    # Gradients that reached roots, for start_nodes.
+    root_outgrads = {}
+    profiler = tracer.profiler
     for node in toposort(end_node):
-        outgrad = outgrads.pop(node)
+        # Nodes that no gradient reached have no entry.
+        outgrad = outgrads.pop(node, None)
+        if not node.parents:
+            root_outgrads[node] = outgrad
         fun, value, args, kwargs, argnums = node.recipe
+        if not retain_graph:
+            node.recipe = None
+        if is_zero(outgrad):
+            # Nothing to send to the parents.
+            argnums = ()
+        elif type(node) is PackedNode:
+            value, args = node.unpack(value, args)
+        if type(outgrad) is SparseCotangent:
+            # vjps expect plain cotangents, or symbolic ones, which behave like
+            # arrays.
+            outgrad = outgrad.densify()
         for argnum, parent in zip(argnums, node.parents):
             # Lookup vector-Jacobian product (gradient) function for this
             # function/argument.
             vjp = primitive_vjps[fun][argnum]
+            if vjp is None:
+                # Not differentiable wrt this argument, e.g. where()'s condition.
+                continue
 
             # Compute vector-Jacobian product (gradient) contribution due to
             # parent node's use in this function.
-            parent_grad = vjp(outgrad, value, *args, **kwargs)
+            if profiler is None:
+                parent_grad = vjp(outgrad, value, *args, **kwargs)
+            else:
+                parent_grad = profiler.call_vjp(vjp, fun, argnum, outgrad,
+                                                value, args, kwargs)
 
             # Save vector-Jacobian product (gradient) for upstream nodes.
             # Sum contributions with all others also using parent's output.
             outgrads[parent] = add_outgrads(outgrads.get(parent), parent_grad)
-    return outgrad
+
+        # Release this node's values before moving on.
+        del value, args, kwargs
+    if start_nodes is not None:
+        return [None if is_zero(root_outgrads.get(node))
+                else densify(root_outgrads[node]) for node in start_nodes]
+    return None if is_zero(outgrad) else densify(outgrad)
 
 def add_outgrads(prev_g, g):
-    """Add gradient contributions together."""
-    if prev_g is None:
+    """Add gradient contributions together.
+
+    Sums of SparseCotangents stay sparse. A SparseCotangent is only scattered
+    into a plain cotangent when it meets one. Adding a SymbolicZero is free.
+    """
+    if is_zero(prev_g):
         return g
+    if is_zero(g):
+        return prev_g
+    if type(g) is SparseCotangent and type(prev_g) is not SparseCotangent:
+        return g.add_to(prev_g)
+    if type(prev_g) is SparseCotangent and type(g) is not SparseCotangent:
+        return prev_g.add_to(g)
     return prev_g + g
 
 primitive_vjps = defaultdict(dict)
@@ -0,0 +1,277 @@
+"""Structured cotangents.
+
+Most cotangents (gradients flowing through the backward pass) are plain values
+shaped like the value they belong to. This library contains alternative
+representations that the backward pass understands, and which avoid
+materializing mostly-empty arrays. With this library, one can,
+
+- Represent a cotangent that is zero except at some indexed entries.
+  (SparseCotangent)
+- Represent a cotangent that is zero, or one, everywhere. (SymbolicZero,
+  SymbolicOnes)
+- Scatter values into an array of zeros, differentiably. (untake)
+"""
+import numpy as np
+
+from .tracer import primitive, isbox
+
+class SparseCotangent(object):
+    """Cotangent that is zero except at some indexed entries.
+
+    Represents the sum of untake(values, index, shape, dtype) over a list of
+    (index, values) pairs. This is what indexing into an array produces in the
+    backward pass: gradient only flows to the entries that were read. Adding
+    two SparseCotangents concatenates their pairs, so a large array read in
+    many places costs nothing proportional to its size until the gradient is
+    needed as a plain array.
+    """
+    __slots__ = ['shape', 'dtype', 'pairs']
+
+    def __init__(self, shape, dtype, pairs):
+        """
+
+        Args:
+          shape: tuple. Shape of the dense cotangent.
+          dtype: dtype of the dense cotangent.
+          pairs: list of (index, values) pairs. 'index' is any numpy index into
+            an array of the given shape, and 'values' has the shape of the
+            result of such indexing.
+        """
+        self.shape = shape
+        self.dtype = dtype
+        self.pairs = pairs
+
+    def __add__(self, other):
+        return SparseCotangent(self.shape, self.dtype, self.pairs + other.pairs)
+
+    def add_to(self, dense):
+        """Add to a plain cotangent. 'dense' is not modified."""
+        if isbox(dense) or self.is_traced():
+            # Boxed values must go through primitives to be traced.
+            return dense + self.densify()
+        result = np.array(dense, dtype=np.result_type(dense, self.dtype))
+        self.scatter(result)
+        return result
+
+    def densify(self):
+        """Convert to a plain cotangent."""
+        if self.is_traced():
+            terms = [untake(values, idx, self.shape, self.dtype)
+                     for idx, values in self.pairs]
+            return sum(terms[1:], terms[0])
+        result = np.zeros(self.shape, self.dtype)
+        self.scatter(result)
+        return result
+
+    def scatter(self, result):
+        """Add every pair's values into the array 'result', in place."""
+        for idx, values in self.pairs:
+            if is_basic_index(idx):
+                # Selects no entry twice, and is much faster than add.at().
+                result[idx] += values
+            else:
+                np.add.at(result, idx, values)
+
+    def is_traced(self):
+        """True if any values are boxed, e.g. during a nested grad()."""
+        return any(isbox(values) for _, values in self.pairs)
+
+def is_basic_index(idx):
+    """True if the numpy index 'idx' is made of integers, slices, Ellipsis and
+    None only, and therefore selects views rather than copies."""
+    for item in idx if type(idx) is tuple else (idx,):
+        if not (item is None or item is Ellipsis or type(item) is slice
+                or isinstance(item, (int, np.integer))):
+            return False
+    return True
+
+class SymbolicCotangent(object):
+    """Cotangent with the same value everywhere, stored as a shape and dtype.
+
+    Behaves like an array in numpy functions and arithmetic, so that vjps
+    needn't know about it. Operations that it makes trivial return their other
+    operand without computing anything (see simplify()). Other ufuncs, and
+    numpy functions that never return views of their arguments, read it
+    through a zero-stride broadcast view, which costs no memory. Other numpy
+    functions get a plain array.
+    """
+    __slots__ = ['shape', 'dtype']
+    fill = None
+
+    def __init__(self, shape, dtype):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    def densify(self):
+        """Convert to a plain cotangent."""
+        return np.full(self.shape, self.fill, self.dtype)
+
+    def broadcast(self):
+        """Read-only view with the value of the cotangent."""
+        return np.broadcast_to(np.array(self.fill, self.dtype), self.shape)
+
+    def simplify(self, ufunc, inputs):
+        """Result of ufunc(*inputs) if it can be had for free, or None."""
+        return None
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        if any(map(isbox, inputs)):
+            return NotImplemented
+        if method == '__call__' and not kwargs:
+            result = self.simplify(ufunc, inputs)
+            if result is not None:
+                return result
+        inputs = [x.broadcast() if isinstance(x, SymbolicCotangent) else x
+                  for x in inputs]
+        return getattr(ufunc, method)(*inputs, **kwargs)
+
+    def __array_function__(self, func, types, args, kwargs):
+        if func in symbolic_queries and not kwargs:
+            return symbolic_queries[func](*args)
+        if func in view_safe_functions:
+            convert = lambda x: x.broadcast()
+        else:
+            convert = lambda x: x.densify()
+        args = [convert(x) if isinstance(x, SymbolicCotangent) else x
+                for x in args]
+        return func(*args, **kwargs)
+
+    def __array__(self, dtype=None):
+        return np.asarray(self.densify(), dtype)
+
+    def __getitem__(self, idx):
+        return self.broadcast()[idx].copy()
+
+    def __getattr__(self, name):
+        # Array methods and attributes, e.g. g.T or g.reshape().
+        if name.startswith('__') or name in SymbolicCotangent.__slots__:
+            raise AttributeError(name)
+        return getattr(self.densify(), name)
+
+    def __repr__(self):
+        return "{}({}, {})".format(type(self).__name__, self.shape, self.dtype)
+
+def dtype_of(x):
+    return x.dtype if isinstance(x, SymbolicCotangent) else x
+
+# Queries answered from a SymbolicCotangent's shape and dtype. vjps make lots
+# of them.
+symbolic_queries = {
+    np.shape: lambda g: g.shape,
+    np.ndim: lambda g: g.ndim,
+    np.size: lambda g: g.size,
+    np.iscomplexobj: lambda g: np.issubdtype(g.dtype, np.complexfloating),
+    np.result_type: lambda *args: np.result_type(*map(dtype_of, args)),
+}
+
+# Functions that never return a view of their arguments, which can therefore
+# be given a read-only broadcast view of a SymbolicCotangent.
+view_safe_functions = {np.sum, np.dot, np.tensordot, np.einsum, np.where}
+
+def symbolic_operator(ufunc, reflected=False):
+    def operator(self, other):
+        if isbox(other):
+            # Let the box trace the operation.
+            return NotImplemented
+        return ufunc(other, self) if reflected else ufunc(self, other)
+    return operator
+
+for name, ufunc in [('add', np.add), ('sub', np.subtract),
+                    ('mul', np.multiply), ('truediv', np.true_divide),
+                    ('pow', np.power)]:
+    setattr(SymbolicCotangent, '__{}__'.format(name), symbolic_operator(ufunc))
+    setattr(SymbolicCotangent, '__r{}__'.format(name),
+            symbolic_operator(ufunc, reflected=True))
+SymbolicCotangent.__neg__ = lambda self: np.negative(self)
+
+def shape_of(x):
+    return x.shape if isinstance(x, SymbolicCotangent) else np.shape(x)
+
+def result_shape(inputs):
+    """Shape of the result of a ufunc, i.e. the broadcast inputs' shape."""
+    shapes = set(map(shape_of, inputs))
+    return shapes.pop() if len(shapes) == 1 else np.broadcast_shapes(*shapes)
+
+def like(x, shape, dtype):
+    """Plain or symbolic 'x', broadcast to 'shape' and cast to 'dtype'."""
+    if isinstance(x, SymbolicCotangent):
+        return type(x)(shape, dtype)
+    if type(x) is np.ndarray and x.shape == shape and x.dtype == dtype:
+        return x
+    result = np.empty(shape, dtype)
+    result[...] = x
+    return result
+
+class SymbolicZero(SymbolicCotangent):
+    """Cotangent that is zero everywhere.
+
+    Adding it is a no-op, and multiplying by it gives another SymbolicZero. The
+    backward pass doesn't call the vjps of nodes whose cotangent is zero.
+    """
+    __slots__ = []
+    fill = 0
+
+    def simplify(self, ufunc, inputs):
+        shape = result_shape(inputs)
+        dtype = np.result_type(*map(dtype_of, inputs))
+        if ufunc is np.negative:
+            return SymbolicZero(shape, dtype)
+        if len(inputs) != 2:
+            return None
+        x, y = inputs
+        if ufunc is np.add:
+            return like(y if x is self else x, shape, dtype)
+        if ufunc is np.subtract and y is self:
+            return like(x, shape, dtype)
+        if ufunc is np.multiply or (ufunc is np.true_divide and x is self):
+            return SymbolicZero(shape, dtype)
+        return None
+
+class SymbolicOnes(SymbolicCotangent):
+    """Cotangent that is one everywhere, e.g. the initial cotangent of grad().
+
+    Multiplying by it passes the other operand through, which may therefore be
+    returned as is.
+    """
+    __slots__ = []
+    fill = 1
+
+    def simplify(self, ufunc, inputs):
+        if len(inputs) != 2:
+            return None
+        x, y = inputs
+        if ufunc is np.multiply or (ufunc is np.true_divide and y is self):
+            shape = result_shape(inputs)
+            dtype = np.result_type(*map(dtype_of, inputs))
+            return like(y if x is self else x, shape, dtype)
+        return None
+
+def is_zero(g):
+    """True if 'g' is known to be zero: None or a SymbolicZero."""
+    return g is None or type(g) is SymbolicZero
+
+def densify(g):
+    """Convert a possibly structured cotangent to a plain one."""
+    if type(g) in (SparseCotangent, SymbolicZero, SymbolicOnes):
+        return g.densify()
+    return g
+
+@primitive
+def untake(x, idx, shape, dtype):
+    """Adjoint of indexing.
+
+    Returns an array of zeros with the given shape and dtype, except that 'x'
+    is added to the entries selected by 'idx'. Entries selected more than once
+    receive every contribution.
+    """
+    result = np.zeros(shape, dtype)
+    np.add.at(result, idx, x)
+    return result
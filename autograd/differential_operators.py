@@ -1,11 +1,21 @@
 """Convenience functions built on top of `make_vjp`."""
 
+from math import factorial
+import threading
 import numpy as np
 
-from .core import make_vjp
-from .util import subval
+from .batching import vmap, defbatch
+from .core import make_vjp, make_multi_vjp, primitive_vjps
+from .cotangents import SymbolicZero, SymbolicOnes, is_zero, densify
+from .flatten import flatten, is_container
+from .forward_mode import make_jvp, primitive_jvps
+from .fusion import record_kernel, NotFusibleError
+from .taylor_mode import make_taylor
+from .tape import record_tape, signature, LRUCache, NotCompilableError
+from .tracer import isbox, getval, primitive, box_type_mappings
+from .util import subval, subvals, wraps
 
-def grad(fun, argnum=0):
+def grad(fun, argnum=0, saved_values=None):
     """Constructs gradient function.
 
     Given a function fun(x), returns a function fun'(x) that returns the
@@ -13,18 +23,513 @@ def grad(fun, argnum=0):
 
     Args:
       fun: single-argument function. ndarray -> ndarray.
-      argnum: integer. Index of argument to take derivative wrt.
+      argnum: integer. Index of argument to take derivative wrt. The argument
+        may be a nested tuple, list or dict of arrays (see flatten.py).
+      saved_values: SavedValuePolicy or None. How to store the values the
+        backward pass needs, e.g. compressed (see saved_values.py).
 
     Returns:
       gradfun: function that takes same args as fun(), but returns the gradient
-        wrt to fun()'s argnum-th argument.
+        wrt to fun()'s argnum-th argument. For a container, that is a
+        container like it whose leaves are views of one flat array.
     """
     def gradfun(*args, **kwargs):
         # Replace args[argnum] with x. Define a single-argument function to
         # compute derivative wrt.
         unary_fun = lambda x: fun(*subval(args, argnum, x), **kwargs)
 
-        # Construct vector-Jacobian product
+        # Construct vector-Jacobian product. If we are inside another trace,
+        # 'ans' is boxed; the all-ones cotangent is a constant either way, and
+        # symbolic so that vjps can multiply by it for free.
+        vjp, ans = make_vjp(unary_fun, args[argnum], saved_values=saved_values)
+        ans = getval(ans)
+        return densify(vjp(SymbolicOnes(np.shape(ans), np.result_type(ans))))
+    return gradfun
+
+def value_and_grad(fun, argnums=0, saved_values=None):
+    """Constructs function returning the value and gradient of a function.
+
+    Like grad(), but also returns fun()'s value, and takes gradients wrt
+    several arguments at once. Every argument in argnums is boxed under the
+    same trace, so fun() is evaluated once and a single backward pass computes
+    all the gradients (see core.make_multi_vjp()).
+
+    Args:
+      fun: scalar-valued function.
+      argnums: integer, or tuple of integers. Indices of arguments to take
+        derivatives wrt. Each argument may be a nested tuple, list or dict of
+        arrays (see flatten.py).
+      saved_values: SavedValuePolicy or None. See grad().
+
+    Returns:
+      valgradfun: function that takes same args as fun(), but returns a pair:
+        fun()'s value, and its gradient wrt the argument at argnums, or a tuple
+        of its gradients wrt each of them if argnums is a tuple.
+    """
+    def valgradfun(*args, **kwargs):
+        nums = argnums if isinstance(argnums, tuple) else (argnums,)
+        multi_fun = lambda *xs: fun(*subvals(args, zip(nums, xs)), **kwargs)
+        vjp, ans = make_multi_vjp(multi_fun, [args[i] for i in nums],
+                                  saved_values=saved_values)
+        # Inside another trace 'ans' is boxed, and returned as such so that the
+        # outer trace can differentiate it.
+        val = getval(ans)
+        grads = tuple(densify(g) for g in
+                      vjp(SymbolicOnes(np.shape(val), np.result_type(val))))
+        return ans, grads if isinstance(argnums, tuple) else grads[0]
+    return valgradfun
+
+def accumulate_grad(fun, data_iter, argnum=0, prefetch=False):
+    """Constructs gradient function summed over a stream of minibatches.
+
+    Equivalent to the sum of grad(fun, argnum)(*args, batch) over every
+    minibatch 'batch' of data_iter, but each minibatch's computation graph is
+    released before the next minibatch is traced, and gradients are added into
+    a single buffer. Memory use doesn't grow with the number of minibatches.
+
+    Args:
+      fun: function. Its last positional argument is a minibatch.
+      data_iter: iterable of minibatches, e.g. a generator. Each call of the
+        returned function iterates over it once.
+      argnum: integer. Index of argument to take derivative wrt. The argument
+        may be a nested tuple, list or dict of arrays, whose gradients are
+        then summed in one flat array (see flatten.py).
+      prefetch: bool. If True, trace the next minibatch on a background thread
+        while the current one's backward pass runs. Two graphs are then alive
+        at a time.
+
+    Returns:
+      gradfun: function that takes the same args as fun() minus the minibatch,
+        and returns the summed gradient wrt fun()'s argnum-th argument. Pass
+        out=array to receive the gradient in an existing array, which for a
+        container is a flat array laid out like flatten()'s.
+    """
+    def gradfun(*args, **kwargs):
+        out = kwargs.pop('out', None)
+        x = args[argnum]
+        if is_container(x):
+            flat, unflatten = flatten(x)
+            flat_fun = lambda *args, **kwargs: fun(
+                *subval(args, argnum, unflatten(args[argnum])), **kwargs)
+            flat_gradfun = accumulate_grad(flat_fun, data_iter, argnum, prefetch)
+            return unflatten(flat_gradfun(*subval(args, argnum, flat), out=out,
+                                          **kwargs))
+
+        def trace_batch(batch):
+            unary_fun = lambda x: fun(*subval(args, argnum, x) + (batch,),
+                                      **kwargs)
+            return make_vjp(unary_fun, x)
+
+        def backward(traced):
+            vjp, ans = traced
+            ans = getval(ans)
+            return vjp(SymbolicOnes(np.shape(ans), np.result_type(ans)))
+
+        if isbox(x):
+            # Inside another trace, gradients are boxed and must be summed by
+            # primitives.
+            total = None
+            add = lambda total, g: g if total is None else total + g
+        else:
+            if out is None:
+                out = np.empty(np.shape(x), np.result_type(x, float))
+            total = out
+            total[...] = 0
+            add = lambda total, g: np.add(total, g, out=total)
+
+        batches = iter(data_iter)
+        if not prefetch:
+            for batch in batches:
+                g = backward(trace_batch(batch))
+                if not is_zero(g):
+                    total = add(total, g)
+                # Let go of this minibatch's graph before tracing the next.
+                del g
+        else:
+            # Imported here, as concurrent.futures is slow to import.
+            from concurrent.futures import ThreadPoolExecutor
+            next_traced = lambda: next((trace_batch(batch) for batch in batches),
+                                       None)
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                pending = executor.submit(next_traced)
+                while True:
+                    traced = pending.result()
+                    if traced is None:
+                        break
+                    pending = executor.submit(next_traced)
+                    g = backward(traced)
+                    if not is_zero(g):
+                        total = add(total, g)
+                    del traced, g
+        if total is None:
+            return densify(SymbolicZero(np.shape(x), np.result_type(x)))
+        return total
+    return gradfun
+
+def jacobian(fun, argnum=0):
+    """Constructs Jacobian function.
+
+    Given a function fun(x), returns a function fun'(x) that returns the
+    Jacobian of fun(x) wrt x. fun() is traced once, and all rows of the Jacobian
+    are computed by a single backward pass: a stack of all basis vectors of
+    fun()'s output space is used as a batch of cotangents.
+
+    Args:
+      fun: function. ndarray -> ndarray.
+      argnum: integer. Index of argument to take derivative wrt. The argument
+        may be a nested tuple, list or dict of arrays (see flatten.py).
+
+    Returns:
+      jacfun: function that takes same args as fun(), but returns the Jacobian
+        wrt to fun()'s argnum-th argument. Its shape is the shape of fun()'s
+        output followed by the shape of the argnum-th argument. For a
+        container, it is a container like it, each leaf holding the Jacobian
+        wrt that leaf.
+    """
+    def jacfun(*args, **kwargs):
+        if is_container(args[argnum]):
+            flat, unflatten = flatten(args[argnum])
+            flat_fun = lambda *args, **kwargs: fun(
+                *subval(args, argnum, unflatten(args[argnum])), **kwargs)
+            # unflatten() keeps the output's axes in front of every leaf's.
+            return unflatten(jacobian(flat_fun, argnum)(
+                *subval(args, argnum, flat), **kwargs))
+        unary_fun = lambda x: fun(*subval(args, argnum, x), **kwargs)
         vjp, ans = make_vjp(unary_fun, args[argnum])
-        return vjp(np.ones_like(ans))
+
+        # Row i of 'basis' is the i-th basis vector of fun()'s output space,
+        # shaped like the output.
+        ans_shape = np.shape(ans)
+        ans_size = int(np.prod(ans_shape))
+        basis = np.reshape(np.eye(ans_size), (ans_size,) + ans_shape)
+        jac = densify(vjp(basis))
+        return np.reshape(jac, ans_shape + np.shape(args[argnum]))
+    return jacfun
+
+def hessian_vector_product(fun, argnum=0):
+    """Constructs Hessian-vector product function.
+
+    Given a scalar-valued function fun(x), returns a function that computes
+    H v, where H is the Hessian of fun at x. The product is computed in
+    forward-over-reverse mode: the tangent v is pushed forward through the
+    evaluation of grad(fun), backward pass included. This costs a small constant
+    multiple of computing the gradient.
+
+    Args:
+      fun: scalar-valued function.
+      argnum: integer. Index of argument to take derivatives wrt.
+
+    Returns:
+      hvpfun: function that takes the same args as fun() plus one more, the
+        vector v, and returns H v. v has the shape of fun()'s argnum-th
+        argument.
+    """
+    fun_grad = grad(fun, argnum)
+    def hvpfun(*args, **kwargs):
+        args, vector = args[:-1], args[-1]
+        unary_fun_grad = lambda x: fun_grad(*subval(args, argnum, x), **kwargs)
+        return make_jvp(unary_fun_grad, args[argnum])(vector)[1]
+    return hvpfun
+
+def hessian(fun, argnum=0):
+    """Constructs Hessian function.
+
+    The Hessian is assembled from Hessian-vector products with each basis
+    vector of the argument's space. See hessian_vector_product().
+
+    Args:
+      fun: scalar-valued function.
+      argnum: integer. Index of argument to take derivatives wrt.
+
+    Returns:
+      hessfun: function that takes same args as fun(), but returns the
+        Hessian wrt fun()'s argnum-th argument. Its shape is the argument's
+        shape, twice.
+    """
+    hvp = hessian_vector_product(fun, argnum)
+    def hessfun(*args, **kwargs):
+        shape = np.shape(args[argnum])
+        size = int(np.prod(shape))
+        basis = np.reshape(np.eye(size), (size,) + shape)
+        columns = [hvp(*(args + (vector,)), **kwargs) for vector in basis]
+        return np.reshape(np.stack(columns), shape + shape)
+    return hessfun
+
+def taylor(fun, order, argnum=0):
+    """Constructs function for derivatives up to a given order.
+
+    Given a function fun(x), returns a function that returns fun(x) and its
+    first 'order' derivatives wrt x, along the all-ones direction. For
+    elementwise functions these are the elementwise derivatives, e.g.
+    taylor(tanh, 2)(x) equals [tanh(x), grad(tanh)(x), grad(grad(tanh))(x)].
+
+    Unlike nested grad(), which builds a larger graph for every order, all
+    derivatives come from a single forward pass that propagates a truncated
+    Taylor series (see taylor_mode.py), at O(order^2) cost per primitive.
+
+    Args:
+      fun: function. ndarray -> ndarray.
+      order: integer. Highest derivative to compute.
+      argnum: integer. Index of argument to take derivatives wrt.
+
+    Returns:
+      derivsfun: function that takes same args as fun(), but returns a list of
+        order + 1 values: fun()'s value and its derivatives of orders 1, 2, ...
+    """
+    def derivsfun(*args, **kwargs):
+        unary_fun = lambda x: fun(*subval(args, argnum, x), **kwargs)
+        x = args[argnum]
+        series = make_taylor(unary_fun, x, order)(np.ones_like(getval(x)))
+        # The j-th coefficient is the j-th derivative divided by j!.
+        return [c * factorial(j) for j, c in enumerate(series)]
+    return derivsfun
+
+def per_example_grad(fun, argnum=0, batch_argnum=1):
+    """Constructs per-example gradient function.
+
+    Given a function fun(params, example) that returns the loss of a single
+    example, returns a function that takes a batch of examples and returns the
+    gradient of every example's loss, stacked. All examples are handled by a
+    single vectorized trace (see batching.vmap()) rather than one trace and
+    backward pass each.
+
+    Args:
+      fun: function of a single example. Returns a scalar.
+      argnum: integer. Index of argument to take derivative wrt.
+      batch_argnum: integer or tuple of integers. Indices of the batched
+        arguments (e.g. inputs and targets).
+
+    Returns:
+      gradfun: function that takes the same args as fun(), but with batches at
+        batch_argnum, and returns an array of shape (batch size,) + shape of
+        fun()'s argnum-th argument.
+    """
+    return vmap(grad(fun, argnum), batch_argnum)
+
+def compiled_grad(fun, argnum=0, cache_size=32):
+    """Constructs gradient function that replays recorded tapes.
+
+    Like grad(), but fun is traced only once per signature (types, shapes and
+    dtypes of its arguments). The primitives it applies are recorded on a flat
+    tape, and later calls replay that tape forward and backward on unboxed
+    values.
+
+    This is only correct if the primitives fun applies depend on nothing but the
+    signature of its arguments. In particular, fun must not branch on the values
+    of its arguments. Functions found not to qualify while recording fall back
+    to grad(): those that apply comparisons or other non-differentiable
+    functions to traced values, or branch on them with 'if'. Other
+    value-dependent control flow (e.g. on float(x)) is NOT detected, and gives
+    wrong gradients without an error (see autograd.tape).
+
+    Arrays that fun closes over or reads from globals are baked into the tape.
+    If fun should see new ones, pass them as arguments instead: rebinding them
+    doesn't invalidate the cached tape.
+
+    Replaying saves the cost of boxing and graph construction, which dominates
+    for scalars and small arrays. When the numpy calls themselves dominate
+    (large arrays, matrix products), expect about the same time as grad().
+
+    Args:
+      fun: function. Same as for grad().
+      argnum: integer. Index of argument to take derivative wrt.
+      cache_size: integer. Maximum number of tapes to keep. The least recently
+        used tape is evicted first.
+
+    Returns:
+      gradfun: function that takes same args as fun(), but returns the gradient
+        wrt to fun()'s argnum-th argument.
+    """
+    cache = LRUCache(cache_size)
+    plain_gradfun = grad(fun, argnum)
+
+    def gradfun(*args, **kwargs):
+        key = signature(args, kwargs)
+        if key is None or any(map(isbox, args)):
+            return plain_gradfun(*args, **kwargs)
+
+        if key not in cache:
+            try:
+                tape, input_slots = record_tape(fun, args, kwargs)
+            except NotCompilableError:
+                tape, input_slots = None, None
+            cache[key] = (tape, input_slots)
+        tape, input_slots = cache[key]
+
+        start_slot = input_slots[argnum] if tape else None
+        if start_slot is None:
+            return plain_gradfun(*args, **kwargs)
+        if tape.end_slot is None:
+            return np.zeros_like(args[argnum])
+
+        inputs = [arg for arg, slot in zip(args, input_slots) if slot is not None]
+        values, entry_args = tape.forward(inputs)
+        ans = values[tape.end_slot]
+        outgrads = tape.backward(np.ones_like(ans), values, entry_args,
+                                 tape.requires_grad(start_slot))
+        if outgrads[start_slot] is None:
+            return np.zeros_like(args[argnum])
+        return densify(outgrads[start_slot])
     return gradfun
+
+def checkpoint(fun):
+    """Constructs a checkpointed (rematerialized) version of a function.
+
+    The returned function computes the same values as fun(), but is a single
+    primitive: its forward pass runs fun() untraced, so that the computation
+    graph only keeps its inputs and output instead of all of fun()'s
+    intermediate values. Its vjp traces fun() again on demand during the
+    backward pass. Memory is traded for computation; checkpointing every
+    sqrt(n)-th block of a chain of n blocks keeps O(sqrt(n)) values alive.
+
+    Checkpointed functions may be nested and differentiated any number of
+    times.
+
+    Args:
+      fun: function. Must return a single value that can be boxed.
+
+    Returns:
+      checkpointed_fun: function with the same signature as fun().
+    """
+    @primitive
+    @wraps(fun, "checkpointed_{fun}")
+    def checkpointed_fun(*args, **kwargs):
+        return fun(*args, **kwargs)
+    primitive_vjps[checkpointed_fun] = RecomputingRules(fun, make_vjp_rule)
+    primitive_jvps[checkpointed_fun] = RecomputingRules(fun, make_jvp_rule)
+    defbatch(checkpointed_fun, lambda argnums, *args, **kwargs:
+             vmap(fun, argnums)(*args, **kwargs))
+    return checkpointed_fun
+
+def fuse(fun, block_size=1 << 14, cache_size=32):
+    """Constructs a fused version of an elementwise function.
+
+    The returned function computes the same values as fun(), but is a single
+    primitive. fun() is recorded once per input signature, on a single
+    element (see autograd.fusion), then evaluated in cache-sized blocks of
+    elements, every ufunc writing into a reused buffer instead of allocating a
+    full-size temporary. Its vjp evaluates the blocks again and runs their backward pass,
+    so the computation graph only keeps fun()'s inputs and output.
+
+    Functions that aren't elementwise (e.g. because they reduce, reshape or
+    broadcast arrays of different shapes) run unfused. Nested derivatives
+    re-trace fun().
+
+    Args:
+      fun: function of arrays of one shape, and scalars, made of ufuncs.
+      block_size: integer. Number of elements evaluated at a time.
+      cache_size: integer. Maximum number of recorded kernels to keep.
+
+    Returns:
+      fused_fun: function with the same signature as fun().
+    """
+    cache = LRUCache(cache_size)
+
+    def kernel(args, kwargs):
+        """Kernel for a call, or None if it can't be fused."""
+        key = signature(args, kwargs)
+        if key is None:
+            return None
+        if key not in cache:
+            try:
+                cache[key] = record_kernel(fun, args, kwargs, block_size)
+            except NotFusibleError:
+                cache[key] = None
+        return cache[key]
+
+    @primitive
+    @wraps(fun, "fused_{fun}")
+    def fused_fun(*args, **kwargs):
+        fused = kernel(args, kwargs)
+        if fused is None:
+            return fun(*args, **kwargs)
+        return fused.forward(args)
+
+    def make_fused_vjp_rule(fun, argnum):
+        recomputing_vjp = make_vjp_rule(fun, argnum)
+        def vjp(g, ans, *args, **kwargs):
+            fused = None
+            if not isbox(g) and not any(map(isbox, args)):
+                fused = kernel(args, kwargs)
+            if fused is None or np.shape(g) != fused.shape:
+                # Nested, or batched cotangents (see jacobian()).
+                return recomputing_vjp(g, ans, *args, **kwargs)
+            return fused.vjp(argnum, g, args)
+        return vjp
+
+    primitive_vjps[fused_fun] = RecomputingRules(fun, make_fused_vjp_rule)
+    primitive_jvps[fused_fun] = RecomputingRules(fun, make_jvp_rule)
+    defbatch(fused_fun, lambda argnums, *args, **kwargs:
+             vmap(fun, argnums)(*args, **kwargs))
+    return fused_fun
+
+class RecomputingRules(dict):
+    """Lazily built vjps (or jvps) of a checkpointed function.
+
+    Maps argnum -> rule. A checkpointed function accepts any number of
+    arguments, so rules are made on first lookup.
+    """
+    def __init__(self, fun, make_rule):
+        self.fun = fun
+        self.make_rule = make_rule
+
+    def __missing__(self, argnum):
+        rule = self[argnum] = self.make_rule(self.fun, argnum)
+        return rule
+
+def make_vjp_rule(fun, argnum):
+    """Vjp of fun wrt its argnum-th argument that re-traces fun.
+
+    The backward pass asks for a node's vjps wrt each of its boxed arguments in
+    turn, with the same g, ans and args. fun is re-traced once for all of them
+    (see recomputed_vjps()).
+    """
+    def vjp(g, ans, *args, **kwargs):
+        vjps = recomputed_vjps(fun, argnum, g, ans, args, kwargs)
+        if argnum in vjps:
+            result = vjps.pop(argnum)
+            if not vjps:
+                recomputed.entry = None
+            return result
+        unary_fun = lambda x: fun(*subval(args, argnum, x), **kwargs)
+        return make_vjp(unary_fun, args[argnum])[0](g)
+    return vjp
+
+# Vjps of the node whose backward step is running on this thread, from a single
+# re-trace, as (fun, g, ans, args, kwargs, dict argnum -> vjp).
+recomputed = threading.local()
+
+def recomputed_vjps(fun, argnum, g, ans, args, kwargs):
+    """Vjps of fun(*args, **kwargs) = ans wrt all its arguments that can be
+    boxed, as a dict argnum -> vjp.
+
+    Kept until each has been asked for once, so that the vjps of a node wrt
+    several of its arguments re-trace fun only once. Re-traces if the argnum-th
+    one was already handed out (e.g. by an earlier backward pass over a
+    retained graph). Which arguments the node
+    depends on isn't known here, so gradients are also computed wrt arrays that
+    turn out to be constants.
+    """
+    entry = getattr(recomputed, 'entry', None)
+    if (entry is not None and argnum in entry[5] and entry[0] is fun
+            and entry[1] is g
+            and entry[2] is ans and len(entry[3]) == len(args)
+            and all(x is y for x, y in zip(entry[3], args))
+            and entry[4].keys() == kwargs.keys()
+            and all(entry[4][name] is kwargs[name] for name in kwargs)):
+        return entry[5]
+    recomputed.entry = None
+    argnums = [argnum for argnum, arg in enumerate(args)
+               if type(arg) in box_type_mappings]
+    multi_fun = lambda *xs: fun(*subvals(args, list(zip(argnums, xs))), **kwargs)
+    vjp, _ = make_multi_vjp(multi_fun, [args[argnum] for argnum in argnums])
+    vjps = dict(zip(argnums, vjp(g)))
+    recomputed.entry = (fun, g, ans, args, kwargs, vjps)
+    return vjps
+
+def make_jvp_rule(fun, argnum):
+    """Jvp of fun wrt its argnum-th argument that re-traces fun."""
+    def jvp(g, ans, *args, **kwargs):
+        unary_fun = lambda x: fun(*subval(args, argnum, x), **kwargs)
+        return make_jvp(unary_fun, args[argnum])(g)[1]
+    return jvp
@@ -0,0 +1,98 @@
+"""Flattening nested containers of arrays.
+
+Models keep their parameters in nested dicts, lists and tuples of arrays,
+while differentiation and most optimizers work best on a single array. With
+this library, one can,
+
+- Copy the leaves of a nested container into one contiguous array, and get
+  the container back as views of any array laid out like it. (flatten)
+- Tell containers from leaves. (is_container)
+
+make_vjp() and grad() use this to differentiate wrt a container: the function
+is traced wrt the flat array, every leaf being a slice of it, so the gradient
+is computed in one flat array too. To keep parameters flat throughout, e.g.
+for an optimizer that updates them with a single vectorized operation,
+
+```
+flat, unflatten = flatten(params)
+flat_grad = grad(lambda flat: loss(unflatten(flat), batch))(flat)
+flat -= step_size * flat_grad
+params = unflatten(flat)
+```
+"""
+import numpy as np
+
+from .tracer import isbox
+
+def is_container(value):
+    """True if 'value' is a tuple, list or dict, whose items are flattened."""
+    return isinstance(value, (tuple, list, dict))
+
+def flatten(value):
+    """Flattens a nested container of arrays.
+
+    Leaves are the values nested in tuples (including namedtuples), lists and
+    dicts that are none of these, e.g. arrays and scalars. They are raveled and
+    concatenated in order, dicts in their iteration order.
+
+    Args:
+      value: nested container of arrays, or a single array.
+
+    Returns:
+      flat: 1-D array of every entry of every leaf, as a floating point dtype
+        that can hold all of them.
+      unflatten: function. Takes an array shaped like flat, possibly with
+        leading axes (e.g. a batch of gradients) or boxed, and returns a
+        container like 'value' whose leaves are the matching slices of it,
+        with leading axes followed by the leaf's shape. These are views of the
+        array rather than copies.
+
+    Raises:
+      TypeError: if a leaf is boxed, i.e. being differentiated wrt.
+    """
+    leaves = []
+    structure = container_structure(value, leaves)
+    if any(isbox(leaf) for leaf in leaves):
+        raise TypeError("Can't flatten a container with traced values")
+    arrays = [np.ravel(leaf) for leaf in leaves]
+    flat = np.empty(sum(a.size for a in arrays), np.result_type(float, *arrays))
+    slices, start = [], 0
+    for leaf, a in zip(leaves, arrays):
+        flat[start:start + a.size] = a
+        slices.append((slice(start, start + a.size), np.shape(leaf)))
+        start += a.size
+
+    def unflatten(flat):
+        batch_shape = np.shape(flat)[:-1]
+        leaves = iter([flat[..., idx].reshape(batch_shape + shape)
+                       for idx, shape in slices])
+        return rebuild(structure, leaves)
+    return flat, unflatten
+
+def container_structure(value, leaves):
+    """Structure of a nested container, with its leaves appended to 'leaves'.
+
+    Returns None for a leaf, or (type, keys, structures of the items), keys
+    being None for sequences.
+    """
+    if isinstance(value, dict):
+        return (type(value), list(value),
+                [container_structure(value[key], leaves) for key in value])
+    if isinstance(value, (tuple, list)):
+        return (type(value), None,
+                [container_structure(item, leaves) for item in value])
+    leaves.append(value)
+    return None
+
+def rebuild(structure, leaves):
+    """Container of the given structure, with leaves taken from an iterator."""
+    if structure is None:
+        return next(leaves)
+    container_type, keys, structures = structure
+    items = [rebuild(s, leaves) for s in structures]
+    if keys is not None:
+        return container_type(zip(keys, items))
+    if hasattr(container_type, '_fields'):
+        # namedtuples take their items as separate arguments.
+        return container_type(*items)
+    return container_type(items)
@@ -0,0 +1,97 @@
+"""Jacobian-Vector Products, Forward Mode.
+
+Construct Jacobian-vector products of a computation by carrying a tangent along
+with every traced value. Unlike reverse mode, nothing is recorded: each node
+computes its tangent from its parents' tangents as soon as it is created. With
+this library, one can,
+
+- Construct Jacobian-vector product for any single-input function. (make_jvp)
+- Register Jacobian-vector product functions for any primitive function and
+  argument index. (defjvp)
+"""
+from collections import defaultdict
+from itertools import count
+import numpy as np
+
+from .tracer import trace, Node, getval
+from .core import add_outgrads
+
+def make_jvp(fun, x):
+    """Make function for Jacobian-vector product.
+
+    Args:
+      fun: single-arg function. Jacobian derived from this.
+      x: ndarray. Point to differentiate about.
+
+    Returns:
+      jvp: single-arg function. vector -> (fun(x), Jacobian[fun, x]-vector
+        product).
+    """
+    def jvp(g):
+        start_node = JVPNode.new_root(g)
+        end_value, end_node = trace(start_node, fun, x)
+        if end_node is None:
+            return end_value, np.zeros_like(getval(end_value))
+        else:
+            return end_value, end_node.g
+    return jvp
+
+class JVPNode(Node):
+    """A node carrying the tangent of its value.
+
+    JVPNodes don't keep their parents or recipe alive. A forward pass needs
+    nothing from a node once its children have been created.
+    """
+    __slots__ = ['g']
+
+    def __init__(self, value, fun, args, kwargs, parent_argnums, parents):
+        self.parents = ()
+        self.recipe = None
+        self.g = None
+        for argnum, parent in zip(parent_argnums, parents):
+            # Lookup Jacobian-vector product (tangent) function for this
+            # function/argument.
+            try:
+                jvp = primitive_jvps[fun][argnum]
+            except KeyError:
+                raise NotImplementedError(
+                    "JVP of {} wrt argnum {}".format(
+                        getattr(fun, '__name__', fun), argnum))
+            if jvp is None:
+                # Argument has no effect on the tangent, e.g. a condition.
+                continue
+
+            # Sum tangent contributions from all boxed arguments.
+            self.g = add_outgrads(self.g, jvp(parent.g, value, *args, **kwargs))
+        if self.g is None:
+            self.g = np.zeros_like(getval(value))
+
+    def initialize_root(self, g):
+        self.parents = ()
+        self.recipe = None
+        self.g = g
+
+primitive_jvps = defaultdict(dict)
+def defjvp(fun, *jvps, **kwargs):
+    """Register Jacobian-vector product functions.
+
+    Let fun(x, y, ...) = ans be a function. We wish to register a
+    Jacobian-vector product for each of fun's arguments. That is, functions
+
+      jvp_x(g, ans, x, y, ...) = df/dx g
+      jvp_y(g, ans, x, y, ...) = df/dy g
+      ...
+
+    where g is the tangent of the corresponding argument. This function
+    registers said callbacks. The tangent of ans is the sum of all arguments'
+    contributions.
+
+    Args:
+      fun: function for which one wants to define jvps for.
+      *jvps: functions. Jacobian-vector products. One per argument to fun().
+        None for arguments that don't affect the tangent.
+      **kwargs: additional keyword arugments. Only 'argnums' is used.
+    """
+    argnums = kwargs.get('argnums', count())
+    for argnum, jvp in zip(argnums, jvps):
+        primitive_jvps[fun][argnum] = jvp
@@ -0,0 +1,212 @@
+"""Fused elementwise kernels.
+
+Every wrapped ufunc allocates its result, so an elementwise expression like
+(1 - exp(-x)) / (1 + exp(-x)) writes and reads back a full-size temporary per
+ufunc. On large arrays its cost is memory traffic rather than arithmetic. This
+library records such an expression once (see autograd.tape) and evaluates it in
+blocks that fit in cache, every ufunc writing into a small buffer with out=. Its
+vjp recomputes each block and runs the backward pass of the whole expression on
+it. With this library, one can,
+
+- Record a function of arrays of one shape made of ufuncs as a kernel.
+  (record_kernel)
+- Evaluate a kernel and its vjps blockwise. (FusedKernel)
+
+Kernels take arrays of one shape, and scalars. The function may only apply
+ufuncs without keyword arguments to them, and to constants of the same shape
+or scalars. Like tapes, kernels are only valid if that sequence of ufuncs
+depends on nothing but the shapes and dtypes of the inputs.
+"""
+import numpy as np
+
+from .core import primitive_vjps, add_outgrads
+from .cotangents import SymbolicCotangent, densify
+from .tape import record_tape, NotCompilableError
+
+class NotFusibleError(Exception):
+    """Raised when a function can't be evaluated as a fused kernel."""
+
+def record_kernel(fun, args, kwargs, block_size):
+    """Record fun(*args, **kwargs) as a kernel.
+
+    fun is traced on a single element of each array argument, with as many
+    axes, so that recording costs nothing like an unfused evaluation.
+
+    Raises:
+      NotFusibleError: if fun isn't an elementwise function of its arguments.
+    """
+    probe_args = [np.reshape(np.ravel(arg)[:1], (1,) * np.ndim(arg))
+                  if type(arg) is np.ndarray and arg.size else arg
+                  for arg in args]
+    try:
+        tape, input_slots = record_tape(fun, probe_args, kwargs)
+    except NotCompilableError as e:
+        raise NotFusibleError(str(e))
+    return FusedKernel(tape, input_slots, args, block_size)
+
+class FusedKernel(object):
+    """An elementwise function recorded on a tape, evaluated in blocks.
+
+    Every slot of the tape holds either an array of the kernel's shape, which
+    is evaluated one block of its flattened elements at a time, or a scalar.
+    """
+    def __init__(self, tape, input_slots, args, block_size):
+        """
+
+        Args:
+          tape: Tape of the function.
+          input_slots: list with, for each positional argument, its input slot
+            or None if it was baked in.
+          args: tuple of positional arguments of the call being recorded.
+          block_size: int. Number of elements evaluated at a time.
+
+        Raises:
+          NotFusibleError: if the tape isn't an elementwise function.
+        """
+        if tape.end_slot is None:
+            raise NotFusibleError("Output doesn't depend on the input")
+        self.tape = tape
+        self.input_slots = input_slots
+        self.block_size = block_size
+
+        shapes = set(np.shape(arg) for arg in args if np.ndim(arg))
+        for entry in tape.entries:
+            if (type(entry.raw_fun) is not np.ufunc or entry.raw_fun.nout != 1
+                    or entry.kwargs):
+                raise NotFusibleError("{} is not an elementwise function"
+                                      .format(getattr(entry.raw_fun, '__name__',
+                                                      entry.raw_fun)))
+            shapes.update(np.shape(arg) for argnum, arg in enumerate(entry.args)
+                          if argnum not in entry.argnums and np.ndim(arg))
+        if len(shapes) != 1:
+            raise NotFusibleError("Values of shapes {} broadcast".format(
+                sorted(shapes)))
+        self.shape = shapes.pop()
+        self.size = int(np.prod(self.shape))
+
+        # Which slots hold arrays, and the constant arrays of each entry, as
+        # argnum -> flattened array.
+        self.full = [False] * tape.num_slots
+        for arg, slot in zip(args, input_slots):
+            if slot is not None:
+                self.full[slot] = np.ndim(arg) > 0
+        self.constants = []
+        for entry in tape.entries:
+            constants = dict((argnum, np.ravel(arg))
+                             for argnum, arg in enumerate(entry.args)
+                             if argnum not in entry.argnums and np.ndim(arg))
+            self.constants.append(constants)
+            self.full[entry.out_slot] = bool(constants) or any(
+                self.full[slot] for slot in entry.parent_slots)
+        if not self.full[tape.end_slot]:
+            raise NotFusibleError("Output is a scalar")
+
+        # Evaluate one element for the dtype of every slot.
+        values, _ = self.evaluate(self.flat_inputs(args), 0, 1)
+        self.dtypes = [np.result_type(value) for value in values]
+
+    def flat_inputs(self, args):
+        """Input slot values of a call, with arrays flattened."""
+        inputs = [None] * self.tape.num_inputs
+        for arg, slot in zip(args, self.input_slots):
+            if slot is not None:
+                inputs[slot] = np.ravel(arg) if self.full[slot] else arg
+        return inputs
+
+    def new_buffers(self):
+        """A block-sized buffer for every entry whose output is an array."""
+        return [np.empty(self.block_size, self.dtypes[entry.out_slot])
+                if self.full[entry.out_slot] else None
+                for entry in self.tape.entries]
+
+    def blocks(self):
+        for start in range(0, self.size, self.block_size):
+            yield start, min(start + self.block_size, self.size)
+
+    def evaluate(self, inputs, start, stop, buffers=None, out=None):
+        """Values of every slot for the flattened elements start:stop.
+
+        Args:
+          inputs: list of input slot values, as returned by flat_inputs().
+          start, stop: int. Block of elements.
+          buffers: list of buffers, as returned by new_buffers(), or None to
+            allocate every value.
+          out: array to write the output's block to, or None to use buffers.
+
+        Returns:
+          values: list of values, one per slot.
+          entry_args: list of positional args each entry was applied to.
+        """
+        tape, full = self.tape, self.full
+        values = [x[start:stop] if full[slot] else x
+                  for slot, x in enumerate(inputs)]
+        values += [None] * (tape.num_slots - tape.num_inputs)
+        entry_args = []
+        for i, entry in enumerate(tape.entries):
+            args = list(entry.args)
+            for argnum, x in self.constants[i].items():
+                args[argnum] = x[start:stop]
+            for argnum, slot in zip(entry.argnums, entry.parent_slots):
+                args[argnum] = values[slot]
+            if out is not None and entry.out_slot == tape.end_slot:
+                values[entry.out_slot] = entry.raw_fun(*args, out=out)
+            elif buffers is not None and full[entry.out_slot]:
+                values[entry.out_slot] = entry.raw_fun(
+                    *args, out=buffers[i][:stop - start])
+            else:
+                values[entry.out_slot] = entry.raw_fun(*args)
+            entry_args.append(args)
+        return values, entry_args
+
+    def forward(self, args):
+        """Value of the function at args."""
+        inputs, buffers = self.flat_inputs(args), self.new_buffers()
+        result = np.empty(self.size, self.dtypes[self.tape.end_slot])
+        for start, stop in self.blocks():
+            self.evaluate(inputs, start, stop, buffers, result[start:stop])
+        return result.reshape(self.shape)
+
+    def vjp(self, argnum, g, args):
+        """Vector-Jacobian product of the function wrt its argnum-th argument.
+
+        Each block is evaluated again, then differentiated with the vjps of its
+        primitives, applied to block-sized values.
+        """
+        tape = self.tape
+        input_slot = self.input_slots[argnum]
+        requires = tape.requires_grad(input_slot)
+        inputs, buffers = self.flat_inputs(args), self.new_buffers()
+        if not isinstance(g, SymbolicCotangent):
+            g = np.ravel(g)
+        result = None
+        for start, stop in self.blocks():
+            values, entry_args = self.evaluate(inputs, start, stop, buffers)
+            outgrads = [None] * tape.num_slots
+            outgrads[tape.end_slot] = (type(g)((stop - start,), g.dtype)
+                                       if isinstance(g, SymbolicCotangent)
+                                       else g[start:stop])
+            for entry, entry_arg in zip(reversed(tape.entries),
+                                        reversed(entry_args)):
+                outgrad = outgrads[entry.out_slot]
+                if outgrad is None:
+                    continue
+                outgrads[entry.out_slot] = None
+                ans = values[entry.out_slot]
+                for parent_argnum, slot in zip(entry.argnums, entry.parent_slots):
+                    if not requires[slot]:
+                        continue
+                    vjp = primitive_vjps[entry.fun][parent_argnum]
+                    parent_grad = vjp(outgrad, ans, *entry_arg, **entry.kwargs)
+                    outgrads[slot] = add_outgrads(outgrads[slot], parent_grad)
+            block_grad = densify(outgrads[input_slot])
+            if block_grad is None:
+                continue
+            if not self.full[input_slot]:
+                result = block_grad if result is None else result + block_grad
+                continue
+            if result is None:
+                result = np.zeros(self.size, np.result_type(block_grad))
+            result[start:stop] = block_grad
+        if result is None:
+            return np.zeros_like(args[argnum])
+        return result.reshape(self.shape) if self.full[input_slot] else result
@@ -0,0 +1,120 @@
+"""Simplification of computation graphs.
+
+The graph recorded by trace() mirrors the user's code exactly: evaluating the
+same subexpression twice records it twice, and the backward pass pays for each
+copy. This library rewrites a recorded graph before its backward pass. With this
+library, one can,
+
+- Merge nodes that compute the same value. (common subexpression elimination)
+- Drop nodes and edges that can't carry gradient to the start node. (dead node
+  pruning)
+- Do both, and report how much work was saved. (optimize_graph)
+
+Both rewrites assume primitives are pure functions of their arguments.
+"""
+from collections import namedtuple
+
+from .core import primitive_vjps
+from .util import toposort
+
+OptimizationStats = namedtuple('OptimizationStats', [
+    'nodes_before', 'nodes_after', 'vjp_calls_before', 'vjp_calls_after'])
+
+def optimize_graph(start_node, end_node):
+    """Simplify the graph between start_node and end_node in place.
+
+    Args:
+      start_node: root Node. Gradients are wanted wrt its value.
+      end_node: Node whose value is differentiated.
+
+    Returns:
+      end_node: Node. End of the simplified graph. None if no gradient can reach
+        start_node.
+      stats: OptimizationStats.
+    """
+    nodes_before, vjp_calls_before = graph_size(end_node)
+    end_node = eliminate_common_subexpressions(end_node)
+    end_node = prune_dead_nodes(start_node, end_node)
+    if end_node is None:
+        nodes_after, vjp_calls_after = 0, 0
+    else:
+        nodes_after, vjp_calls_after = graph_size(end_node)
+    stats = OptimizationStats(nodes_before, nodes_after,
+                              vjp_calls_before, vjp_calls_after)
+    return end_node, stats
+
+def graph_size(end_node):
+    """Count nodes and vjp calls in the backward pass from end_node."""
+    num_nodes, num_vjp_calls = 0, 0
+    for node in toposort(end_node):
+        num_nodes += 1
+        num_vjp_calls += len(node.parents)
+    return num_nodes, num_vjp_calls
+
+def eliminate_common_subexpressions(end_node):
+    """Merge nodes that apply the same function to the same arguments.
+
+    Two nodes are the same if they have the same function, the same parents in
+    the same argument positions, and the same constant arguments. Nodes are
+    visited parents-first, so duplicates of duplicates are found too. Children
+    of a merged node are pointed at the node it was merged into.
+
+    Returns:
+      End node of the rewritten graph.
+    """
+    canonical = {}  # Node -> Node it was merged into, or itself.
+    seen = {}       # key -> Node
+    for node in reversed(list(toposort(end_node))):
+        node.parents = tuple(canonical[parent] for parent in node.parents)
+        fun, _, args, kwargs, argnums = node.recipe
+        key = (fun, tuple(argnums), node.parents,
+               tuple(constant_key(arg) for argnum, arg in enumerate(args)
+                     if argnum not in argnums),
+               tuple(sorted((name, constant_key(value))
+                            for name, value in kwargs.items())))
+        canonical[node] = seen.setdefault(key, node)
+    return canonical[end_node]
+
+def constant_key(x):
+    """Hashable key that is equal for two constants only if they are equal."""
+    if isinstance(x, float):
+        # Tell 0.0 from -0.0.
+        return (type(x), repr(x))
+    try:
+        hash(x)
+    except TypeError:
+        # Arrays and other mutable values are only equal to themselves. The
+        # graph keeps them alive, so their ids are unique.
+        return ('id', id(x))
+    return (type(x), x)
+
+def prune_dead_nodes(start_node, end_node):
+    """Remove nodes and edges that can't carry gradient to start_node.
+
+    An edge is dead if it has no vjp (its vjp was registered as None, like the
+    condition of anp.where). A node is dead if no path of live edges leads from
+    it to start_node.
+
+    Returns:
+      End node of the rewritten graph, or None if it is dead itself.
+    """
+    live = {}
+    for node in reversed(list(toposort(end_node))):
+        fun, value, args, kwargs, argnums = node.recipe
+        live_edges = [(argnum, parent)
+                      for argnum, parent in zip(argnums, node.parents)
+                      if live[parent] and has_vjp(fun, argnum)]
+        live[node] = node is start_node or bool(live_edges)
+        if len(live_edges) < len(node.parents):
+            node.parents = tuple(parent for _, parent in live_edges)
+            node.recipe = (fun, value, args, kwargs,
+                           tuple(argnum for argnum, _ in live_edges))
+    return end_node if live[end_node] else None
+
+def has_vjp(fun, argnum):
+    """False if fun has been declared non-differentiable wrt argnum."""
+    try:
+        return primitive_vjps[fun][argnum] is not None
+    except KeyError:
+        # Leave it to the backward pass to report the missing vjp.
+        return True
@@ -1,4 +1,28 @@
 from __future__ import absolute_import
+import importlib
 from .numpy_wrapper import *
+from . import numpy_wrapper
 from . import numpy_boxes
 from . import numpy_vjps
+from . import numpy_jvps
+from . import numpy_batching
+from . import numpy_taylor
+
+# Wrapped versions of numpy's submodules.
+submodules = {'linalg', 'fft'}
+
+def __getattr__(name):
+    # Functions of numpy_wrapper are wrapped on first access.
+    if name in submodules:
+        return importlib.import_module('.' + name, __name__)
+    if name == '__all__':
+        return [name for name in dir(numpy_wrapper) if not name.startswith('_')]
+    try:
+        value = getattr(numpy_wrapper, name)
+    except AttributeError:
+        raise AttributeError("module {!r} has no attribute {!r}".format(
+            __name__, name))
+    return globals().setdefault(name, value)
+
+def __dir__():
+    return sorted(set(globals()) | set(dir(numpy_wrapper)) | submodules)
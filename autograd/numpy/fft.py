@@ -0,0 +1,10 @@
+"""Wrapped numpy.fft functions.
+
+Like those of autograd.numpy, they are wrapped on first access. None of them
+has a registered vector-Jacobian product yet.
+"""
+from __future__ import absolute_import
+import numpy.fft as _npfft
+from .numpy_wrapper import lazy_namespace
+
+__getattr__, __dir__ = lazy_namespace(_npfft, globals())
@@ -0,0 +1,145 @@
+"""Batching rules for NumPy functions.
+
+This library consists of batching rules (see autograd.batching) for functions
+implemented in numpy. Batched arguments have a leading batch axis, and so do
+the results. Functions without a rule here are batched by looping over the
+examples.
+"""
+from __future__ import absolute_import
+import numpy as onp
+from . import numpy_wrapper as anp
+from .numpy_boxes import ArrayBox
+from .numpy_vjps import batch_index, take_index
+from autograd.batching import defbatch, defbatch_lazily, batch_by_loop
+from autograd.cotangents import untake
+from autograd.util import subvals
+
+# ----- Elementwise functions -----
+
+def expand_example(x, ndim):
+    """Give a batched value's examples 'ndim' dimensions by inserting axes after
+    the batch axis. Lines examples up with unbatched arguments the way numpy's
+    broadcasting would for a single example."""
+    shape = anp.shape(x)
+    if len(shape) - 1 >= ndim:
+        return x
+    return anp.reshape(x, shape[:1] + (1,) * (ndim - len(shape) + 1) + shape[1:])
+
+def elementwise(fun):
+    """Batching rule for a function that broadcasts its arguments."""
+    def rule(argnums, *args, **kwargs):
+        ndim = max(anp.ndim(arg) - (argnum in argnums)
+                   for argnum, arg in enumerate(args))
+        return fun(*subvals(args, [(argnum, expand_example(args[argnum], ndim))
+                                   for argnum in argnums]), **kwargs)
+    return rule
+
+def elementwise_ufunc(fun):
+    """Whether fun wraps a ufunc, differentiable or not (comparisons, floor(),
+    etc.), other than a generalized ufunc like matmul()."""
+    raw_fun = getattr(fun, 'fun', None)
+    return type(raw_fun) is onp.ufunc and raw_fun.signature is None
+
+# autograd.numpy wraps ufuncs on first access, so they can't be listed here.
+defbatch_lazily(elementwise_ufunc, elementwise)
+
+defbatch(anp.where, elementwise(anp.where))
+
+# ----- Shape functions -----
+
+def example_axis(axis, ndim):
+    """Position of an example's axis in a batched value."""
+    return axis % ndim + 1
+
+def _sum_batch(argnums, x, axis=None, *args, **kwargs):
+    ndim = anp.ndim(x) - 1
+    if axis is None:
+        axis = tuple(range(1, ndim + 1))
+    elif isinstance(axis, (tuple, list)):
+        axis = tuple(example_axis(a, ndim) for a in axis)
+    else:
+        axis = example_axis(axis, ndim)
+    return anp.sum(x, axis, *args, **kwargs)
+
+def _transpose_batch(argnums, x, axes=None):
+    ndim = anp.ndim(x) - 1
+    if axes is None:
+        axes = reversed(range(ndim))
+    return anp.transpose(x, (0,) + tuple(example_axis(a, ndim) for a in axes))
+
+def _reshape_batch(argnums, x, shape, order='C'):
+    if isinstance(shape, int):
+        shape = (shape,)
+    return anp.reshape(x, anp.shape(x)[:1] + tuple(shape), order=order)
+
+defbatch(anp.sum, _sum_batch)
+defbatch(anp.transpose, _transpose_batch)
+defbatch(anp.reshape, _reshape_batch)
+
+# ----- Indexing -----
+
+# Indices computed from traced values (e.g. by argmax()) differ per example.
+# Those calls are looped over.
+
+def _getitem_batch(argnums, A, idx):
+    if argnums != (0,):
+        return batch_by_loop(ArrayBox.__getitem__)(argnums, A, idx)
+    return A[batch_index(idx, 1)]
+
+def _take_batch(argnums, a, indices, axis=None, out=None, mode='raise'):
+    if argnums != (0,):
+        return batch_by_loop(anp.take)(argnums, a, indices, axis=axis,
+                                       mode=mode)
+    return a[batch_index(take_index(anp.shape(a)[1:], indices, axis, mode), 1)]
+
+def _untake_batch(argnums, x, idx, shape, dtype):
+    return untake(x, batch_index(idx, 1), anp.shape(x)[:1] + tuple(shape), dtype)
+
+defbatch(ArrayBox.__getitem__, _getitem_batch)
+defbatch(anp.take, _take_batch)
+defbatch(untake, _untake_batch)
+
+# ----- Products -----
+
+def move_to_front(x, axis):
+    """Move an axis of x to the front."""
+    axes = list(range(anp.ndim(x)))
+    axes.insert(0, axes.pop(axis))
+    return anp.transpose(x, tuple(axes))
+
+def _dot_batch(argnums, lhs, rhs):
+    lhs_ndim = anp.ndim(lhs) - (0 in argnums)
+    rhs_ndim = anp.ndim(rhs) - (1 in argnums)
+    if lhs_ndim == 0 or rhs_ndim == 0:
+        # dot() with a scalar multiplies.
+        return elementwise(anp.multiply)(argnums, lhs, rhs)
+    if argnums == (0,):
+        # dot() contracts the last axis of lhs, leaving its batch axis first.
+        return anp.dot(lhs, rhs)
+    if argnums == (1,):
+        # The batch axis of rhs ends up after lhs's remaining axes.
+        if rhs_ndim == 1:
+            return move_to_front(anp.dot(lhs, anp.transpose(rhs)), -1)
+        return move_to_front(anp.dot(lhs, rhs), lhs_ndim - 1)
+    if lhs_ndim <= 2 and rhs_ndim <= 2:
+        # Batched matrix products, with vectors as 1-row or 1-column matrices.
+        batch_size = anp.shape(lhs)[0]
+        out_shape = anp.shape(lhs)[1:-1] + anp.shape(rhs)[2:]
+        lhs = expand_example(lhs, 2)
+        if rhs_ndim == 1:
+            rhs = anp.reshape(rhs, anp.shape(rhs) + (1,))
+        return anp.reshape(anp.matmul(lhs, rhs), (batch_size,) + out_shape)
+    return batch_by_loop(anp.dot)(argnums, lhs, rhs)
+
+def _matmul_batch(argnums, lhs, rhs):
+    ndims = [anp.ndim(arg) - (argnum in argnums)
+             for argnum, arg in enumerate([lhs, rhs])]
+    if min(ndims) < 2:
+        return batch_by_loop(anp.matmul)(argnums, lhs, rhs)
+    # Line up the leading (stacked matrix) axes of all arguments.
+    ndim = max(ndims)
+    return anp.matmul(*subvals((lhs, rhs), [
+        (argnum, expand_example((lhs, rhs)[argnum], ndim)) for argnum in argnums]))
+
+defbatch(anp.dot, _dot_batch)
+defbatch(anp.matmul, _matmul_batch)
@@ -6,7 +6,7 @@ to ensure all transformations of an np.ndarray are traced.
 """
 from __future__ import absolute_import
 import numpy as np
-from autograd.tracer import Box, primitive
+from autograd.tracer import Box, binary_primitive
 from . import numpy_wrapper as anp
 
 Box.__array_priority__ = 90.0
@@ -24,7 +24,7 @@ class ArrayBox(Box):
     # multiple possibilities. Larger numbers == higher priority.
     __array_priority__ = 100.0
 
-    @primitive
+    @binary_primitive
     def __getitem__(A, idx): return A[idx]
 
     # Constants w.r.t float data just pass though
@@ -34,17 +34,28 @@ class ArrayBox(Box):
     dtype = property(lambda self: self._value.dtype)
     T = property(lambda self: anp.transpose(self))
     def __len__(self): return len(self._value)
+    # To numpy, a box is a single object. Without this, np.asarray() treats it
+    # as a sequence and unpacks it into an array of boxed elements. Products
+    # with constant scipy.sparse matrices rely on this: S @ box gets a 0-d
+    # object array from np.asanyarray(box), so scipy returns NotImplemented and
+    # __rmatmul__ below is called.
+    def __array__(self, dtype=None):
+        result = np.empty((), object)
+        result[()] = self
+        return result
     def astype(self, *args, **kwargs): return anp._astype(self, *args, **kwargs)
 
-    def __neg__(self): return anp.negative(self)
-    def __add__(self, other): return anp.add(     self, other)
-    def __sub__(self, other): return anp.subtract(self, other)
-    def __mul__(self, other): return anp.multiply(self, other)
-    def __pow__(self, other): return anp.power   (self, other)
-    def __div__(self, other): return anp.divide(  self, other)
-    def __mod__(self, other): return anp.mod(     self, other)
-    def __truediv__(self, other): return anp.true_divide(self, other)
-    def __matmul__(self, other): return anp.matmul(self, other)
+    # Operators whose first argument is the box itself are the wrapped
+    # functions themselves, saving a Python call per operation.
+    __neg__ = anp.negative
+    __add__ = anp.add
+    __sub__ = anp.subtract
+    __mul__ = anp.multiply
+    __pow__ = anp.power
+    __div__ = anp.divide
+    __mod__ = anp.mod
+    __truediv__ = anp.true_divide
+    __matmul__ = anp.matmul
     def __radd__(self, other): return anp.add(     other, self)
     def __rsub__(self, other): return anp.subtract(other, self)
     def __rmul__(self, other): return anp.multiply(other, self)
@@ -53,13 +64,13 @@ class ArrayBox(Box):
     def __rmod__(self, other): return anp.mod(     other, self)
     def __rtruediv__(self, other): return anp.true_divide(other, self)
     def __rmatmul__(self, other): return anp.matmul(other, self)
-    def __eq__(self, other): return anp.equal(self, other)
-    def __ne__(self, other): return anp.not_equal(self, other)
-    def __gt__(self, other): return anp.greater(self, other)
-    def __ge__(self, other): return anp.greater_equal(self, other)
-    def __lt__(self, other): return anp.less(self, other)
-    def __le__(self, other): return anp.less_equal(self, other)
-    def __abs__(self): return anp.abs(self)
+    __eq__ = anp.equal
+    __ne__ = anp.not_equal
+    __gt__ = anp.greater
+    __ge__ = anp.greater_equal
+    __lt__ = anp.less
+    __le__ = anp.less_equal
+    __abs__ = anp.abs
     def __hash__(self): return id(self)
 
 # Register ArrayBox as the type to use when boxing np.ndarray and scalar values.
@@ -67,6 +78,11 @@ ArrayBox.register(np.ndarray)
 for type_ in [float, np.float64, np.float32, np.float16,
               complex, np.complex64, np.complex128]:
     ArrayBox.register(type_)
+# Non-differentiable functions return these. Batching traces box their results
+# (see autograd.batching).
+for type_ in [np.bool_, np.int64, np.int32, np.int16, np.int8,
+              np.uint64, np.uint32, np.uint16, np.uint8]:
+    ArrayBox.register(type_)
 
 # Set ArrayBox.<method name> = autograd.numpy.<function_name>
 nondiff_methods = [
@@ -103,8 +119,30 @@ diff_methods = [
     'transpose',
     'var']
 for method_name in nondiff_methods + diff_methods:
-    setattr(ArrayBox, method_name, anp.__dict__[method_name])
+    setattr(ArrayBox, method_name, getattr(anp, method_name))
 
 # Flatten has no function, only a method.
-setattr(ArrayBox, 'flatten', anp.__dict__['ravel'])
+setattr(ArrayBox, 'flatten', anp.ravel)
+
+
+class SparseBox(Box):
+    """Box for scipy.sparse matrices and arrays.
+
+    Sparse matrices are multiplied with dense arrays by anp.dot(), anp.matmul()
+    and @. Their cotangents are sparse, with the nonzero pattern of the matrix.
+    """
+    __slots__ = []
+
+    shape = property(lambda self: self._value.shape)
+    ndim  = property(lambda self: self._value.ndim)
+    nnz   = property(lambda self: self._value.nnz)
+    dtype = property(lambda self: self._value.dtype)
+    T = property(lambda self: anp.transpose(self))
+    def transpose(self, axes=None): return anp.transpose(self, axes)
+    def dot(self, other): return anp.dot(self, other)
+    __matmul__ = anp.matmul
+    def __rmatmul__(self, other): return anp.matmul(other, self)
+    def __hash__(self): return id(self)
 
+# scipy.sparse is only imported by code that uses it.
+SparseBox.register_lazily(anp.sparse_type)
@@ -0,0 +1,90 @@
+"""Jacobian-vector products for NumPy functions.
+
+This library consists of implementations of Jacobian-vector products (jvps,
+tangents) for functions implemented in numpy. Each function-argument index pair
+is provided a tangent function registered with defjvp(). It mirrors
+numpy_vjps.py.
+"""
+from __future__ import absolute_import
+from . import numpy_wrapper as anp
+from .numpy_boxes import ArrayBox
+from .numpy_vjps import replace_zero
+from autograd.forward_mode import defjvp
+from autograd.cotangents import untake
+from autograd.util import subvals
+
+# ----- Binary ufuncs -----
+
+defjvp(anp.add,         lambda g, ans, x, y : broadcast(g, ans),
+                        lambda g, ans, x, y : broadcast(g, ans))
+defjvp(anp.multiply,    lambda g, ans, x, y : broadcast(y * g, ans),
+                        lambda g, ans, x, y : broadcast(x * g, ans))
+defjvp(anp.subtract,    lambda g, ans, x, y : broadcast(g, ans),
+                        lambda g, ans, x, y : broadcast(-g, ans))
+defjvp(anp.divide,      lambda g, ans, x, y : broadcast(  g / y, ans),
+                        lambda g, ans, x, y : broadcast(- g * x / y**2, ans))
+defjvp(anp.true_divide, lambda g, ans, x, y : broadcast(  g / y, ans),
+                        lambda g, ans, x, y : broadcast(- g * x / y**2, ans))
+defjvp(anp.power,
+    lambda g, ans, x, y: broadcast(g * y * x ** anp.where(y, y - 1, 1.), ans),
+    lambda g, ans, x, y: broadcast(g * anp.log(replace_zero(x, 1.)) * x ** y, ans))
+
+def broadcast(g, target):
+    """Broadcast a tangent to the shape of 'target'.
+
+    The counterpart of unbroadcast(). A tangent contribution from an argument
+    that was broadcast against others must be cloned along the broadcasted
+    dimensions.
+    """
+    if anp.shape(g) == anp.shape(target):
+        return g
+    return g + anp.zeros(anp.shape(target), anp.result_type(target))
+
+# ----- Simple jvps -----
+
+defjvp(anp.negative, lambda g, ans, x: -g)
+defjvp(anp.exp,    lambda g, ans, x: ans * g)
+defjvp(anp.log,    lambda g, ans, x: g / x)
+defjvp(anp.tanh,   lambda g, ans, x: g / anp.cosh(x) **2)
+defjvp(anp.sinh,   lambda g, ans, x: g * anp.cosh(x))
+defjvp(anp.cosh,   lambda g, ans, x: g * anp.sinh(x))
+
+defjvp(anp.where, None,
+       lambda g, ans, c, x=None, y=None:
+           anp.where(c, broadcast(g, ans), anp.zeros(anp.shape(ans))),
+       lambda g, ans, c, x=None, y=None:
+           anp.where(c, anp.zeros(anp.shape(ans)), broadcast(g, ans)))
+
+defjvp(anp.reshape, lambda g, ans, x, shape, order=None:
+       anp.reshape(g, anp.shape(ans), order=order))
+
+# sum() and transpose() are linear.
+defjvp(anp.sum, lambda g, ans, x, *args, **kwargs: anp.sum(g, *args, **kwargs))
+defjvp(anp.transpose, lambda g, ans, x, axes=None: anp.transpose(g, axes))
+
+# ----- Indexing jvps -----
+
+defjvp(ArrayBox.__getitem__, lambda g, ans, A, idx: g[idx])
+defjvp(anp.take, lambda g, ans, a, indices, axis=None, out=None, mode='raise':
+       anp.take(g, indices, axis=axis, mode=mode))
+defjvp(untake, lambda g, ans, x, idx, shape, dtype:
+       untake(g, idx, shape, dtype))
+
+# ----- Dot jvps -----
+
+# dot(), matmul() and tensordot() are linear in each argument.
+defjvp(anp.dot,    lambda g, ans, lhs, rhs: anp.dot(g, rhs),
+                   lambda g, ans, lhs, rhs: anp.dot(lhs, g))
+defjvp(anp.matmul, lambda g, ans, lhs, rhs: anp.matmul(g, rhs),
+                   lambda g, ans, lhs, rhs: anp.matmul(lhs, g))
+defjvp(anp.tensordot, lambda g, ans, a, b, axes=2: anp.tensordot(g, b, axes),
+                      lambda g, ans, a, b, axes=2: anp.tensordot(a, g, axes))
+
+# einsum() is linear in each operand: replace it with its tangent.
+def _einsum_jvp(argnum):
+    return lambda g, ans, *args, **kwargs: anp.einsum(
+        *subvals(args, [(argnum, g)]), **kwargs)
+
+# numpy.einsum() takes up to 32 operands, after the subscripts.
+for argnum in range(1, 33):
+    defjvp(anp.einsum, _einsum_jvp(argnum), argnums=[argnum])
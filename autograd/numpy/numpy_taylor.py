@@ -0,0 +1,229 @@
+"""Taylor series propagation rules for NumPy functions.
+
+This library consists of Taylor series rules (see autograd.taylor_mode) for
+functions implemented in numpy. Series are lists of coefficients [x_0, ...,
+x_k], with None for coefficients that are zero. Nonlinear functions use the
+usual recurrences, which follow from their differential equations (e.g. y' =
+y x' for y = exp(x)) and cost O(k^2) operations each.
+"""
+from __future__ import absolute_import
+from . import numpy_wrapper as anp
+from .numpy_boxes import ArrayBox
+from .numpy_jvps import broadcast
+from autograd.taylor_mode import deftaylor
+from autograd.cotangents import untake
+
+# ----- Coefficient arithmetic -----
+
+def mul(a, b):
+    if a is None or b is None:
+        return None
+    return a * b
+
+def add(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return a + b
+
+def total(terms):
+    """Sum of the terms that aren't None, or None."""
+    result = None
+    for term in terms:
+        result = add(result, term)
+    return result
+
+def scale(a, c):
+    return None if a is None else a * c
+
+def convolve(xs, zs, j, product=mul):
+    """Coefficient j of the product of two series."""
+    return total(product(xs[i], zs[j - i]) for i in range(j + 1))
+
+def elementwise(series_fun):
+    """Rule of an elementwise function from a function of coefficient lists.
+
+    Broadcasts coefficients to the shape of the result, since an argument's
+    coefficients may have fewer dimensions than the result.
+    """
+    def rule(ans, series, *args, **kwargs):
+        ys = series_fun(ans, *series)
+        return [None if y is None else broadcast(y, ans) for y in ys[1:]]
+    return rule
+
+# ----- Series of elementwise functions -----
+
+# Each takes the value of the result and the full series of the arguments, and
+# returns the full series of the result.
+
+def add_series(ans, xs, zs):
+    return [ans] + [add(x, z) for x, z in zip(xs[1:], zs[1:])]
+
+def subtract_series(ans, xs, zs):
+    return [ans] + [add(x, scale(z, -1)) for x, z in zip(xs[1:], zs[1:])]
+
+def negative_series(ans, xs):
+    return [ans] + [scale(x, -1) for x in xs[1:]]
+
+def multiply_series(ans, xs, zs):
+    return [ans] + [convolve(xs, zs, j) for j in range(1, len(xs))]
+
+def divide_series(ans, xs, zs):
+    # z y = x, so x_j = sum_i z_i y_(j-i).
+    ys = [ans]
+    for j in range(1, len(xs)):
+        rest = total(mul(zs[i], ys[j - i]) for i in range(1, j + 1))
+        ys.append(None if xs[j] is None and rest is None
+                  else add(xs[j], scale(rest, -1)) / zs[0])
+    return ys
+
+def exp_series(ans, xs):
+    # y' = y x'
+    ys = [ans]
+    for j in range(1, len(xs)):
+        ys.append(scale(total(scale(mul(xs[i], ys[j - i]), i)
+                              for i in range(1, j + 1)), 1. / j))
+    return ys
+
+def log_series(ans, xs):
+    # x y' = x', so j x_0 y_j = j x_j - sum_(0<i<j) i y_i x_(j-i).
+    ys = [ans]
+    for j in range(1, len(xs)):
+        rest = total(scale(mul(ys[i], xs[j - i]), i) for i in range(1, j))
+        y = add(xs[j], scale(rest, -1. / j))
+        ys.append(None if y is None else y / xs[0])
+    return ys
+
+def sinh_cosh_series(sinh_ans, cosh_ans, xs):
+    # sinh' = cosh x', cosh' = sinh x'
+    ss, cs = [sinh_ans], [cosh_ans]
+    for j in range(1, len(xs)):
+        ss.append(scale(total(scale(mul(xs[i], cs[j - i]), i)
+                              for i in range(1, j + 1)), 1. / j))
+        cs.append(scale(total(scale(mul(xs[i], ss[j - i]), i)
+                              for i in range(1, j + 1)), 1. / j))
+    return ss, cs
+
+def tanh_series(ans, xs):
+    # y' = u x' with u = 1 - y^2.
+    ys, us = [ans], [1. - ans ** 2]
+    for j in range(1, len(xs)):
+        ys.append(scale(total(scale(mul(xs[i], us[j - i]), i)
+                              for i in range(1, j + 1)), 1. / j))
+        us.append(scale(convolve(ys, ys, j), -1))
+    return ys
+
+def power_series(ans, xs, ps):
+    if any(p is not None for p in ps[1:]):
+        # Traced exponent: x^p = exp(p log(x)).
+        logs = log_series(anp.log(xs[0]), xs)
+        return exp_series(ans, multiply_series(logs[0] * ps[0], logs, ps))
+    p = ps[0]
+    if anp.ndim(p) == 0 and p >= 0 and p == int(p):
+        # Repeated squaring, which unlike the recurrence below is fine at x = 0.
+        return integer_power_series(ans, xs, int(p))
+    # x y' = p y x', so j x_0 y_j = sum_(0<i<=j) (p i - (j - i)) x_i y_(j-i).
+    ys = [ans]
+    for j in range(1, len(xs)):
+        y = total(scale(mul(xs[i], ys[j - i]), p * i - (j - i))
+                  for i in range(1, j + 1))
+        ys.append(None if y is None else y / (j * xs[0]))
+    return ys
+
+def integer_power_series(ans, xs, n):
+    result, square = None, xs
+    while n:
+        if n & 1:
+            result = square if result is None else multiply_series(
+                result[0] * square[0], result, square)
+        n >>= 1
+        if n:
+            square = multiply_series(square[0] * square[0], square, square)
+    if result is None:
+        # x^0 is constant.
+        return [ans] + [None] * (len(xs) - 1)
+    return [ans] + result[1:]
+
+deftaylor(anp.add,         elementwise(add_series))
+deftaylor(anp.subtract,    elementwise(subtract_series))
+deftaylor(anp.negative,    elementwise(negative_series))
+deftaylor(anp.multiply,    elementwise(multiply_series))
+deftaylor(anp.divide,      elementwise(divide_series))
+deftaylor(anp.true_divide, elementwise(divide_series))
+deftaylor(anp.power,       elementwise(power_series))
+deftaylor(anp.exp,         elementwise(exp_series))
+deftaylor(anp.log,         elementwise(log_series))
+deftaylor(anp.tanh,        elementwise(tanh_series))
+deftaylor(anp.sinh, elementwise(
+    lambda ans, xs: sinh_cosh_series(ans, anp.cosh(xs[0]), xs)[0]))
+deftaylor(anp.cosh, elementwise(
+    lambda ans, xs: sinh_cosh_series(anp.sinh(xs[0]), ans, xs)[1]))
+
+def _where_taylor(ans, series, c, x=None, y=None):
+    return [None if xj is None and yj is None
+            else broadcast(anp.where(c, 0. if xj is None else xj,
+                                        0. if yj is None else yj), ans)
+            for xj, yj in zip(series[1][1:], series[2][1:])]
+
+deftaylor(anp.where, _where_taylor)
+
+# ----- Linear functions -----
+
+def linear(fun):
+    """Rule of a function that is linear in its first argument."""
+    def rule(ans, series, x, *args, **kwargs):
+        return [None if xj is None else fun(xj, *args, **kwargs)
+                for xj in series[0][1:]]
+    return rule
+
+deftaylor(anp.reshape, linear(anp.reshape))
+deftaylor(anp.sum, linear(anp.sum))
+deftaylor(anp.transpose, linear(anp.transpose))
+deftaylor(ArrayBox.__getitem__, linear(lambda x, idx: x[idx]))
+deftaylor(anp.take, linear(anp.take))
+deftaylor(untake, linear(untake))
+
+# ----- Bilinear functions -----
+
+def bilinear(fun):
+    """Rule of a function that is linear in each of its first two arguments.
+    The remaining arguments (e.g. tensordot()'s axes) are passed along."""
+    def rule(ans, series, x, y, *args, **kwargs):
+        xs, ys = series[:2]
+        return [convolve(xs, ys, j, lambda a, b: None if a is None or b is None
+                         else fun(a, b, *args, **kwargs))
+                for j in range(1, len(xs))]
+    return rule
+
+deftaylor(anp.dot, bilinear(anp.dot))
+deftaylor(anp.matmul, bilinear(anp.matmul))
+deftaylor(anp.tensordot, bilinear(anp.tensordot))
+
+def orders(j, n):
+    """Ways to split order j among n factors, as tuples of n orders."""
+    if n == 1:
+        yield (j,)
+        return
+    for i in range(j + 1):
+        for rest in orders(j - i, n - 1):
+            yield (i,) + rest
+
+def _einsum_taylor(ans, series, subscripts, *operands, **kwargs):
+    # einsum() is linear in each operand: coefficient j sums the products of
+    # the operands' coefficients whose orders add up to j.
+    if not isinstance(subscripts, str):
+        raise NotImplementedError(
+            "Taylor series of einsum operands given in sublist format")
+    operand_series = series[1:]
+    ys = []
+    for j in range(1, len(operand_series[0])):
+        terms = []
+        for js in orders(j, len(operands)):
+            coefficients = [xs[i] for xs, i in zip(operand_series, js)]
+            if all(x is not None for x in coefficients):
+                terms.append(anp.einsum(subscripts, *coefficients, **kwargs))
+        ys.append(total(terms))
+    return ys
+
+deftaylor(anp.einsum, _einsum_taylor)
@@ -13,38 +13,70 @@ from . import numpy_wrapper as anp
 from .numpy_boxes import ArrayBox
 from autograd.tracer import primitive
 from autograd.core import defvjp
+from autograd.cotangents import (SparseCotangent, SymbolicZero, SymbolicOnes,
+                                 untake, densify)
 
 # ----- Binary ufuncs -----
 
-defvjp(anp.add,         lambda g, ans, x, y : unbroadcast(x, g),
-                        lambda g, ans, x, y : unbroadcast(y, g))
-defvjp(anp.multiply,    lambda g, ans, x, y : unbroadcast(x, y * g),
-                        lambda g, ans, x, y : unbroadcast(y, x * g))
-defvjp(anp.subtract,    lambda g, ans, x, y : unbroadcast(x, g),
-                        lambda g, ans, x, y : unbroadcast(y, -g))
-defvjp(anp.divide,      lambda g, ans, x, y : unbroadcast(x,   g / y),
-                        lambda g, ans, x, y : unbroadcast(y, - g * x / y**2))
-defvjp(anp.true_divide, lambda g, ans, x, y : unbroadcast(x,   g / y),
-                        lambda g, ans, x, y : unbroadcast(y, - g * x / y**2))
+defvjp(anp.add,         lambda g, ans, x, y : unbroadcast(x, g, nbatch(g, ans)),
+                        lambda g, ans, x, y : unbroadcast(y, g, nbatch(g, ans)))
+defvjp(anp.multiply,    lambda g, ans, x, y : unbroadcast(x, y * g, nbatch(g, ans)),
+                        lambda g, ans, x, y : unbroadcast(y, x * g, nbatch(g, ans)))
+defvjp(anp.subtract,    lambda g, ans, x, y : unbroadcast(x, g, nbatch(g, ans)),
+                        lambda g, ans, x, y : unbroadcast(y, -g, nbatch(g, ans)))
+defvjp(anp.divide,      lambda g, ans, x, y : unbroadcast(x,   g / y, nbatch(g, ans)),
+                        lambda g, ans, x, y : unbroadcast(y, - g * x / y**2, nbatch(g, ans)))
+defvjp(anp.true_divide, lambda g, ans, x, y : unbroadcast(x,   g / y, nbatch(g, ans)),
+                        lambda g, ans, x, y : unbroadcast(y, - g * x / y**2, nbatch(g, ans)))
 defvjp(anp.power,
-    lambda g, ans, x, y: unbroadcast(x, g * y * x ** anp.where(y, y - 1, 1.)),
-    lambda g, ans, x, y: unbroadcast(y, g * anp.log(replace_zero(x, 1.)) * x ** y))
+    lambda g, ans, x, y: unbroadcast(x, g * y * x ** anp.where(y, y - 1, 1.),
+                                     nbatch(g, ans)),
+    lambda g, ans, x, y: unbroadcast(y, g * anp.log(replace_zero(x, 1.)) * x ** y,
+                                     nbatch(g, ans)))
 
 def replace_zero(x, val):
     """Replace all zeros in 'x' with 'val'."""
     return anp.where(x, x, val)
 
-def unbroadcast(target, g, broadcast_idx=0):
+def nbatch(g, ans):
+    """Number of leading batch axes of cotangent 'g'.
+
+    A cotangent normally has the shape of the value 'ans' it belongs to.
+    jacobian() instead pushes a whole stack of cotangents through the backward
+    pass at once, so every vjp must treat any extra leading axes of 'g' as batch
+    axes. As numpy broadcasts from the right, elementwise vjps get this for
+    free.
+    """
+    return anp.ndim(g) - anp.ndim(ans)
+
+def unbroadcast(target, g, batch_ndim=0):
     """Remove broadcasted dimensions by summing along them.
 
     When computing gradients of a broadcasted value, this is the right thing to
     do when computing the total derivative and accounting for cloning.
+
+    Args:
+      target: value 'g' is the gradient of.
+      g: gradient to sum. Same shape as 'target' after broadcasting, plus
+        'batch_ndim' leading batch axes.
+      batch_ndim: number of leading batch axes of 'g'. These are left alone.
     """
-    while anp.ndim(g) > anp.ndim(target):
-        g = anp.sum(g, axis=broadcast_idx)
-    for axis, size in enumerate(anp.shape(target)):
-        if size == 1:
-            g = anp.sum(g, axis=axis, keepdims=True)
+    if type(g) is SymbolicZero or (type(g) is SymbolicOnes and
+                                   g.shape[batch_ndim:] == anp.shape(target)):
+        # Sums of zeros are zero, and ones that weren't broadcast need no sum.
+        dtype = (g.dtype if anp.iscomplexobj(target)
+                 else onp.zeros((), g.dtype).real.dtype)
+        return type(g)(g.shape[:batch_ndim] + anp.shape(target), dtype)
+    # Sum over leading broadcast axes and over axes where 'target' has size 1
+    # in a single reduction, rather than one sum (and one traced node) per axis.
+    num_leading = anp.ndim(g) - anp.ndim(target) - batch_ndim
+    axes = tuple(range(batch_ndim, batch_ndim + num_leading))
+    axes += tuple(batch_ndim + num_leading + axis
+                  for axis, size in enumerate(anp.shape(target)) if size == 1)
+    if axes:
+        g = anp.sum(g, axis=axes, keepdims=True)
+        if num_leading:
+            g = anp.reshape(g, anp.shape(g)[:batch_ndim] + anp.shape(target))
     if anp.iscomplexobj(g) and not anp.iscomplex(target):
         g = anp.real(g)
     return g
@@ -59,40 +91,313 @@ defvjp(anp.sinh,   lambda g, ans, x: g * anp.cosh(x))
 defvjp(anp.cosh,   lambda g, ans, x: g * anp.sinh(x))
 
 defvjp(anp.where, None,
-       lambda g, ans, c, x=None, y=None: anp.where(c, g, anp.zeros(g.shape)),
-       lambda g, ans, c, x=None, y=None: anp.where(c, anp.zeros(g.shape), g))
+       lambda g, ans, c, x=None, y=None: anp.where(c, g, 0.),
+       lambda g, ans, c, x=None, y=None: anp.where(c, 0., g))
 
 defvjp(anp.reshape, lambda g, ans, x, shape, order=None:
-       anp.reshape(g, anp.shape(x), order=order))
+       anp.reshape(g, anp.shape(g)[:nbatch(g, ans)] + anp.shape(x), order=order))
+
+def _sum_vjp(g, ans, x, axis=None, dtype=None, out=None, keepdims=False):
+  batch_ndim = nbatch(g, ans)
+  batch_shape = anp.shape(g)[:batch_ndim]
+  shape = anp.shape(x)
+  if type(g) is SymbolicOnes:
+    return SymbolicOnes(batch_shape + shape, g.dtype)
+  if not keepdims:
+    # Restore summed-over axes with size 1 so that 'g' broadcasts against x.
+    if axis is None:
+      axes = range(len(shape))
+    else:
+      axes = [a % len(shape) for a in onp.atleast_1d(axis)]
+    kept_shape = tuple(1 if i in axes else size for i, size in enumerate(shape))
+    g = anp.reshape(g, batch_shape + kept_shape)
+  if anp.shape(g) == batch_shape + shape:
+    return g
+  return g * onp.ones(batch_shape + shape, anp.result_type(g))
+
+def _transpose_vjp(g, ans, x, axes=None):
+  if anp.issparse(g):
+    # The cotangent of a transposed sparse matrix, which has two axes.
+    return g.T
+  batch_ndim = nbatch(g, ans)
+  if axes is None:
+    inverse = reversed(range(anp.ndim(x)))
+  else:
+    inverse = onp.argsort([a % anp.ndim(x) for a in axes])
+  return anp.transpose(g, tuple(range(batch_ndim)) +
+                          tuple(batch_ndim + a for a in inverse))
+
+defvjp(anp.sum, _sum_vjp)
+defvjp(anp.transpose, _transpose_vjp)
+
+# ----- Indexing grads -----
+
+# Reading entries of an array sends gradient to those entries only. Rather than
+# building a dense array of zeros for every read, these vjps return a
+# SparseCotangent that remembers which entries were read.
+
+def batch_index(idx, batch_ndim):
+    """Prepend full slices for leading batch axes to a numpy index."""
+    if batch_ndim == 0:
+        return idx
+    if not isinstance(idx, tuple):
+        idx = (idx,)
+    return (slice(None),) * batch_ndim + idx
+
+def _getitem_vjp(g, ans, A, idx):
+    batch_ndim = nbatch(g, ans)
+    shape = anp.shape(g)[:batch_ndim] + anp.shape(A)
+    return SparseCotangent(shape, anp.result_type(g),
+                           [(batch_index(idx, batch_ndim), g)])
+
+def take_index(shape, indices, axis=None, mode='raise'):
+    """Equivalent numpy index of anp.take(x, indices, axis, mode=mode)."""
+    size = onp.prod(shape, dtype=int) if axis is None else shape[axis]
+    indices = onp.asarray(indices)
+    if mode == 'clip':
+        indices = onp.clip(indices, 0, size - 1)
+    else:
+        indices = onp.mod(indices, size)
+    if axis is None:
+        return onp.unravel_index(indices, shape)
+    return (slice(None),) * (axis % len(shape)) + (indices,)
+
+def _take_vjp(g, ans, a, indices, axis=None, out=None, mode='raise'):
+    batch_ndim = nbatch(g, ans)
+    idx = take_index(anp.shape(a), indices, axis, mode)
+    shape = anp.shape(g)[:batch_ndim] + anp.shape(a)
+    return SparseCotangent(shape, anp.result_type(g),
+                           [(batch_index(idx, batch_ndim), g)])
+
+defvjp(ArrayBox.__getitem__, _getitem_vjp)
+defvjp(anp.take, _take_vjp)
+defvjp(untake, lambda g, ans, x, idx, shape, dtype:
+       g[batch_index(idx, nbatch(g, ans))])
 
 # ----- Dot grads -----
 
+# The cotangent 'g' may carry leading batch axes (see nbatch()). anp.dot()
+# contracts the last axis of its first argument, so products with 'g' on the
+# left batch correctly. Products with 'g' on the right are written so as to
+# keep its batch axes in front.
+
+def _append_axis(x):
+  """Reshape x from (..., n) to (..., n, 1)."""
+  return anp.reshape(x, anp.shape(x) + (1,))
+
+def _insert_axis(x):
+  """Reshape x from (..., n) to (..., 1, n)."""
+  return anp.reshape(x, anp.shape(x)[:-1] + (1,) + anp.shape(x)[-1:])
+
+def _swap_last_axes(x):
+  axes = tuple(range(anp.ndim(x)))
+  return anp.transpose(x, axes[:-2] + axes[:-3:-1])
+
+def _sparse_cotangent(A, X, Y):
+  """Cotangent of the sparse matrix A whose entries are those of X Y^T.
+
+  Only A's nonzero entries are free to vary, so only those entries of X Y^T are
+  computed, without materializing it. Not differentiable.
+  """
+  if anp.issparse(X) or anp.issparse(Y):
+    raise NotImplementedError("Cotangents of sparse matrices are only "
+                              "supported for their products with dense arrays.")
+  result = A.tocsr(copy=True)
+  result.sum_duplicates()
+  rows = onp.repeat(onp.arange(A.shape[0]), onp.diff(result.indptr))
+  X = onp.reshape(densify(X), (A.shape[0], -1))
+  Y = onp.reshape(densify(Y), (A.shape[1], -1))
+  result.data = onp.einsum('ij,ij->i', X[rows], Y[result.indices])
+  return result.asformat(A.format)
+
+def _sparse_dot(x, y):
+  """dot(x, y) for a sparse matrix y and a dense x with any number of axes."""
+  if anp.ndim(x) <= 2:
+    return anp.dot(x, y)
+  # Sparse products take matrices: fold the batch axes of x into its rows.
+  shape = anp.shape(x)
+  result = anp.dot(anp.reshape(x, (-1, shape[-1])), y)
+  return anp.reshape(result, shape[:-1] + anp.shape(result)[1:])
+
 def _dot_vjp_0(g, ans, lhs, rhs):
   if max(anp.ndim(lhs), anp.ndim(rhs)) > 2:
-    raise NotImplementedError("Current dot vjps only support ndim <= 2.")
+    return _tensordot_vjp_0(g, ans, lhs, rhs, _dot_axes(lhs, rhs))
 
+  if anp.issparse(lhs):
+    if nbatch(g, ans):
+      raise NotImplementedError("Batched cotangents of sparse matrices.")
+    return _sparse_cotangent(lhs, g, rhs)
+  if anp.issparse(rhs):
+    return _sparse_dot(g, rhs.T)
   if anp.ndim(lhs) == 0:
-    return anp.sum(rhs * g)
-  if anp.ndim(lhs) == 1 and anp.ndim(rhs) == 1:
+    return anp.sum(rhs * g, axis=tuple(range(nbatch(g, ans), anp.ndim(g))))
+  if anp.ndim(rhs) == 0:
     return g * rhs
-  if anp.ndim(lhs) == 2 and anp.ndim(rhs) == 1:
-    return g[:, None] * rhs
-  if anp.ndim(lhs) == 1 and anp.ndim(rhs) == 2:
-    return anp.dot(rhs, g)
+  if anp.ndim(rhs) == 1:
+    return _append_axis(g) * rhs
   return anp.dot(g, rhs.T)
 
 def _dot_vjp_1(g, ans, lhs, rhs):
   if max(anp.ndim(lhs), anp.ndim(rhs)) > 2:
-    raise NotImplementedError("Current dot vjps only support ndim <= 2.")
+    return _tensordot_vjp_1(g, ans, lhs, rhs, _dot_axes(lhs, rhs))
 
+  if anp.issparse(rhs):
+    if nbatch(g, ans):
+      raise NotImplementedError("Batched cotangents of sparse matrices.")
+    return _sparse_cotangent(rhs, anp.transpose(lhs), anp.transpose(g))
+  if anp.issparse(lhs):
+    # Contract g with the rows of lhs, without densifying it.
+    if anp.ndim(rhs) == 1:
+      return _sparse_dot(g, lhs)
+    if nbatch(g, ans) == 0:
+      return anp.dot(lhs.T, g)
+    return _swap_last_axes(_sparse_dot(_swap_last_axes(g), lhs))
   if anp.ndim(rhs) == 0:
-    return anp.sum(lhs * g)
+    return anp.sum(lhs * g, axis=tuple(range(nbatch(g, ans), anp.ndim(g))))
+  if anp.ndim(lhs) == 0:
+    return lhs * g
   if anp.ndim(lhs) == 1 and anp.ndim(rhs) == 1:
-    return g * lhs
+    return _append_axis(g) * lhs
   if anp.ndim(lhs) == 2 and anp.ndim(rhs) == 1:
     return anp.dot(g, lhs)
   if anp.ndim(lhs) == 1 and anp.ndim(rhs) == 2:
-    return lhs[:, None] * g
-  return anp.dot(lhs.T, g)
+    return _append_axis(lhs) * _insert_axis(g)
+  if nbatch(g, ans) == 0:
+    return anp.dot(lhs.T, g)
+  return anp.matmul(lhs.T, g)
 
 defvjp(anp.dot, _dot_vjp_0, _dot_vjp_1)
+
+def _dot_axes(lhs, rhs):
+  """tensordot() axes of dot(lhs, rhs): the last axis of lhs and the second to
+  last of rhs."""
+  return [anp.ndim(lhs) - 1], [max(anp.ndim(rhs) - 2, 0)]
+
+def _tensordot_axes(a, b, axes):
+  """Contracted axes of a and b, as lists of nonnegative ints."""
+  try:
+    a_axes, b_axes = axes
+  except TypeError:
+    return (list(range(anp.ndim(a) - axes, anp.ndim(a))), list(range(axes)))
+  return ([axis % anp.ndim(a) for axis in onp.atleast_1d(a_axes)],
+          [axis % anp.ndim(b) for axis in onp.atleast_1d(b_axes)])
+
+def _permute(x, batch_ndim, order):
+  """Transpose x, whose axis batch_ndim + k is axis order[k] of the result.
+  Batch axes stay in front."""
+  perm = onp.argsort(order)
+  if list(perm) == list(range(len(order))):
+    return x
+  return anp.transpose(x, tuple(range(batch_ndim)) +
+                          tuple(batch_ndim + k for k in perm))
+
+# The cotangent of a tensordot() is another tensordot(), of g with the other
+# argument over that argument's free axes, followed by a transpose to the axis
+# order of the argument.
+
+def _tensordot_vjp_0(g, ans, a, b, axes=2):
+  a_axes, b_axes = _tensordot_axes(a, b, axes)
+  a_free = [i for i in range(anp.ndim(a)) if i not in a_axes]
+  b_free = [j for j in range(anp.ndim(b)) if j not in b_axes]
+  # g has axes (batch..., a_free..., b_free...).
+  g_b_free = list(range(anp.ndim(g) - len(b_free), anp.ndim(g)))
+  result = anp.tensordot(g, b, (g_b_free, b_free))
+  # The axes of b left over are its contracted ones, in increasing order.
+  paired = [a_axes[b_axes.index(j)] for j in sorted(b_axes)]
+  return _permute(result, nbatch(g, ans), a_free + paired)
+
+def _tensordot_vjp_1(g, ans, a, b, axes=2):
+  a_axes, b_axes = _tensordot_axes(a, b, axes)
+  a_free = [i for i in range(anp.ndim(a)) if i not in a_axes]
+  b_free = [j for j in range(anp.ndim(b)) if j not in b_axes]
+  batch_ndim = nbatch(g, ans)
+  g_a_free = list(range(batch_ndim, batch_ndim + len(a_free)))
+  # Contracting a first leaves its axes (paired with b's contracted ones)
+  # in front of the batch axes of g.
+  result = anp.tensordot(a, g, (a_free, g_a_free))
+  paired = [b_axes[a_axes.index(i)] for i in sorted(a_axes)]
+  if batch_ndim:
+    axes = tuple(range(anp.ndim(result)))
+    n = len(paired)
+    result = anp.transpose(result, axes[n:n + batch_ndim] + axes[:n] +
+                                   axes[n + batch_ndim:])
+  return _permute(result, batch_ndim, paired + b_free)
+
+defvjp(anp.tensordot, _tensordot_vjp_0, _tensordot_vjp_1)
+
+# matmul() broadcasts stacks of matrices. Vectors are promoted to matrices,
+# (k,) to (1, k) on the left and to (k, 1) on the right, and g with them.
+
+def _matmul_operands(g, a, b):
+  if anp.ndim(b) == 1:
+    g, b = _append_axis(g), _append_axis(b)
+  if anp.ndim(a) == 1:
+    g, a = _insert_axis(g), _insert_axis(a)
+  return g, a, b
+
+def _matmul_vjp_0(g, ans, a, b):
+  if anp.issparse(a) or anp.issparse(b):
+    return _dot_vjp_0(g, ans, a, b)
+  g2, a2, b2 = _matmul_operands(g, a, b)
+  result = anp.matmul(g2, _swap_last_axes(b2))
+  if anp.ndim(a) == 1:
+    result = anp.reshape(result, anp.shape(result)[:-2] + anp.shape(result)[-1:])
+  return unbroadcast(a, result, nbatch(g, ans))
+
+def _matmul_vjp_1(g, ans, a, b):
+  if anp.issparse(a) or anp.issparse(b):
+    return _dot_vjp_1(g, ans, a, b)
+  g2, a2, b2 = _matmul_operands(g, a, b)
+  result = anp.matmul(_swap_last_axes(a2), g2)
+  if anp.ndim(b) == 1:
+    result = anp.reshape(result, anp.shape(result)[:-1])
+  return unbroadcast(b, result, nbatch(g, ans))
+
+defvjp(anp.matmul, _matmul_vjp_0, _matmul_vjp_1)
+
+# The cotangent of an einsum() operand is the einsum() of g with the other
+# operands. It is optimized, as a batched matmul() or along a contraction path
+# searched for once per subscripts and shapes (see anp.einsum_path()).
+
+einsum_labels = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+def _einsum_vjp(argnum):
+  def vjp(g, ans, subscripts, *operands, **kwargs):
+    if not isinstance(subscripts, str):
+      raise NotImplementedError("einsum vjps of operands given in sublist format")
+    inputs, output = anp.einsum_subscripts(subscripts)
+    target, x = inputs[argnum - 1], operands[argnum - 1]
+    if len(set(target)) < len(target):
+      raise NotImplementedError("einsum vjps of repeated labels in one operand")
+    others = inputs[:argnum - 1] + inputs[argnum:]
+    batch_ndim = nbatch(g, ans)
+    batch = ''.join([label for label in einsum_labels
+                     if label not in subscripts][:batch_ndim])
+    # Labels (and ellipses) of the target that appear nowhere else are summed
+    # over by the einsum: its cotangent is constant along them.
+    elsewhere = set(output + ''.join(others))
+    kept = ''.join(label for label in target if label in elsewhere)
+    result = anp.einsum(
+        (','.join(others + [batch + output]) + '->' + batch + kept).replace('.', '...'),
+        *(operands[:argnum - 1] + operands[argnum:] + (g,)), optimize=True)
+    if kept == target:
+      return unbroadcast(x, result, batch_ndim)
+    # Put size 1 axes where the target has labels that were summed over.
+    shape = anp.shape(result)
+    ellipsis_ndim = anp.ndim(x) - len(target) + 1
+    new_shape, i = list(shape[:batch_ndim]), batch_ndim
+    for label in target:
+      n = (anp.ndim(result) - batch_ndim - len(kept) + 1 if label == '.' else 1)
+      if label in kept:
+        new_shape += shape[i:i + n]
+        i += n
+      else:
+        new_shape += [1] * (ellipsis_ndim if label == '.' else 1)
+    result = unbroadcast(x, anp.reshape(result, tuple(new_shape)), batch_ndim)
+    return result * onp.ones(anp.shape(result)[:batch_ndim] + anp.shape(x),
+                             anp.result_type(result))
+  return vjp
+
+# numpy.einsum() takes up to 32 operands, after the subscripts.
+for argnum in range(1, 33):
+  defvjp(anp.einsum, _einsum_vjp(argnum), argnums=[argnum])
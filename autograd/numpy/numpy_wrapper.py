@@ -4,16 +4,21 @@ This library contains all functions and methods in numpy. Unless specified in
 'nograd_functions', the function is assumed to have a registered vector-Jacobian
 product.
 
-Uses Python namespace-is-a-dict magic.
+Functions are wrapped on first access, through the module's __getattr__, so
+that importing autograd.numpy doesn't pay for the hundreds of numpy functions a
+program never uses.
 """
 from __future__ import absolute_import
 import types
-from autograd.tracer import primitive, notrace_primitive
+from autograd.tracer import (primitive, unary_primitive, binary_primitive,
+                             notrace_primitive)
+from autograd.util import wraps
+from autograd.tape import LRUCache
 import numpy as _np
 
 # ----- Non-differentiable functions -----
 
-nograd_functions = [
+nograd_functions = {
     _np.all,
     _np.allclose,
     _np.any,
@@ -63,13 +68,53 @@ nograd_functions = [
     _np.size,
     _np.trunc,
     _np.zeros_like,
-]
+}
 
 def wrap_intdtype(cls):
     class IntdtypeSubclass(cls):
         __new__ = notrace_primitive(cls.__new__)
     return IntdtypeSubclass
 
+# Number of inputs -> wrapper specialized for ufuncs taking that many.
+ufunc_primitives = {1: unary_primitive, 2: binary_primitive}
+
+unchanged_types = {float, int, type(None), type}
+int_types = {_np.int, _np.int8, _np.int16, _np.int32, _np.int64, _np.integer}
+function_types = {_np.ufunc, types.FunctionType, types.BuiltinFunctionType}
+
+def provides(obj):
+    """Whether autograd.numpy provides (a wrapped version of) a numpy object.
+    Modules, for example, aren't."""
+    return type(obj) in function_types or type(obj) in unchanged_types
+
+def wrap(obj):
+    """Wrapped version of a numpy object that autograd.numpy provides. Objects
+    that need no wrapping are returned as they are."""
+    if type(obj) in function_types:
+        if obj in nograd_functions:
+            # Functions without gradients. We don't bother to trace values that
+            # enter here.
+            return notrace_primitive(obj)
+        if type(obj) is _np.ufunc and obj.nin in ufunc_primitives:
+            # Ufuncs with gradients. Use a wrapper specialized to their number
+            # of inputs to cut dispatch overhead.
+            return ufunc_primitives[obj.nin](obj)
+        # Functions with gradients. We trace values.
+        return primitive(obj)
+    if type(obj) is type and obj in int_types:
+        # Wrap int types with something identical except that calls to __new__
+        # immediately strip argument of boxes.
+        #
+        # TODO(duckworthd): Why do numpy int types need to be boxed, but not
+        # Python's int()?
+        return wrap_intdtype(obj)
+    return obj
+
+def wrapped_names(old):
+    """Names of the objects of module 'old' that are provided wrapped."""
+    return [name for name, obj in old.__dict__.items()
+            if not name.startswith('__') and provides(obj)]
+
 def wrap_namespace(old, new):
     """Copy all functions in 'old' namespace to 'new' namespace.
 
@@ -77,26 +122,156 @@ def wrap_namespace(old, new):
       old: __dict__ of module to copy from.
       new: __dict__ of module to copy to.
     """
-    unchanged_types = {float, int, type(None), type}
-    int_types = {_np.int, _np.int8, _np.int16, _np.int32, _np.int64, _np.integer}
-    function_types = {_np.ufunc, types.FunctionType, types.BuiltinFunctionType}
     for name, obj in old.items():
-        if obj in nograd_functions:
-            # Functions without gradients. We don't bother to trace values that
-            # enter here.
-            new[name] = notrace_primitive(obj)
-        elif type(obj) in function_types:
-            # Functions with gradients. We trace values.
-            new[name] = primitive(obj)
-        elif type(obj) is type and obj in int_types:
-            # Wrap int types with something identical except that calls to __new__
-            # immediately strip argument of boxes.
-            #
-            # TODO(duckworthd): Why do numpy int types need to be boxed, but not
-            # Python's int()?
-            new[name] = wrap_intdtype(obj)
-        elif type(obj) in unchanged_types:
-            new[name] = obj
-
-# Set autograd.numpy.<function> = wrap(numpy.<function>)
-wrap_namespace(_np.__dict__, globals())
+        if provides(obj):
+            new[name] = wrap(obj)
+
+def lazy_namespace(old, new):
+    """Module __getattr__ and __dir__ functions that wrap the objects of module
+    'old' on first access.
+
+    Args:
+      old: module to wrap.
+      new: __dict__ of the module to cache wrapped objects in.
+    """
+    def __getattr__(name):
+        if (name.startswith('__') or name not in old.__dict__
+                or not provides(old.__dict__[name])):
+            raise AttributeError("module {!r} has no attribute {!r}".format(
+                new['__name__'], name))
+        # Another thread may have wrapped it first. Keep a single wrapper, as
+        # vjps are registered with it.
+        return new.setdefault(name, wrap(old.__dict__[name]))
+
+    def __dir__():
+        return sorted(set(new) | set(wrapped_names(old)))
+    return __getattr__, __dir__
+
+# Set autograd.numpy.<function> = wrap(numpy.<function>) on first access.
+__getattr__, __dir__ = lazy_namespace(_np, globals())
+
+# ----- Sparse matrices -----
+
+def sparse_type(value_type):
+    """Whether value_type is a scipy.sparse matrix or array type.
+
+    Decided by the module the type is defined in, so that scipy, which is slow
+    to import, is only imported by code that uses it.
+    """
+    return (value_type.__module__.startswith('scipy.sparse.')
+            and hasattr(value_type, 'tocsr'))
+
+def issparse(x):
+    return sparse_type(type(x))
+
+def sparse_product(f_raw):
+    """Wrap a numpy product so that it also multiplies scipy.sparse matrices,
+    which numpy functions would convert to object arrays."""
+    @wraps(f_raw)
+    def product(a, b, *args, **kwargs):
+        if type(a) is _np.ndarray and type(b) is _np.ndarray:
+            return f_raw(a, b, *args, **kwargs)
+        if issparse(a):
+            return a.dot(b)
+        if issparse(b):
+            return b * a if _np.ndim(a) == 0 else a @ b
+        return f_raw(a, b, *args, **kwargs)
+    return product
+
+dot = primitive(sparse_product(_np.dot))
+matmul = binary_primitive(sparse_product(_np.matmul))
+
+# ----- Contractions -----
+
+def einsum_subscripts(subscripts):
+    """Explicit form of einsum subscripts, as (list of input labels, output
+    labels). Labels are strings in which '.' stands for an ellipsis."""
+    subscripts = subscripts.replace(' ', '').replace('...', '.')
+    if '->' in subscripts:
+        inputs, output = subscripts.split('->')
+        return inputs.split(','), output
+    inputs = subscripts.split(',')
+    labels = ''.join(inputs)
+    # Implicit mode: labels used once, in alphabetical order, after any
+    # ellipsis.
+    output = ''.join(sorted(label for label in set(labels)
+                            if labels.count(label) == 1 and label != '.'))
+    return inputs, ('.' if '.' in labels else '') + output
+
+# (subscripts, optimize, shapes) -> contraction path.
+einsum_paths = LRUCache(1024)
+
+def einsum_path(subscripts, *operands, **kwargs):
+    """Contraction path of numpy.einsum_path(), searched for once per
+    subscripts and operand shapes."""
+    optimize = kwargs.get('optimize', 'greedy')
+    shapes = tuple(_np.shape(x) for x in operands)
+    key = (subscripts, optimize, shapes)
+    try:
+        return einsum_paths[key]
+    except KeyError:
+        # Only shapes matter: search with zero-stride stand-ins.
+        stand_ins = [_np.broadcast_to(0., shape) for shape in shapes]
+        path = _np.einsum_path(subscripts, *stand_ins, optimize=optimize)[0]
+        einsum_paths[key] = path
+        return path
+
+def einsum_as_matmul(subscripts, a, b):
+    """einsum() of two operands as a single batched matmul(), or None if the
+    subscripts use ellipses or repeated labels.
+
+    numpy.einsum() hands contractions to BLAS through tensordot(), which can't
+    express labels kept from both operands (e.g. the batch and head axes of
+    attention): those contractions run in einsum's own loops instead.
+    """
+    # Builtins such as any() are shadowed by numpy functions in this module
+    # once those have been wrapped (see lazy_namespace()), so they aren't used.
+    inputs, output = einsum_subscripts(subscripts)
+    a, b = _np.asarray(a), _np.asarray(b)
+    if (len(inputs) != 2 or '.' in subscripts
+            or [len(set(labels)) for labels in inputs + [output]] !=
+               [len(labels) for labels in inputs + [output]]
+            or (a.ndim, b.ndim) != tuple(map(len, inputs))):
+        return None
+    in_a, in_b = inputs
+    sizes = dict(zip(in_a, a.shape))
+    for label, size in zip(in_b, b.shape):
+        if sizes.setdefault(label, size) != size:
+            return None  # Broadcasting, which matmul() would do differently.
+    # Labels of only one operand that aren't kept are summed first.
+    summed = [i for i, label in enumerate(in_a) if label not in in_b + output]
+    if summed:
+        a = a.sum(axis=tuple(summed))
+        in_a = ''.join(label for label in in_a if label in in_b + output)
+    summed = [j for j, label in enumerate(in_b) if label not in in_a + output]
+    if summed:
+        b = b.sum(axis=tuple(summed))
+        in_b = ''.join(label for label in in_b if label in in_a + output)
+    batch = [label for label in in_a if label in in_b and label in output]
+    contracted = [label for label in in_a if label in in_b and label not in output]
+    left = [label for label in in_a if label not in in_b]
+    right = [label for label in in_b if label not in in_a]
+    size = lambda labels: int(_np.prod([sizes[label] for label in labels]))
+    a = a.transpose([in_a.index(label) for label in batch + left + contracted])
+    b = b.transpose([in_b.index(label) for label in batch + contracted + right])
+    result = _np.matmul(a.reshape(size(batch), size(left), size(contracted)),
+                        b.reshape(size(batch), size(contracted), size(right)))
+    labels = batch + left + right
+    result = result.reshape([sizes[label] for label in labels])
+    if not output:
+        return result[()]
+    return result.transpose([labels.index(label) for label in output])
+
+@wraps(_np.einsum)
+def _einsum(*operands, **kwargs):
+    optimize = kwargs.get('optimize', False)
+    if (optimize is not False and not isinstance(optimize, list)
+            and isinstance(operands[0], str)):
+        if len(operands) == 3 and len(kwargs) == 1:
+            result = einsum_as_matmul(*operands)
+            if result is not None:
+                return result
+        kwargs['optimize'] = einsum_path(*operands, optimize=optimize)
+    return _np.einsum(*operands, **kwargs)
+
+einsum = primitive(_einsum)
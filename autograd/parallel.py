@@ -0,0 +1,283 @@
+"""Parallel gradient computation.
+
+NumPy releases the GIL inside large array operations, so independent parts of a
+backward pass can run at the same time on several threads. With this library,
+one can,
+
+- Run a backward pass on a thread pool, processing a node as soon as all of its
+  children have contributed to its gradient. (parallel_backward_pass)
+- Compute the gradient of a loss summed over a batch on a process pool, one
+  shard of the batch per process. (parallel_grad)
+"""
+from functools import reduce
+from itertools import count
+import os
+import threading
+import weakref
+
+import numpy as np
+
+from . import tracer
+from .core import make_vjp, primitive_vjps, add_outgrads
+from .cotangents import SparseCotangent, is_zero, densify
+from .saved_values import PackedNode
+from .tracer import getval
+from .util import count_children, subvals, subval
+
+def parallel_backward_pass(g, end_node, n_workers=None, retain_graph=False):
+    """Backpropagation on a thread pool.
+
+    Computes the same result as core.backward_pass(), but instead of following
+    a single topological order, schedules each node on the pool as soon as all
+    of its children have added their contributions to its gradient. Branches
+    of the graph that don't depend on each other then run concurrently.
+
+    A worker that makes a node ready continues with that node itself, so a
+    chain of nodes stays on one thread and is not handed back to the pool at
+    every step.
+
+    Args:
+      g: gradient with respect to the end node's value.
+      end_node: Node to start from.
+      n_workers: int. Number of threads. Defaults to the number of CPUs.
+      retain_graph: see core.backward_pass().
+
+    Returns:
+      Gradient with respect to the root node's value, or None if it is zero.
+    """
+    n_workers = n_workers or os.cpu_count() or 1
+    pending = count_children(end_node)
+    contributions = {end_node: [g]}
+    lock = threading.Lock()
+    done = threading.Event()
+    state = {'remaining': len(pending), 'result': None, 'error': None}
+    profiler = tracer.profiler
+
+    def process(node):
+        """Run node's vjps. Returns parents that became ready."""
+        with lock:
+            # Nodes that no gradient reached have no contributions.
+            outgrad = reduce(add_outgrads, contributions.pop(node, []), None)
+        fun, value, args, kwargs, argnums = node.recipe
+        if not retain_graph:
+            node.recipe = None
+        if not node.parents:
+            state['result'] = None if is_zero(outgrad) else densify(outgrad)
+        elif type(node) is PackedNode and not is_zero(outgrad):
+            value, args = node.unpack(value, args)
+        if type(outgrad) is SparseCotangent:
+            # vjps expect plain cotangents, or symbolic ones.
+            outgrad = outgrad.densify()
+        ready = []
+        for argnum, parent in zip(argnums, node.parents):
+            vjp = primitive_vjps[fun][argnum]
+            if is_zero(outgrad) or vjp is None:
+                # Parents still wait for this node, so it must check in.
+                parent_grad = None
+            elif profiler is None:
+                parent_grad = vjp(outgrad, value, *args, **kwargs)
+            else:
+                parent_grad = profiler.call_vjp(vjp, fun, argnum, outgrad,
+                                                value, args, kwargs)
+            # Contributions are summed by the parent's own task, outside of
+            # the lock.
+            with lock:
+                if not is_zero(parent_grad):
+                    contributions.setdefault(parent, []).append(parent_grad)
+                pending[parent] -= 1
+                if pending[parent] == 0:
+                    ready.append(parent)
+        return ready
+
+    def run(node):
+        try:
+            while node is not None and not done.is_set():
+                ready = process(node)
+                with lock:
+                    state['remaining'] -= 1
+                    if state['remaining'] == 0:
+                        done.set()
+                for parent in ready[1:]:
+                    executor.submit(run, parent)
+                node = ready[0] if ready else None
+        except BaseException as e:
+            with lock:
+                if state['error'] is None:
+                    state['error'] = e
+            done.set()
+
+    # Imported here, as concurrent.futures is slow to import.
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        executor.submit(run, end_node)
+        done.wait()
+    if state['error'] is not None:
+        raise state['error']
+    return state['result']
+
+def parallel_grad(fun, batch_argnum, n_workers=None, argnum=0):
+    """Constructs a data-parallel gradient function.
+
+    Like grad(fun, argnum), for functions that sum a loss over the examples in
+    their batch arguments. The batch is split along its first axis into one
+    shard per worker process. Each worker differentiates fun() on its shard,
+    and the per-shard gradients are summed.
+
+    The differentiated argument and the batch arguments are passed to the
+    workers through shared memory (multiprocessing.shared_memory) rather than
+    being pickled. Each worker writes its gradient into its own row of a shared
+    buffer, and the rows are summed into a preallocated buffer. Other
+    arguments are pickled.
+
+    Workers are forked when the returned function is first called, and
+    inherit fun() from that point, so fun() needn't be picklable. This needs
+    the 'fork' start method, i.e. a POSIX system. Call gradfun.close() to shut
+    the workers down; otherwise they are shut down when gradfun is garbage
+    collected.
+
+    Args:
+      fun: function. Returns a scalar that is a sum over the batch.
+      batch_argnum: integer or tuple of integers. Indices of the batch
+        arguments, ndarrays with the same length (e.g. inputs and targets).
+      n_workers: integer. Number of processes. Defaults to the number of CPUs.
+      argnum: integer. Index of argument to take derivative wrt, an ndarray.
+
+    Returns:
+      gradfun: function that takes the same positional args as fun(), but
+        returns the gradient wrt fun()'s argnum-th argument. Pass out=array to
+        receive the gradient in an existing array.
+    """
+    n_workers = n_workers or os.cpu_count() or 1
+    if isinstance(batch_argnum, int):
+        batch_argnums = (batch_argnum,)
+    else:
+        batch_argnums = tuple(batch_argnum)
+    state = {'pool': None, 'buffers': {}}
+
+    def gradfun(*args, **kwargs):
+        out = kwargs.pop('out', None)
+        x = np.asarray(args[argnum])
+        batches = [np.asarray(args[i]) for i in batch_argnums]
+        if state['pool'] is None:
+            # Imported here, as multiprocessing is slow to import.
+            import multiprocessing
+            from multiprocessing import resource_tracker
+            # Make fun() available to the workers before they are forked.
+            key = next(worker_fun_ids)
+            worker_funs[key] = fun
+            state['key'] = key
+            # Have workers share this process's resource tracker. Otherwise
+            # each starts its own, which unlinks the shared memory blocks the
+            # worker attached to when it exits.
+            resource_tracker.ensure_running()
+            state['pool'] = multiprocessing.get_context('fork').Pool(n_workers)
+            state['finalizer'] = weakref.finalize(
+                gradfun, close_workers, key, state['pool'], state['buffers'])
+
+        # Place x and the batches in shared memory, reusing buffers between
+        # calls with the same shapes.
+        n_examples = len(batches[0])
+        n_shards = min(n_workers, n_examples)
+        shared = [shared_buffer(state['buffers'], i, value.shape, value.dtype)
+                  for i, value in zip((argnum,) + batch_argnums, [x] + batches)]
+        rows = shared_buffer(state['buffers'], 'rows', (n_shards,) + x.shape,
+                             np.result_type(x, float))
+        for buffer, value in zip(shared, [x] + batches):
+            buffer.array[...] = value
+
+        # Pickle placeholders instead of the shared arguments.
+        other_args = subvals(args, [(i, None) for i in (argnum,) + batch_argnums])
+        bounds = np.linspace(0, n_examples, n_shards + 1).astype(int)
+        tasks = [(state['key'], argnum, batch_argnums, other_args,
+                  [buffer.spec for buffer in shared], rows.spec, row,
+                  bounds[row], bounds[row + 1])
+                 for row in range(n_shards)]
+        state['pool'].map(shard_grad, tasks)
+
+        if out is None:
+            out = np.empty(x.shape, rows.array.dtype)
+        return np.sum(rows.array, axis=0, out=out)
+
+    def close():
+        if state['pool'] is not None:
+            state['finalizer']()
+            state['pool'] = None
+    gradfun.close = close
+    return gradfun
+
+# Functions differentiated by parallel_grad(), by id. Populated in the parent
+# process before workers are forked, so that workers can look them up.
+worker_funs = {}
+worker_fun_ids = count()
+
+class SharedArray(object):
+    """An ndarray backed by a multiprocessing.shared_memory block."""
+
+    def __init__(self, shape, dtype, name=None):
+        """
+
+        Args:
+          shape: tuple. Shape of the array.
+          dtype: dtype of the array.
+          name: string. Name of an existing block to attach to. If None, a new
+            block is created; its owner must call unlink().
+        """
+        from multiprocessing import shared_memory
+        dtype = np.dtype(dtype)
+        size = max(1, int(np.prod(shape)) * dtype.itemsize)
+        self.shm = shared_memory.SharedMemory(name=name, create=name is None,
+                                              size=size)
+        self.array = np.ndarray(shape, dtype, buffer=self.shm.buf)
+        self.spec = (self.shm.name, shape, dtype.str)
+
+    def close(self):
+        self.array = None  # Views must be released before the block.
+        self.shm.close()
+
+    def unlink(self):
+        self.close()
+        self.shm.unlink()
+
+def shared_buffer(buffers, role, shape, dtype):
+    """Return buffers[role] if it has the right shape and dtype, else replace
+    it with a new SharedArray."""
+    buffer = buffers.get(role)
+    if buffer is None or buffer.spec[1:] != (shape, np.dtype(dtype).str):
+        if buffer is not None:
+            buffer.unlink()
+        buffer = buffers[role] = SharedArray(shape, dtype)
+    return buffer
+
+def close_workers(key, pool, buffers):
+    del worker_funs[key]
+    pool.terminate()
+    pool.join()
+    for buffer in buffers.values():
+        buffer.unlink()
+    buffers.clear()
+
+# Shared memory blocks a worker has attached to, by name.
+attached = {}
+
+def attach(spec):
+    name, shape, dtype = spec
+    if name not in attached:
+        attached[name] = SharedArray(shape, dtype, name=name)
+    return attached[name].array
+
+def shard_grad(task):
+    """Worker process: write the gradient of one shard of the batch into its
+    row of the shared gradient buffer."""
+    (key, argnum, batch_argnums, args, specs, rows_spec, row, start,
+     stop) = task
+    fun = worker_funs[key]
+    # Let go of blocks the parent has replaced since the last task.
+    names = set(spec[0] for spec in specs + [rows_spec])
+    for name in [name for name in attached if name not in names]:
+        attached.pop(name).close()
+    x, batches = attach(specs[0]), [attach(spec) for spec in specs[1:]]
+    rows = attach(rows_spec)
+    args = subvals(args, [(i, batch[start:stop])
+                          for i, batch in zip(batch_argnums, batches)])
+    vjp, ans = make_vjp(lambda x: fun(*subval(args, argnum, x)), x)
+    rows[row] = vjp(np.ones_like(getval(ans)))
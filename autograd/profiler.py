@@ -0,0 +1,169 @@
+"""Per-primitive profiling.
+
+Find out which primitives and vjps a computation spends its time and memory
+on. With this library, one can,
+
+- Record every primitive call and every vjp call made inside a block of code.
+  (profile)
+- Aggregate the records per function. (Profiler.summary, Profiler.report)
+- Export them for chrome://tracing or Perfetto. (Profiler.export_chrome_trace)
+
+Profiling is off unless a profile() block is active. When it is off, the cost
+is one comparison per primitive call and per backward pass.
+
+Only the raw calls are timed, i.e. the numpy work itself and not the time
+spent boxing and recording nodes. Replays of compiled tapes (see tape.py) call
+raw functions directly and are not seen.
+"""
+from collections import namedtuple
+import json
+import threading
+import time
+
+import numpy as np
+
+from . import tracer
+from .tracer import getval, trace_stack
+from .cotangents import SparseCotangent, SymbolicCotangent
+
+Event = namedtuple('Event', ['kind', 'name', 'start', 'duration', 'nbytes',
+                             'trace_depth', 'thread'])
+Event.__doc__ = """One recorded call.
+
+Attributes:
+  kind: 'primitive' or 'vjp'.
+  name: name of the function called. vjps are named after their primitive and
+    argnum, e.g. 'multiply/vjp1'.
+  start: float. Seconds since the profile() block was entered.
+  duration: float. Wall time of the call, in seconds.
+  nbytes: int. Size of the call's output.
+  trace_depth: int. Number of traces active on the calling thread during the
+    call: 0 outside of any grad(), 1 inside one, 2 inside a nested grad(), and
+    so on. Not a node's depth in the graph.
+  thread: identifier of the calling thread.
+"""
+
+Stats = namedtuple('Stats', ['kind', 'name', 'calls', 'total_time', 'max_time',
+                             'total_bytes', 'max_trace_depth'])
+
+class Profiler(object):
+    """Collects Events while it is active. Use through profile()."""
+
+    def __init__(self):
+        self.events = []
+        self.origin = None
+        self.previous = None
+
+    def __enter__(self):
+        self.previous = tracer.profiler
+        self.origin = time.perf_counter()
+        tracer.profiler = self
+        return self
+
+    def __exit__(self, *exc_info):
+        tracer.profiler = self.previous
+
+    def call_primitive(self, f_raw, args, kwargs):
+        """Call f_raw(*args, **kwargs) and record it."""
+        start = time.perf_counter()
+        ans = f_raw(*args, **kwargs)
+        self.record('primitive', function_name(f_raw), start, ans)
+        return ans
+
+    def call_vjp(self, vjp, fun, argnum, g, ans, args, kwargs):
+        """Call vjp(g, ans, *args, **kwargs) and record it."""
+        start = time.perf_counter()
+        result = vjp(g, ans, *args, **kwargs)
+        self.record('vjp', '{}/vjp{}'.format(function_name(fun), argnum),
+                    start, result)
+        return result
+
+    def record(self, kind, name, start, output):
+        end = time.perf_counter()
+        self.events.append(Event(kind, name, start - self.origin, end - start,
+                                 nbytes(output), trace_stack.depth,
+                                 threading.current_thread().ident))
+
+    def summary(self):
+        """Aggregate events per function.
+
+        Returns:
+          list of Stats, most total time first.
+        """
+        stats = {}
+        for event in self.events:
+            key = (event.kind, event.name)
+            if key not in stats:
+                stats[key] = Stats(event.kind, event.name, 0, 0., 0., 0, 0)
+            s = stats[key]
+            stats[key] = Stats(s.kind, s.name, s.calls + 1,
+                               s.total_time + event.duration,
+                               max(s.max_time, event.duration),
+                               s.total_bytes + event.nbytes,
+                               max(s.max_trace_depth, event.trace_depth))
+        return sorted(stats.values(), key=lambda s: -s.total_time)
+
+    def report(self, limit=20):
+        """Table of the 'limit' most expensive functions, as a string."""
+        lines = ["{:<10} {:<28} {:>8} {:>12} {:>12} {:>12} {:>12}".format(
+            "kind", "name", "calls", "total (ms)", "max (ms)", "bytes",
+            "trace depth")]
+        for s in self.summary()[:limit]:
+            lines.append("{:<10} {:<28} {:>8} {:>12.3f} {:>12.3f} {:>12} {:>12}"
+                         .format(s.kind, s.name[:28], s.calls, s.total_time * 1e3,
+                                 s.max_time * 1e3, s.total_bytes,
+                                 s.max_trace_depth))
+        return '\n'.join(lines)
+
+    def export_chrome_trace(self, path):
+        """Write events in the Chrome trace event format.
+
+        Open the file in chrome://tracing or https://ui.perfetto.dev. Calls made
+        inside a vjp (e.g. the primitives it applies) show up nested in it.
+        """
+        trace_events = [{'name': event.name,
+                         'cat': event.kind,
+                         'ph': 'X',  # Complete event: has start and duration.
+                         'ts': event.start * 1e6,
+                         'dur': event.duration * 1e6,
+                         'pid': 0,
+                         'tid': event.thread,
+                         'args': {'bytes': event.nbytes,
+                                  'trace_depth': event.trace_depth}}
+                        for event in self.events]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': trace_events,
+                       'displayTimeUnit': 'ms'}, f)
+
+def profile():
+    """Profile primitive and vjp calls made inside a with-block.
+
+    ```
+    with profile() as prof:
+        grad(f)(x)
+    print(prof.report())
+    prof.export_chrome_trace('trace.json')
+    ```
+
+    Returns:
+      Profiler. Holds the recorded events after the block exits.
+    """
+    return Profiler()
+
+def function_name(fun):
+    return getattr(fun, '__name__', repr(fun))
+
+def nbytes(x):
+    """Size of a primitive's or vjp's output. 0 if it has no array size."""
+    x = getval(x)
+    if isinstance(x, SymbolicCotangent):
+        # SymbolicZero or SymbolicOnes. Nothing is stored; converting to an
+        # array would allocate one the backward pass never does.
+        return 0
+    if type(x) is SparseCotangent:
+        # Count the stored values, not the dense shape.
+        return sum(nbytes(values) for _, values in x.pairs)
+    try:
+        return np.asarray(x).nbytes
+    except Exception:
+        return 0
@@ -0,0 +1,360 @@
+"""Saved value policies.
+
+Every node of a computation graph keeps its value and arguments (its recipe)
+until the backward pass runs. For wide layers these saved values are most of
+a program's memory. With this library, one can,
+
+- Store saved values at lower precision, if that is accurate enough.
+  (Downcast)
+- Store saved values losslessly compressed. (Compress)
+- Spill saved values to a memory-mapped file on disk, for graphs whose
+  values don't fit in memory. (Spill)
+- Write other policies for saved values. (SavedValuePolicy)
+- Trace computation graphs whose nodes keep their values through a policy,
+  and find out how much memory that saved. (PackedNode, SavedValueStats)
+
+Policies apply to make_vjp(fun, x, saved_values=policy) and grad(). Values are
+packed as soon as their node is created, and unpacked when the backward pass
+reaches a node that uses them.
+"""
+from collections import namedtuple
+import mmap
+import os
+import weakref
+import zlib
+
+import numpy as np
+
+from .tracer import Node, root_recipe
+from .util import subvals
+
+SavedValueStats = namedtuple('SavedValueStats', ['values', 'packed',
+                                                 'nbytes', 'packed_nbytes'])
+SavedValueStats.__doc__ = """What a policy did during one trace.
+
+Attributes:
+  values: int. Number of arrays large enough for the policy to consider.
+  packed: int. Number of them stored through the policy. The others were kept
+    as they were, e.g. because storing them at lower precision was not
+    accurate enough.
+  nbytes: int. Size of the considered arrays.
+  packed_nbytes: int. Size of what was kept of them in memory. nbytes -
+    packed_nbytes bytes were saved.
+"""
+
+class PackedValue(object):
+    """A saved value stored by a policy. Subclasses implement restore()."""
+    __slots__ = ['nbytes', 'unpacked', '__weakref__']
+
+    def __init__(self, nbytes):
+        self.nbytes = nbytes
+        self.unpacked = None
+
+    def unpack(self):
+        """The saved value. Nodes sharing this value share its unpacked copy
+        for as long as one of them holds on to it."""
+        x = None if self.unpacked is None else self.unpacked()
+        if x is None:
+            x = self.restore()
+            self.unpacked = weakref.ref(x)
+        return x
+
+    def restore(self):
+        raise NotImplementedError
+
+class SavedValuePolicy(object):
+    """How to store saved values.
+
+    Subclasses implement pack(), and are given every saved ndarray of at least
+    min_nbytes bytes. Policies that need resources for each trace (e.g. a
+    file) implement open() instead.
+    """
+
+    def __init__(self, min_nbytes=4096):
+        self.min_nbytes = min_nbytes
+
+    def open(self):
+        """Packer for the values of one trace: an object with the pack() and
+        close() methods of a policy. close() is called when the vjp function
+        of the trace is garbage collected."""
+        return self
+
+    def pack(self, x):
+        """Store the ndarray x. Returns a PackedValue, or None to keep x."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+# ----- Downcasting -----
+
+class DowncastValue(PackedValue):
+    __slots__ = ['data', 'dtype', 'from_bits']
+
+    def __init__(self, data, dtype, from_bits):
+        PackedValue.__init__(self, data.nbytes)
+        self.data = data
+        self.dtype = dtype
+        self.from_bits = from_bits
+
+    def restore(self):
+        return self.from_bits(self.data).astype(self.dtype)
+
+def to_bfloat16(x):
+    """Upper 16 bits of float32(x), rounded to nearest even, as uint16."""
+    bits = np.asarray(x, np.float32).view(np.uint32)
+    bits = bits + (0x7FFF + ((bits >> 16) & 1))
+    return (bits >> 16).astype(np.uint16)
+
+def from_bfloat16(bits):
+    return (bits.astype(np.uint32) << 16).view(np.float32)
+
+def to_float16(x):
+    return x.astype(np.float16)
+
+def from_float16(bits):
+    return bits
+
+class Downcast(SavedValuePolicy):
+    """Store floating point values at 16 bits.
+
+    Each value is checked when it is packed: if the largest error of its
+    low-precision copy is more than 'rtol' times its largest magnitude (e.g.
+    because it overflows float16), it is kept at full precision.
+    """
+    formats = {'float16': (to_float16, from_float16),
+               'bfloat16': (to_bfloat16, from_bfloat16)}
+
+    def __init__(self, dtype='float16', rtol=1e-2, min_nbytes=4096):
+        """
+
+        Args:
+          dtype: 'float16', or 'bfloat16', which has float32's range but
+            only 8 bits of precision.
+          rtol: float. Tolerance of the check.
+          min_nbytes: int. Smaller values are kept as they are.
+        """
+        SavedValuePolicy.__init__(self, min_nbytes)
+        self.to_bits, self.from_bits = self.formats[dtype]
+        self.rtol = rtol
+
+    def pack(self, x):
+        if x.dtype.kind != 'f' or x.dtype.itemsize <= 2:
+            return None
+        data = self.to_bits(x)
+        error = np.max(np.abs(self.from_bits(data) - x))
+        if not error <= self.rtol * np.max(np.abs(x)):
+            return None
+        return DowncastValue(data, x.dtype, self.from_bits)
+
+# ----- Compression -----
+
+class CompressedValue(PackedValue):
+    __slots__ = ['data', 'shape', 'dtype']
+
+    def __init__(self, data, shape, dtype):
+        PackedValue.__init__(self, len(data))
+        self.data = data
+        self.shape = shape
+        self.dtype = dtype
+
+    def restore(self):
+        # Read-only, as it shares the decompressed bytes.
+        return np.frombuffer(zlib.decompress(self.data),
+                             self.dtype).reshape(self.shape)
+
+class Compress(SavedValuePolicy):
+    """Store values compressed with zlib. Lossless.
+
+    Pays off for values with many repeated bytes, e.g. the zeros of a relu.
+    Values that don't get smaller are kept as they are.
+    """
+
+    def __init__(self, level=1, min_nbytes=4096):
+        """
+
+        Args:
+          level: int. zlib compression level, from 1 (fastest) to 9.
+          min_nbytes: int. Smaller values are kept as they are.
+        """
+        SavedValuePolicy.__init__(self, min_nbytes)
+        self.level = level
+
+    def pack(self, x):
+        if x.dtype.hasobject:
+            return None
+        data = zlib.compress(np.ascontiguousarray(x), self.level)
+        if len(data) >= x.nbytes:
+            return None
+        return CompressedValue(data, x.shape, x.dtype)
+
+# ----- Spilling to disk -----
+
+class SpilledValue(PackedValue):
+    __slots__ = ['arena', 'offset', 'shape', 'dtype']
+
+    def __init__(self, arena, offset, shape, dtype):
+        # Nothing is kept in memory.
+        PackedValue.__init__(self, 0)
+        self.arena = arena
+        self.offset = offset
+        self.shape = shape
+        self.dtype = dtype
+
+    def restore(self):
+        return self.arena.load(self.offset, self.shape, self.dtype)
+
+class Spill(SavedValuePolicy):
+    """Write values to a file, and memory-map it for the backward pass.
+
+    Each trace appends its values to a file of its own (an arena) in
+    'directory'. The backward pass reads them through a single memory map of
+    the arena, without copying: a node's values are views of the map. Pages
+    are read as the backward pass reaches them and can be dropped by the OS
+    page cache afterwards, so a graph only needs memory for the values of the
+    nodes the backward pass is working on. The arena is deleted once the vjp
+    function of its trace is garbage collected.
+    """
+
+    def __init__(self, directory=None, min_nbytes=1 << 20):
+        """
+
+        Args:
+          directory: str. Where to put arenas. Defaults to the system's
+            temporary directory.
+          min_nbytes: int. Smaller values are kept in memory.
+        """
+        SavedValuePolicy.__init__(self, min_nbytes)
+        self.directory = directory
+
+    def open(self):
+        return Arena(self.directory)
+
+class Arena(object):
+    """A file that values are appended to, then read back memory-mapped."""
+
+    # Values start at multiples of this many bytes, for aligned views.
+    alignment = 64
+    # Bytes before a value that load() asks the OS to read ahead.
+    readahead = 16 << 20
+
+    def __init__(self, directory):
+        # Imported here, as tempfile is slow to import.
+        import tempfile
+        fd, self.path = tempfile.mkstemp(prefix='autograd-', suffix='.arena',
+                                         dir=directory)
+        self.file = os.fdopen(fd, 'w+b')
+        self.size = 0
+        self.map = None
+
+    def pack(self, x):
+        if x.dtype.hasobject:
+            return None
+        offset = -self.size % self.alignment + self.size
+        self.file.seek(offset)
+        self.file.write(np.ascontiguousarray(x).data.cast('B'))
+        self.size = offset + x.nbytes
+        return SpilledValue(self, offset, x.shape, x.dtype)
+
+    def load(self, offset, shape, dtype):
+        """Read-only view of the value at 'offset'."""
+        if self.map is None or len(self.map) < self.size:
+            # Map the values written so far, usually all of them.
+            self.file.flush()
+            self.map = mmap.mmap(self.file.fileno(), self.size,
+                                 access=mmap.ACCESS_READ)
+        count = int(np.prod(shape))
+        if hasattr(mmap, 'MADV_WILLNEED'):
+            # The backward pass reads values in the reverse of the order in
+            # which they were written, which defeats the kernel's readahead.
+            # Ask for the preceding values, which are needed next.
+            start = max(offset - self.readahead, 0)
+            start -= start % mmap.PAGESIZE
+            end = offset + count * dtype.itemsize
+            self.map.madvise(mmap.MADV_WILLNEED, start, end - start)
+        return np.frombuffer(self.map, dtype, count, offset).reshape(shape)
+
+    def close(self):
+        # Views of the map stay valid after the file is deleted.
+        self.map = None
+        self.file.close()
+        os.remove(self.path)
+
+# ----- Graphs -----
+
+class SavedValueStore(object):
+    """Packs the saved values of one trace through a policy.
+
+    An array is packed once, when it is the value of a new node. Nodes that
+    take it as an argument later share the packed copy.
+    """
+
+    def __init__(self, policy):
+        self.min_nbytes = policy.min_nbytes
+        self.packer = policy.open()
+        self.packed = {}  # id(array) -> (weakref to array, PackedValue)
+        self.counts = [0, 0, 0, 0]
+
+    def pack(self, x):
+        """PackedValue for x, or x itself."""
+        if type(x) is not np.ndarray or x.nbytes < self.min_nbytes:
+            return x
+        packed = self.lookup(x)
+        if packed is not x:
+            return packed
+        packed = self.packer.pack(x)
+        counts = self.counts
+        counts[0] += 1
+        counts[2] += x.nbytes
+        if packed is None:
+            counts[3] += x.nbytes
+            return x
+        counts[1] += 1
+        counts[3] += packed.nbytes
+        key = id(x)
+        # Forget x once it is gone, as its id may be reused.
+        self.packed[key] = (weakref.ref(x, lambda _: self.packed.pop(key, None)),
+                            packed)
+        return packed
+
+    def lookup(self, x):
+        """PackedValue for x if it has been packed, or x itself."""
+        ref, packed = self.packed.get(id(x), (None, None))
+        return packed if ref is not None and ref() is x else x
+
+    def stats(self):
+        return SavedValueStats(*self.counts)
+
+    def close(self):
+        self.packer.close()
+
+class PackedNode(Node):
+    """A node that keeps its recipe's values through a SavedValueStore.
+
+    The value of the node is packed. Arguments that are values of other nodes
+    refer to those nodes' packed copies. Other arguments (the differentiated
+    argument, constants) are kept as they are. Use unpack() to get the recipe
+    back.
+    """
+    __slots__ = ['store']
+
+    def __init__(self, value, fun, args, kwargs, parent_argnums, parents):
+        store = self.store = parents[0].store
+        args = subvals(args, [(argnum, store.lookup(args[argnum]))
+                              for argnum in parent_argnums])
+        Node.__init__(self, store.pack(value), fun, args, kwargs,
+                      parent_argnums, parents)
+
+    def initialize_root(self, store):
+        self.parents = ()
+        self.recipe = root_recipe
+        self.store = store
+
+    @staticmethod
+    def unpack(value, args):
+        """Unpacked value and args of a recipe."""
+        if isinstance(value, PackedValue):
+            value = value.unpack()
+        return value, subvals(args, [(argnum, arg.unpack())
+                                     for argnum, arg in enumerate(args)
+                                     if isinstance(arg, PackedValue)])
@@ -0,0 +1,284 @@
+"""Compiled tapes.
+
+Tracing a function builds a fresh graph of Box and Node objects on every call.
+When a function is evaluated many times at inputs with the same shapes and
+dtypes, the graph it builds is the same each time; only the values change. This
+library records that graph once as a flat list of primitive applications (a
+"tape") and replays it, forward and backward, on raw unboxed values.
+
+With this library, one can,
+
+- Record the primitives applied by a function. (record_tape)
+- Evaluate a recorded function and its gradient without boxing. (Tape)
+- Keep a bounded number of tapes around, keyed by input signature. (LRUCache)
+
+Replaying a tape is only valid if the function's sequence of primitives depends
+on nothing but the shapes and dtypes of its inputs. Value-dependent control
+flow can't be seen by a tape. Non-differentiable functions applied to traced
+values (comparisons, argmax, etc.) and branches on traced values (if x: ...)
+are detected while recording, and such functions are reported as not
+compilable. Control flow that depends on traced values without going through
+either, e.g. on x.tolist() or on float(x), is not detected.
+
+Values that aren't arguments of the recorded function, such as arrays it closes
+over, are baked into the tape as constants. Rebinding them afterwards (e.g.
+assigning a new array to a global) is not seen by a replay.
+"""
+from collections import OrderedDict, namedtuple
+import numpy as np
+
+from . import tracer
+from .tracer import Node, new_box, isbox, trace_stack, box_type_mappings
+from .core import primitive_vjps, add_outgrads
+from .cotangents import densify
+from .util import toposort
+
+# Non-differentiable functions whose output depends only on the shape and dtype
+# of their inputs. These are safe to apply to traced values while recording.
+static_functions = {
+    np.iscomplexobj,
+    np.isscalar,
+    np.ndim,
+    np.ones_like,
+    np.result_type,
+    np.shape,
+    np.size,
+    np.zeros_like,
+}
+
+TapeEntry = namedtuple('TapeEntry', [
+    'fun',           # wrapped primitive. Used to look up vjps.
+    'raw_fun',       # unwrapped function. Used for forward replay.
+    'args',          # positional args with parent positions set to None.
+    'kwargs',        # keyword args.
+    'argnums',       # positions of args that are outputs of other entries.
+    'parent_slots',  # slots holding those outputs.
+    'out_slot',      # slot to store this entry's output in.
+])
+
+class NotCompilableError(Exception):
+    """Raised when a function can't be faithfully recorded on a tape."""
+
+class Tape(object):
+    """A flat record of the primitives applied by a function.
+
+    Values live in numbered slots. Slots 0..num_inputs-1 hold the function's
+    inputs; every entry writes its output to its own slot.
+    """
+    def __init__(self, entries, num_inputs, num_slots, end_slot, end_value):
+        """
+
+        Args:
+          entries: list of TapeEntry, in order of evaluation.
+          num_inputs: int. Number of input slots.
+          num_slots: int. Total number of slots.
+          end_slot: int or None. Slot holding the function's output. None if
+            the output doesn't depend on the inputs.
+          end_value: output of the function if end_slot is None.
+        """
+        self.entries = entries
+        self.num_inputs = num_inputs
+        self.num_slots = num_slots
+        self.end_slot = end_slot
+        self.end_value = end_value
+        self._requires = {}
+
+    def requires_grad(self, input_slot):
+        """Find slots whose value depends on the given input slot.
+
+        Returns:
+          List of booleans, one per slot.
+        """
+        if input_slot in self._requires:
+            return self._requires[input_slot]
+        requires = self._requires[input_slot] = [False] * self.num_slots
+        requires[input_slot] = True
+        for entry in self.entries:
+            requires[entry.out_slot] = any(
+                requires[slot] for slot in entry.parent_slots)
+        return requires
+
+    def forward(self, inputs):
+        """Replay the tape on unboxed inputs.
+
+        Args:
+          inputs: list of values, one per input slot.
+
+        Returns:
+          values: list of values, one per slot.
+          entry_args: list of positional args each entry was applied to.
+        """
+        values = list(inputs) + [None] * (self.num_slots - self.num_inputs)
+        entry_args = []
+        for entry in self.entries:
+            args = list(entry.args)
+            for argnum, slot in zip(entry.argnums, entry.parent_slots):
+                args[argnum] = values[slot]
+            values[entry.out_slot] = entry.raw_fun(*args, **entry.kwargs)
+            entry_args.append(args)
+        return values, entry_args
+
+    def backward(self, g, values, entry_args, requires):
+        """Backpropagation along the tape.
+
+        Args:
+          g: gradient with respect to the tape's output.
+          values: list of slot values, as returned by forward().
+          entry_args: list of entry arguments, as returned by forward().
+          requires: list of booleans, as returned by requires_grad().
+
+        Returns:
+          List of gradients, one per slot. None for slots that received no
+          gradient. Gradients may be structured (see autograd.cotangents).
+        """
+        outgrads = [None] * self.num_slots
+        outgrads[self.end_slot] = g
+        for entry, args in zip(reversed(self.entries), reversed(entry_args)):
+            outgrad = outgrads[entry.out_slot]
+            if outgrad is None:
+                continue
+            outgrads[entry.out_slot] = None
+            outgrad = densify(outgrad)
+            ans = values[entry.out_slot]
+            for argnum, slot in zip(entry.argnums, entry.parent_slots):
+                vjp = primitive_vjps[entry.fun][argnum]
+                if not requires[slot] or vjp is None:
+                    # vjp is None if fun isn't differentiable wrt this
+                    # argument, e.g. where()'s condition.
+                    continue
+                parent_grad = vjp(outgrad, ans, *args, **entry.kwargs)
+                outgrads[slot] = add_outgrads(outgrads[slot], parent_grad)
+        return outgrads
+
+def record_tape(fun, args, kwargs):
+    """Trace fun(*args, **kwargs) once and record it on a tape.
+
+    Every positional argument that can be boxed becomes an input slot of the
+    tape. All other arguments are baked in as constants.
+
+    Args:
+      fun: function to record.
+      args: tuple of positional arguments.
+      kwargs: dict of keyword arguments.
+
+    Returns:
+      tape: Tape.
+      input_slots: list with, for each positional argument, its input slot or
+        None if it was baked in.
+
+    Raises:
+      NotCompilableError: if fun's computation can't be replayed from a tape.
+    """
+    def observe(f_raw, notrace_args):
+        # Non-differentiable functions, and branches (f_raw is bool), drop
+        # boxes. If their output depends on the values of traced inputs, a
+        # replay would silently reuse stale values.
+        if f_raw not in static_functions and any(map(is_traced, notrace_args)):
+            raise NotCompilableError(
+                "{} is applied to a traced value".format(
+                    getattr(f_raw, '__name__', f_raw)))
+
+    def is_traced(x):
+        while isbox(x):
+            if x._trace_id == trace_id:
+                return True
+            x = x._value
+        return False
+
+    input_slots, start_nodes = [], []
+    old_observer = tracer.notrace_observer
+    with trace_stack.new_trace() as trace_id:
+        boxed_args = []
+        for arg in args:
+            if type(arg) in box_type_mappings and not isbox(arg):
+                start_node = Node.new_root()
+                input_slots.append(len(start_nodes))
+                start_nodes.append(start_node)
+                boxed_args.append(new_box(arg, trace_id, start_node))
+            else:
+                input_slots.append(None)
+                boxed_args.append(arg)
+
+        tracer.notrace_observer = observe
+        try:
+            end_box = fun(*boxed_args, **kwargs)
+        finally:
+            tracer.notrace_observer = old_observer
+
+    num_inputs = len(start_nodes)
+    if not (isbox(end_box) and end_box._trace_id == trace_id):
+        # Output seems independent of input
+        return Tape([], num_inputs, num_inputs, None, end_box), input_slots
+
+    slots = dict((node, slot) for slot, node in enumerate(start_nodes))
+    entries = []
+    for node in reversed(list(toposort(end_box._node))):
+        if node in slots:
+            continue
+        fun_, _, node_args, node_kwargs, argnums = node.recipe
+        node_args = list(node_args)
+        for argnum in argnums:
+            node_args[argnum] = None
+        if any(map(isbox, node_args)) or any(map(isbox, node_kwargs.values())):
+            raise NotCompilableError(
+                "{} closes over a value traced by an enclosing "
+                "computation".format(getattr(fun_, '__name__', fun_)))
+        slots[node] = len(slots)
+        entries.append(TapeEntry(
+            fun=fun_,
+            raw_fun=getattr(fun_, 'fun', fun_),
+            args=tuple(node_args),
+            kwargs=node_kwargs,
+            argnums=tuple(argnums),
+            parent_slots=tuple(slots[parent] for parent in node.parents),
+            out_slot=slots[node]))
+    tape = Tape(entries, num_inputs, len(slots), slots[end_box._node], None)
+    return tape, input_slots
+
+def signature(args, kwargs):
+    """Key identifying the tape recorded for fun(*args, **kwargs).
+
+    Boxable arguments contribute their type, shape and dtype. All other
+    arguments are baked into the tape, so they contribute their value.
+
+    Returns:
+      Hashable key, or None if some argument can't be used as a key.
+    """
+    key = []
+    for arg in args:
+        if type(arg) in box_type_mappings:
+            key.append((type(arg), getattr(arg, 'shape', None),
+                    getattr(arg, 'dtype', None)))
+        else:
+            key.append((type(arg), arg))
+    key.append(tuple(sorted((name, type(value), value)
+                            for name, value in kwargs.items())))
+    key = tuple(key)
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+class LRUCache(object):
+    """Dict with bounded size that evicts its least recently used item."""
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, key):
+        value = self.items.pop(key)
+        self.items[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self.items.pop(key, None)
+        self.items[key] = value
+        while len(self.items) > self.maxsize:
+            self.items.popitem(last=False)
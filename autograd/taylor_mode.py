@@ -0,0 +1,96 @@
+"""Truncated Taylor series, Taylor Mode.
+
+Compute higher derivatives of a computation in a single forward pass, by
+carrying a truncated Taylor series along with every traced value. Each node
+computes its series from its parents' series as soon as it is created. Nested
+grad() builds a larger graph for every additional order; here every primitive
+costs O(k^2) operations for a series of order k. With this library, one can,
+
+- Construct the Taylor series of any single-input function along a direction.
+  (make_taylor)
+- Register Taylor series propagation rules for any primitive function.
+  (deftaylor)
+"""
+import numpy as np
+
+from .tracer import trace, Node, getval
+
+def make_taylor(fun, x, order):
+    """Make function for truncated Taylor series.
+
+    Let y(t) = fun(x + t v). Its Taylor series around t = 0 is
+
+      y(t) = y_0 + y_1 t + y_2 t^2 + ... + y_k t^k + O(t^(k+1))
+
+    where y_0 = fun(x) and y_j is the j-th directional derivative of fun along
+    v, divided by j!.
+
+    Args:
+      fun: single-arg function.
+      x: ndarray. Point to expand about.
+      order: int. Order k of the series.
+
+    Returns:
+      taylor_fun: single-arg function. v -> [y_0, y_1, ..., y_k].
+    """
+    def taylor_fun(v):
+        start_node = TaylorNode.new_root([v] + [None] * (order - 1))
+        end_value, end_node = trace(start_node, fun, x)
+        if end_node is None:
+            series = [None] * order
+        else:
+            series = end_node.series
+        zeros = np.zeros_like(getval(end_value))
+        return [end_value] + [zeros if y is None else y for y in series]
+    return taylor_fun
+
+class TaylorNode(Node):
+    """A node carrying the Taylor coefficients y_1, ..., y_k of its value.
+
+    Coefficients that are identically zero are None, so that values that don't
+    depend on the input beyond first order (e.g. through multiplication by a
+    constant) cost nothing at higher orders. Like JVPNodes, TaylorNodes don't
+    keep their parents or recipe alive.
+    """
+    __slots__ = ['series']
+
+    def __init__(self, value, fun, args, kwargs, parent_argnums, parents):
+        self.parents = ()
+        self.recipe = None
+        try:
+            rule = primitive_taylors[fun]
+        except KeyError:
+            raise NotImplementedError(
+                "Taylor series of {}".format(getattr(fun, '__name__', fun)))
+
+        # Full series [x_0, x_1, ..., x_k] of every positional argument.
+        # Arguments that aren't traced are constants.
+        order = len(parents[0].series)
+        series = [[arg] + [None] * order for arg in args]
+        for argnum, parent in zip(parent_argnums, parents):
+            series[argnum] = [args[argnum]] + parent.series
+        self.series = rule(value, series, *args, **kwargs)
+
+    def initialize_root(self, series):
+        self.parents = ()
+        self.recipe = None
+        self.series = series
+
+primitive_taylors = {}
+def deftaylor(fun, rule):
+    """Register a Taylor series propagation rule.
+
+    Let fun(x, y, ...) = ans be a function. Its rule maps the Taylor series of
+    fun's arguments to the series of ans,
+
+      rule(ans, series, x, y, ...) = [ans_1, ..., ans_k]
+
+    where series[i] = [a_0, a_1, ..., a_k] are the coefficients of fun's i-th
+    positional argument (a_0 being its value), and ans = ans_0. Coefficients
+    that are zero are None, in both the arguments' and the result's series.
+
+    Args:
+      fun: function for which one wants to define a rule.
+      rule: function. Taylor series propagation rule.
+    """
+    primitive_taylors[fun] = rule
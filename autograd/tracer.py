@@ -4,14 +4,16 @@
 This library provides functions for constructing a computation graph. With this
 library, one can,
 
-- Build a computation graph. (trace)
+- Build a computation graph, from one or several inputs. (trace, trace_many)
 - Register wrapper types for unwrapped values based on type(). (Box.register)
 - Build functions that can deal with wrapped values. (primitive,
-  notrace_primitive)
+  unary_primitive, binary_primitive, notrace_primitive)
 - Box values. (new_box)
 """
 from collections import defaultdict
 from contextlib import contextmanager
+from itertools import count
+import threading
 
 from .util import subvals, wraps
 
@@ -32,8 +34,29 @@ def trace(start_node, fun, x):
             # Output seems independent of input
             return end_box, None
 
+def trace_many(start_nodes, fun, xs):
+    """Like trace(), for a function of several arguments.
+
+    Every argument is boxed with its own start node, all under the same trace,
+    so that a single graph records how the output depends on each of them.
+    """
+    with trace_stack.new_trace() as trace_id:
+        start_boxes = [new_box(x, trace_id, start_node)
+                       for x, start_node in zip(xs, start_nodes)]
+        end_box = fun(*start_boxes)
+        if isbox(end_box) and end_box._trace_id == trace_id:
+            return end_box._value, end_box._node
+        else:
+            # Output seems independent of every input.
+            return end_box, None
+
 class Node(object):
-    """A node in a computation graph."""
+    """A node in a computation graph.
+
+    Graphs can have millions of nodes, so nodes have no instance dict.
+    """
+    __slots__ = ['parents', 'recipe']
+
     def __init__(self, value, fun, args, kwargs, parent_argnums, parents):
         """
 
@@ -50,8 +73,15 @@ class Node(object):
         self.recipe = (fun, value, args, kwargs, parent_argnums)
 
     def initialize_root(self):
-        self.parents = []
-        self.recipe = (lambda x: x, None, (), {}, [])
+        self.parents = ()
+        self.recipe = root_recipe
+
+    @staticmethod
+    def records_notrace(f_raw):
+        """Whether this trace records notrace_primitive(f_raw) applied to its
+        boxes, rather than letting it discard them. Gradients don't flow through
+        such functions, so nodes for differentiation don't."""
+        return False
 
     @classmethod
     def new_root(cls, *args, **kwargs):
@@ -59,36 +89,120 @@ class Node(object):
         root.initialize_root(*args, **kwargs)
         return root
 
+# Recipe shared by all root nodes. Roots have no parents, so their recipe is
+# never applied.
+root_recipe = (lambda x: x, None, (), {}, ())
+
 def primitive(f_raw):
     """Wraps a function so that its gradient (vjp) can be specified and its
     invocation can be recorded."""
     @wraps(f_raw)
     def f_wrapped(*args, **kwargs):
-        # Fetch boxed arguments with largest trace_id.  This ensures that the
-        # computational graph being constructed only consists of other nodes
-        # from the same call to trace().
-        boxed_args, trace_id = find_top_boxed_args(args)
-        if boxed_args:
-            # Replace some elements of args with corresponding unboxed values.
-            argvals = subvals(args, [(argnum, box._value) for argnum, box in boxed_args])
-            # Get nodes for each boxed argument.
-            parents = tuple(box._node for _, box in boxed_args)
-
-            # Get argument indices for each boxed argument.
-            argnums = tuple(argnum for argnum, _ in boxed_args)
-
-            # Calculate result of applying original numpy function.
-            #
-            # Note that we use a recursive call here in order to also augment
-            # outer calls to trace() with lower trace_ids. See TraceStack's
-            # docstring for details.
-            ans = f_wrapped(*argvals, **kwargs)
-
-            # Create a new node
-            node = Node(ans, f_wrapped, argvals, kwargs, argnums, parents)
-            return new_box(ans, trace_id, node)
-        else:
-            return f_raw(*args, **kwargs)
+        return apply_primitive(f_wrapped, f_raw, args, kwargs)
+    # Keep a handle on the raw function so that callers holding only unboxed
+    # values (e.g. replaying a compiled tape) can skip the dispatch above.
+    f_wrapped.fun = f_raw
+    return f_wrapped
+
+def apply_primitive(f_wrapped, f_raw, args, kwargs):
+    """Apply a function wrapped by primitive() to its arguments.
+
+    Args:
+      f_wrapped: wrapped function. Recorded in the computation graph.
+      f_raw: original function.
+      args: tuple of positional arguments, possibly boxed.
+      kwargs: dict of keyword arguments.
+
+    Returns:
+      f_raw(*args, **kwargs), boxed if any argument was boxed.
+    """
+    # Fetch boxed arguments with largest trace_id.  This ensures that the
+    # computational graph being constructed only consists of other nodes
+    # from the same call to trace().
+    boxed_args, trace_id = find_top_boxed_args(args)
+    if boxed_args:
+        # Replace some elements of args with corresponding unboxed values.
+        argvals = subvals(args, [(argnum, box._value) for argnum, box in boxed_args])
+        # Get nodes for each boxed argument.
+        parents = tuple(box._node for _, box in boxed_args)
+
+        # Get argument indices for each boxed argument.
+        argnums = tuple(argnum for argnum, _ in boxed_args)
+
+        # Calculate result of applying original numpy function.
+        #
+        # Note that we use a recursive call here in order to also augment
+        # outer calls to trace() with lower trace_ids. See TraceStack's
+        # docstring for details.
+        ans = f_wrapped(*argvals, **kwargs)
+
+        # Create a new node. Nodes of the same trace share a type, which
+        # determines what is recorded (see Node and JVPNode).
+        node = type(parents[0])(ans, f_wrapped, argvals, kwargs, argnums,
+                                parents)
+        return new_box(ans, trace_id, node)
+    else:
+        if profiler is not None:
+            return profiler.call_primitive(f_raw, args, kwargs)
+        return f_raw(*args, **kwargs)
+
+def unary_primitive(f_raw):
+    """Like primitive(), specialized for functions of one positional argument.
+
+    Dispatch overhead dominates the cost of applying a primitive to small
+    arrays. With a single argument there is nothing to search or substitute, so
+    this wrapper skips find_top_boxed_args() and subvals(). Calls with more
+    positional arguments (e.g. a ufunc's 'out') take the general path.
+    """
+    @wraps(f_raw)
+    def f_wrapped(x, *args, **kwargs):
+        if args:
+            return apply_primitive(f_wrapped, f_raw, (x,) + args, kwargs)
+        if type(x) in box_types:
+            parent, xval = x._node, x._value
+            ans = f_wrapped(xval, **kwargs)
+            node = type(parent)(ans, f_wrapped, (xval,), kwargs, (0,), (parent,))
+            return new_box(ans, x._trace_id, node)
+        if profiler is not None:
+            return profiler.call_primitive(f_raw, (x,), kwargs)
+        return f_raw(x, **kwargs)
+    f_wrapped.fun = f_raw
+    return f_wrapped
+
+def binary_primitive(f_raw):
+    """Like primitive(), specialized for functions of two positional arguments.
+
+    See unary_primitive().
+    """
+    @wraps(f_raw)
+    def f_wrapped(x, y, *args, **kwargs):
+        if args:
+            return apply_primitive(f_wrapped, f_raw, (x, y) + args, kwargs)
+        x_boxed = type(x) in box_types
+        y_boxed = type(y) in box_types
+        if x_boxed and (not y_boxed or x._trace_id > y._trace_id):
+            # Only x belongs to the innermost trace.
+            parent, xval = x._node, x._value
+            ans = f_wrapped(xval, y, **kwargs)
+            node = type(parent)(ans, f_wrapped, (xval, y), kwargs, (0,), (parent,))
+            return new_box(ans, x._trace_id, node)
+        if y_boxed and (not x_boxed or y._trace_id > x._trace_id):
+            # Only y belongs to the innermost trace.
+            parent, yval = y._node, y._value
+            ans = f_wrapped(x, yval, **kwargs)
+            node = type(parent)(ans, f_wrapped, (x, yval), kwargs, (1,), (parent,))
+            return new_box(ans, y._trace_id, node)
+        if x_boxed:
+            # Both belong to the innermost trace.
+            xval, yval = x._value, y._value
+            ans = f_wrapped(xval, yval, **kwargs)
+            node = type(x._node)(ans, f_wrapped, (xval, yval), kwargs, (0, 1),
+                                 (x._node, y._node))
+            return new_box(ans, x._trace_id, node)
+        if profiler is not None:
+            return profiler.call_primitive(f_raw, (x, y), kwargs)
+        return f_raw(x, y, **kwargs)
+    f_wrapped.fun = f_raw
     return f_wrapped
 
 def notrace_primitive(f_raw):
@@ -107,14 +221,34 @@ def notrace_primitive(f_raw):
     """
     @wraps(f_raw)
     def f_wrapped(*args, **kwargs):
-        # Extract np.ndarray values from boxed values.
-        argvals = map(getval, args)
+        # Let an observer (see autograd.tape) know that boxed values are about
+        # to be discarded.
+        if notrace_observer is not None:
+            notrace_observer(f_raw, args)
 
-        # Call original function. Note that f_raw()'s arguments may still be
-        # boxed, but with a lower trace_id.
-        return f_raw(*argvals, **kwargs)
+        boxed_args, _ = find_top_boxed_args(args)
+        if not boxed_args:
+            return f_raw(*args, **kwargs)
+        if boxed_args[0][1]._node.records_notrace(f_raw):
+            # This trace needs the result for every value it carries (see
+            # batching.BatchNode), so record the call like a primitive's.
+            return apply_primitive(f_wrapped, f_raw, args, kwargs)
+
+        # Extract values from the innermost trace's boxes and try again. The
+        # arguments may still be boxed, but with a lower trace_id.
+        argvals = subvals(args, [(argnum, box._value) for argnum, box in boxed_args])
+        return f_wrapped(*argvals, **kwargs)
+    f_wrapped.fun = f_raw
     return f_wrapped
 
+# Callback f(f_raw, args) invoked by every notrace_primitive() before it strips
+# boxes from its arguments. None if nobody is listening.
+notrace_observer = None
+
+# Active autograd.profiler.Profiler, or None. Primitives hand their raw calls
+# (the ones that do the actual work, with all boxes stripped) to it.
+profiler = None
+
 def find_top_boxed_args(args):
     """Finds boxed arguments with largest trace_id.
 
@@ -161,25 +295,60 @@ class TraceStack(object):
     Autograd know that x is fixed, when all it can see is
     np.multipy(Box(5.), Box(Box(5.))? Because the second argument has a larger
     trace_id than the former!
+
+    Traces may be started from several threads at once (e.g. by
+    accumulate_grad(prefetch=True) or parallel_backward_pass()), so trace_ids
+    are drawn from a counter that only ever increases. A trace nested in
+    another still gets the larger id, and no two traces share one. The nesting
+    depth is kept per thread.
     """
     def __init__(self):
-        self.top = -1
+        self.ids = count()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    @property
+    def depth(self):
+        """Number of traces open on the calling thread."""
+        return getattr(self.local, 'depth', 0)
 
     @contextmanager
     def new_trace(self):
-        """Increment trace depth."""
-        self.top += 1
-        yield self.top
-        self.top -= 1
+        """Start a trace with a fresh trace_id."""
+        with self.lock:
+            trace_id = next(self.ids)
+        self.local.depth = self.depth + 1
+        try:
+            yield trace_id
+        finally:
+            self.local.depth -= 1
 
 trace_stack = TraceStack()
 
+class TypeMappings(dict):
+    """Type -> subclass of Box.
+
+    Types registered lazily (see Box.register_lazily()) are added the first
+    time a value of that type is boxed.
+    """
+
+    def __init__(self):
+        dict.__init__(self)
+        self.lazy = []  # (predicate on types, subclass of Box)
+
+    def __missing__(self, value_type):
+        for matches, cls in self.lazy:
+            if matches(value_type):
+                self[value_type] = cls
+                return cls
+        raise KeyError(value_type)
+
 class Box(object):
     """Boxes a value within a computation graph."""
 
     # Type -> subclasses of Box. Types may be instances of Box. Subclasses must
     # take same arguments for __init__().
-    type_mappings = {}
+    type_mappings = TypeMappings()
 
     # Non-Box types that can be boxed.
     types = set()
@@ -190,6 +359,9 @@ class Box(object):
         self._trace_id = trace_id
 
     def __bool__(self):
+        # Branching on a value discards its box, like a notrace_primitive().
+        if notrace_observer is not None:
+            notrace_observer(bool, (self,))
         return bool(self._value)
 
     __nonzero__ = __bool__
@@ -216,6 +388,21 @@ class Box(object):
         # interact with the outer Box's.
         Box.type_mappings[cls] = cls
 
+    @classmethod
+    def register_lazily(cls, matches):
+        """Register a class as a Box for every type for which 'matches' is true.
+
+        For types of optional libraries, which can't be registered without
+        importing them.
+
+        Args:
+          cls: Inherits from Box.
+          matches: function. Type -> bool.
+        """
+        Box.types.add(cls)
+        Box.type_mappings.lazy.append((matches, cls))
+        Box.type_mappings[cls] = cls
+
 
 box_type_mappings = Box.type_mappings
 
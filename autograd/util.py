@@ -22,17 +22,30 @@ def subval(x, i, v):
     x_[i] = v
     return tuple(x_)
 
-def toposort(end_node):
-    child_counts = {}
+def count_children(end_node):
+    """Count the edges from each node's children to it.
+
+    Args:
+      end_node: Node. Only it and its ancestors are counted.
+
+    Returns:
+      dict mapping each ancestor of end_node (and end_node itself, with count
+      0) to the number of times it appears among its children's parents.
+    """
+    child_counts = {end_node: 0}
     stack = [end_node]
     while stack:
         node = stack.pop()
-        if node in child_counts:
-            child_counts[node] += 1
-        else:
-            child_counts[node] = 1
-            stack.extend(node.parents)
+        for parent in node.parents:
+            if parent in child_counts:
+                child_counts[parent] += 1
+            else:
+                child_counts[parent] = 1
+                stack.append(parent)
+    return child_counts
 
+def toposort(end_node):
+    child_counts = count_children(end_node)
     childless_nodes = [end_node]
     while childless_nodes:
         node = childless_nodes.pop()
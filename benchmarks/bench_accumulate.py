@@ -0,0 +1,58 @@
+"""Full-batch grad() vs accumulate_grad() over minibatches.
+
+Gradient of an MLP's squared error summed over 'n_batches' minibatches of 256
+examples. grad() sees all of them at once; accumulate_grad() streams them
+from a generator, with and without tracing the next minibatch on a background
+thread.
+
+Prefetching only helps if there is a spare core for the background thread.
+
+Usage:
+  PYTHONPATH=. python benchmarks/bench_accumulate.py [n_batches]
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+import sys
+import time
+
+import numpy as onp
+import autograd.numpy as np
+from autograd import grad, accumulate_grad
+
+from util import peak_rss_mb, in_fresh_interpreter, main_or_measure
+
+batch_size, width = 256, 512
+
+def loss(W, batch):
+    inputs, targets = batch
+    hiddens = np.tanh(np.dot(inputs, W))
+    return np.sum((np.dot(hiddens, np.ones((width, 1))) - targets) ** 2)
+
+def minibatches(n_batches):
+    rs = onp.random.RandomState(0)
+    for _ in range(n_batches):
+        yield rs.randn(batch_size, width), rs.randn(batch_size, 1)
+
+def measure(mode, n_batches):
+    W = onp.random.RandomState(1).randn(width, width) / width
+    baseline = peak_rss_mb()
+    start = time.time()
+    if mode == 'grad':
+        inputs, targets = zip(*minibatches(n_batches))
+        grad(loss)(W, (onp.concatenate(inputs), onp.concatenate(targets)))
+    else:
+        accumulate_grad(loss, minibatches(n_batches),
+                        prefetch=(mode == 'prefetch'))(W)
+    return {'peak_mb': peak_rss_mb() - baseline,
+            'seconds': time.time() - start}
+
+def main():
+    n_batches = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    print("{} minibatches of {} examples".format(n_batches, batch_size))
+    for mode in ['grad', 'accumulate', 'prefetch']:
+        result = in_fresh_interpreter(__file__, mode, n_batches)
+        print("{:<12} peak RSS: {:8.1f} MB   time: {:8.1f} ms".format(
+            mode, result['peak_mb'], result['seconds'] * 1e3))
+
+if __name__ == '__main__':
+    main_or_measure(main, measure)
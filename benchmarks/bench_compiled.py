@@ -0,0 +1,39 @@
+"""Compare grad() against compiled_grad().
+
+Usage:
+  PYTHONPATH=. python benchmarks/bench_compiled.py
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+import timeit
+
+import numpy as onp
+import autograd.numpy as np
+from autograd import grad, compiled_grad
+
+def tanh(x):
+    return (1.0 - np.exp(-x))  / (1.0 + np.exp(-x))
+
+def mlp(W1, W2, W3, inputs):
+    hiddens = np.tanh(np.dot(inputs, W1))
+    hiddens = np.tanh(np.dot(hiddens, W2))
+    return np.dot(hiddens, W3)
+
+def time_per_call(f, args, number):
+    f(*args)  # Warm up. Records the tape for compiled_grad().
+    return min(timeit.repeat(lambda: f(*args), repeat=5, number=number)) / number
+
+def compare(name, fun, args, number):
+    plain = time_per_call(grad(fun), args, number)
+    compiled = time_per_call(compiled_grad(fun), args, number)
+    print("{:<24} grad: {:9.1f} us   compiled_grad: {:9.1f} us   speedup: {:5.2f}x"
+          .format(name, plain * 1e6, compiled * 1e6, plain / compiled))
+
+if __name__ == '__main__':
+    rs = onp.random.RandomState(0)
+    compare("tanh, scalar", tanh, (1.0,), 2000)
+    compare("tanh, 200 points", tanh, (np.linspace(-7, 7, 200),), 2000)
+    for width in [10, 100, 1000]:
+        args = (rs.randn(20, width), rs.randn(width, width), rs.randn(width, 1),
+                rs.randn(32, 20))
+        compare("mlp, width {}".format(width), mlp, args, 200)
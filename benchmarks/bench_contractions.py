@@ -0,0 +1,62 @@
+"""Gradients of batched contractions.
+
+Gradient of an attention-style score, softmax-free to keep the contractions
+the only cost: scores = q k^T for every (batch, head) pair, then v-weighted.
+'loop' writes it with 2-D dot() calls in Python loops, as was needed before
+matmul(), tensordot() and einsum() had vjps; 'matmul' and 'einsum' are single
+batched calls. 'einsum_path' is the time the einsum contraction path search
+would add to every call of the einsum version if its path weren't cached.
+
+Usage:
+  PYTHONPATH=. python benchmarks/bench_contractions.py [batch] [heads] [length] [dim]
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+import sys
+
+import numpy as onp
+import autograd.numpy as np
+from autograd import grad
+
+from util import best_of
+
+def loop(q, k, v):
+    total = 0.
+    for b in range(q.shape[0]):
+        for h in range(q.shape[1]):
+            scores = np.dot(q[b, h], k[b, h].T)
+            total = total + np.sum(np.tanh(np.dot(scores, v[b, h])))
+    return total
+
+def matmul(q, k, v):
+    scores = np.matmul(q, np.swapaxes(k, -1, -2))
+    return np.sum(np.tanh(np.matmul(scores, v)))
+
+def einsum(q, k, v):
+    scores = np.einsum('bhqd,bhkd->bhqk', q, k, optimize=True)
+    return np.sum(np.tanh(np.einsum('bhqk,bhkd->bhqd', scores, v,
+                                    optimize=True)))
+
+def main():
+    batch, heads, length, dim = [int(a) for a in sys.argv[1:5]] or [8, 8, 128, 64]
+    print("batch {}, {} heads, length {}, dim {}".format(
+        batch, heads, length, dim))
+    rs = onp.random.RandomState(0)
+    q, k, v = [rs.randn(batch, heads, length, dim) / dim ** 0.5
+               for _ in range(3)]
+    reference = None
+    for fun in [loop, matmul, einsum]:
+        g = grad(fun)(q, k, v)
+        if reference is None:
+            reference = g
+        assert onp.allclose(g, reference)
+        print("{:<12} {:8.1f} ms".format(
+            fun.__name__, best_of(lambda: grad(fun)(q, k, v)) * 1e3))
+    shapes = [(batch, heads, length, dim)] * 2
+    search = best_of(lambda: onp.einsum_path(
+        'bhqd,bhkd->bhqk', *[onp.empty(s) for s in shapes], optimize=True))
+    # Forward pass and the vjps of both operands of both einsums.
+    print("{:<12} {:8.1f} ms".format('einsum_path', search * 6 * 1e3))
+
+if __name__ == '__main__':
+    main()
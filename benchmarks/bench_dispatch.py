@@ -0,0 +1,58 @@
+"""Per-operation overhead of primitive dispatch.
+
+Applies a unary and a binary ufunc to small arrays nested in 0 to 3 boxes (one
+per enclosing trace), through the general primitive() wrapper and through the
+wrappers specialized by arity. Depth 0 means unboxed arguments.
+
+Usage:
+  PYTHONPATH=. python benchmarks/bench_dispatch.py
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+from contextlib import contextmanager
+import timeit
+
+import numpy as onp
+import autograd.numpy  # Registers ArrayBox.
+from autograd.tracer import (primitive, unary_primitive, binary_primitive,
+                             trace_stack, new_box, Node)
+
+@contextmanager
+def nested_boxes(value, depth):
+    """Box 'value' in 'depth' nested traces."""
+    traces = [trace_stack.new_trace() for _ in range(depth)]
+    try:
+        for trace in traces:
+            trace_id = trace.__enter__()
+            value = new_box(value, trace_id, Node.new_root())
+        yield value
+    finally:
+        for trace in reversed(traces):
+            trace.__exit__(None, None, None)
+
+def time_per_call(f, args, number=20000):
+    return min(timeit.repeat(lambda: f(*args), repeat=5, number=number)) / number
+
+def main():
+    x = onp.ones(3)
+    cases = [
+        ("negative", onp.negative, unary_primitive, 1),
+        ("multiply", onp.multiply, binary_primitive, 2),
+    ]
+    print("{:<10} {:>5} {:>12} {:>12} {:>12} {:>8}".format(
+        "op", "depth", "numpy (us)", "general", "specialized", "speedup"))
+    for name, ufunc, specialized_primitive, nin in cases:
+        general = primitive(ufunc)
+        specialized = specialized_primitive(ufunc)
+        raw = time_per_call(ufunc, (x,) * nin)
+        for depth in range(4):
+            with nested_boxes(x, depth) as boxed:
+                args = (boxed,) + (x,) * (nin - 1)
+                t_general = time_per_call(general, args)
+                t_specialized = time_per_call(specialized, args)
+            print("{:<10} {:>5} {:>12.2f} {:>12.2f} {:>12.2f} {:>7.2f}x".format(
+                name, depth, raw * 1e6, t_general * 1e6, t_specialized * 1e6,
+                t_general / t_specialized))
+
+if __name__ == '__main__':
+    main()
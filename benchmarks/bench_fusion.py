@@ -0,0 +1,45 @@
+"""Fused vs unfused elementwise expressions.
+
+Value and gradient of tanh written with exp() as in examples/tanh.py, on a
+large array. Unfused, every ufunc reads and writes full-size arrays; fused (see
+autograd/fusion.py), every ufunc works on a block of elements in cache.
+
+Usage:
+  PYTHONPATH=. python benchmarks/bench_fusion.py [n_elements] [block_size]
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+import sys
+
+import numpy as onp
+import autograd.numpy as np
+from autograd import grad, fuse
+
+from util import best_of, peak_rss_mb, in_fresh_interpreter, main_or_measure
+
+def tanh(x):
+    return (1.0 - np.exp(-x)) / (1.0 + np.exp(-x))
+
+def measure(mode, n_elements, block_size):
+    x = onp.random.RandomState(0).randn(n_elements)
+    f = tanh if mode == 'unfused' else fuse(tanh, block_size)
+    loss = lambda x: np.sum(f(x))
+    baseline = peak_rss_mb()
+    grad(loss)(x)
+    return {'peak_mb': peak_rss_mb() - baseline,
+            'forward': best_of(lambda: f(x)),
+            'grad': best_of(lambda: grad(loss)(x))}
+
+def main():
+    n_elements = int(sys.argv[1]) if len(sys.argv) > 1 else 10 ** 7
+    block_size = int(sys.argv[2]) if len(sys.argv) > 2 else 1 << 14
+    print("{} elements, blocks of {}".format(n_elements, block_size))
+    for mode in ['unfused', 'fused']:
+        result = in_fresh_interpreter(__file__, mode, n_elements, block_size)
+        print("{:<8} forward: {:7.1f} ms   grad: {:7.1f} ms   "
+              "grad peak RSS: {:7.1f} MB".format(
+                  mode, result['forward'] * 1e3, result['grad'] * 1e3,
+                  result['peak_mb']))
+
+if __name__ == '__main__':
+    main_or_measure(main, measure)
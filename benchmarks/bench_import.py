@@ -0,0 +1,38 @@
+"""Import time of autograd.numpy.
+
+Imports numpy, then autograd.numpy, in fresh interpreters, and reports the time
+the second import takes: autograd's own startup cost, which short-lived
+processes pay on every run. A first, unmeasured import writes the modules'
+bytecode caches, as an installed package would have them.
+
+Usage:
+  PYTHONPATH=. python benchmarks/bench_import.py [n_runs]
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import subprocess
+import sys
+
+measure = """
+import time
+import numpy
+start = time.time()
+import autograd.numpy
+print(time.time() - start)
+"""
+
+def main():
+    n_runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    run = lambda: float(subprocess.check_output([sys.executable, '-c', measure],
+                                                env=env))
+    run()
+    times = sorted(run() for _ in range(n_runs))
+    print("import autograd.numpy, after numpy, over {} runs".format(n_runs))
+    print("min: {:6.1f} ms   median: {:6.1f} ms".format(
+        times[0] * 1e3, times[len(times) // 2] * 1e3))
+
+if __name__ == '__main__':
+    main()
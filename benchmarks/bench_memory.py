@@ -0,0 +1,69 @@
+"""Peak memory of backward passes over a long chain of primitives.
+
+"before" keeps the whole graph alive until the vjp function is dropped
+(retain_graph=True); "after" frees each node's values as soon as the backward
+pass has consumed it.
+
+Within a single step the peak is reached at the end of the forward pass either
+way. The difference shows in a training loop, where the previous step's vjp
+function is still alive while the next step is traced.
+
+Usage:
+  PYTHONPATH=. python benchmarks/bench_memory.py [num_ops] [array_size]
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+import sys
+
+import numpy as onp
+import autograd.numpy as np
+from autograd.core import make_vjp
+from autograd.flatten import flatten, is_container
+
+from util import peak_rss_mb, in_fresh_interpreter, main_or_measure
+
+def chain(x, num_ops):
+    for _ in range(num_ops):
+        x = np.tanh(x) * 1.01
+    return x
+
+def measure(mode, scenario, num_ops, size):
+    x = onp.linspace(-1, 1, size)
+    baseline = peak_rss_mb()
+    retain_graph = (mode == 'before')
+    if scenario == 'single step':
+        vjp, ans = make_vjp(lambda x: chain(x, num_ops), x)
+        vjp(onp.ones_like(ans), retain_graph=retain_graph)
+    elif scenario == 'training loop':
+        # 'vjp' still refers to the previous step's graph while the next step
+        # is traced.
+        for _ in range(3):
+            vjp, ans = make_vjp(lambda x: chain(x, num_ops), x)
+            x = x - 0.01 * vjp(onp.ones_like(ans), retain_graph=retain_graph)
+    return peak_rss_mb() - baseline
+
+def check_constant_output():
+    """vjps of a function that ignores its input take the same arguments as
+    any other, for an array and for a container."""
+    for x in [onp.ones(3), {'a': onp.ones(3), 'b': (onp.ones(2),)}]:
+        for kwargs in [{'retain_graph': True}, {'n_workers': 2}]:
+            vjp, ans = make_vjp(lambda x: 3.0, x)
+            assert ans == 3.0
+            g = vjp(1.0, **kwargs)
+            assert not onp.any(flatten(g)[0] if is_container(g) else g)
+
+def main():
+    check_constant_output()
+    num_ops = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    print("chain of {} ops on arrays of {} floats".format(num_ops, size))
+    for scenario in ['single step', 'training loop']:
+        results = {}
+        for mode in ['before', 'after']:
+            results[mode] = in_fresh_interpreter(__file__, mode, scenario,
+                                                 num_ops, size)
+        print("{:<14} peak RSS before: {:8.1f} MB   after: {:8.1f} MB"
+              .format(scenario + ':', results['before'], results['after']))
+
+if __name__ == '__main__':
+    main_or_measure(main, measure)
@@ -0,0 +1,82 @@
+"""Serial vs parallel gradients.
+
+Thread pool: a backward pass over a graph with 'width' independent branches,
+each a chain of matrix products and tanhs on 'size' x 'size' matrices. NumPy
+releases the GIL inside these, so the branches' vjps can run on several cores
+at once.
+
+Process pool: grad vs parallel_grad of an MLP's squared error summed over a
+batch of 'batch_size' examples.
+
+Expect no speedup on a single-core machine.
+
+Usage:
+  PYTHONPATH=. python benchmarks/bench_parallel.py [width] [size] [batch_size]
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import sys
+import timeit
+
+import numpy as onp
+import autograd.numpy as np
+from autograd import grad, parallel_grad
+from autograd.core import make_vjp
+
+def wide(x, Ws, depth=3):
+    total = 0.
+    for W in Ws:
+        h = x
+        for _ in range(depth):
+            h = np.tanh(np.dot(h, W))
+        total = total + np.sum(h)
+    return total
+
+def mlp_loss(W, inputs, targets):
+    hiddens = np.tanh(np.dot(inputs, W))
+    return np.sum((np.dot(hiddens, np.ones((W.shape[1], 1))) - targets) ** 2)
+
+def time_best(f):
+    return min(timeit.repeat(f, repeat=5, number=1))
+
+def bench_threads(width, size):
+    rs = onp.random.RandomState(0)
+    x = rs.randn(size, size)
+    Ws = [rs.randn(size, size) / size for _ in range(width)]
+    vjp, _ = make_vjp(lambda x: wide(x, Ws), x)
+
+    print("backward pass, {} branches of {}x{} matmuls".format(
+        width, size, size))
+    serial = time_best(lambda: vjp(1.0, retain_graph=True))
+    print("{:<12} {:9.1f} ms".format("serial", serial * 1e3))
+    for n_workers in [2, 4, 8]:
+        t = time_best(lambda: vjp(1.0, retain_graph=True, n_workers=n_workers))
+        print("{:<12} {:9.1f} ms   speedup: {:5.2f}x".format(
+            "{} threads".format(n_workers), t * 1e3, serial / t))
+
+def bench_processes(batch_size):
+    rs = onp.random.RandomState(0)
+    W = rs.randn(100, 500) * 0.1
+    inputs, targets = rs.randn(batch_size, 100), rs.randn(batch_size, 1)
+    print("grad of an MLP loss summed over {} examples".format(batch_size))
+    serial = time_best(lambda: grad(mlp_loss)(W, inputs, targets))
+    print("{:<12} {:9.1f} ms".format("grad", serial * 1e3))
+    for n_workers in [2, 4, 8]:
+        gradfun = parallel_grad(mlp_loss, (1, 2), n_workers)
+        gradfun(W, inputs, targets)  # Start the workers.
+        t = time_best(lambda: gradfun(W, inputs, targets))
+        gradfun.close()
+        print("{:<12} {:9.1f} ms   speedup: {:5.2f}x".format(
+            "{} processes".format(n_workers), t * 1e3, serial / t))
+
+def main():
+    width = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    batch_size = int(sys.argv[3]) if len(sys.argv) > 3 else 20000
+    print("{} CPUs".format(os.cpu_count()))
+    bench_threads(width, size)
+    bench_processes(batch_size)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+"""Per-example gradients: a loop of grad() vs per_example_grad().
+
+Gradients of a 2-layer network's squared error, one per example of a batch.
+
+Usage:
+  PYTHONPATH=. python benchmarks/bench_per_example.py
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+import timeit
+
+import numpy as onp
+import autograd.numpy as np
+from autograd import grad, per_example_grad
+
+def loss(W, x, y):
+    hidden = np.tanh(np.dot(x, W))
+    return np.sum((hidden - y) ** 2)
+
+def loop(W, xs, ys):
+    return onp.stack([grad(loss)(W, x, y) for x, y in zip(xs, ys)])
+
+def time_best(f):
+    return min(timeit.repeat(f, repeat=5, number=1))
+
+def main():
+    rs = onp.random.RandomState(0)
+    vectorized = per_example_grad(loss, 0, (1, 2))
+    for batch_size, width in [(32, 10), (256, 10), (256, 100), (1024, 100)]:
+        W = rs.randn(width, width)
+        xs, ys = rs.randn(batch_size, width), rs.randn(batch_size, width)
+        t_loop = time_best(lambda: loop(W, xs, ys))
+        t_vec = time_best(lambda: vectorized(W, xs, ys))
+        print("batch {:>5}, width {:>4}   loop: {:9.2f} ms   per_example_grad: "
+              "{:9.2f} ms   speedup: {:6.1f}x".format(
+                  batch_size, width, t_loop * 1e3, t_vec * 1e3, t_loop / t_vec))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Memory and time of saved value policies.
+
+Gradient of a deep relu network's squared error, with the graph's saved values
+stored as they are, downcast to 16 bits, compressed, or spilled to a
+memory-mapped file (see autograd/saved_values.py).
+
+Usage:
+  PYTHONPATH=. python benchmarks/bench_saved_values.py [depth] [width] [batch_size]
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as onp
+import autograd.numpy as np
+from autograd import grad
+from autograd.saved_values import Downcast, Compress, Spill
+
+from util import peak_rss_mb, in_fresh_interpreter, main_or_measure
+
+policies = {
+    'none': None,
+    'float16': Downcast('float16'),
+    'bfloat16': Downcast('bfloat16'),
+    'zlib': Compress(),
+    'spill': Spill(),
+}
+
+def relu_net(Ws, inputs):
+    h = inputs
+    for W in Ws:
+        h = np.dot(h, W)
+        h = np.where(h > 0, h, 0.)
+    return np.sum(h ** 2)
+
+def measure(policy, depth, width, batch_size, path):
+    rs = onp.random.RandomState(0)
+    Ws = [rs.randn(width, width) * (2. / width) ** 0.5 for _ in range(depth)]
+    inputs = rs.randn(batch_size, width)
+    baseline = peak_rss_mb()
+    start = time.time()
+    g = grad(lambda W0: relu_net([W0] + Ws[1:], inputs),
+             saved_values=policies[policy])(Ws[0])
+    seconds = time.time() - start
+    onp.save(path, g)
+    return {'peak_mb': peak_rss_mb() - baseline, 'seconds': seconds}
+
+def main():
+    depth = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    width = int(sys.argv[2]) if len(sys.argv) > 2 else 1024
+    batch_size = int(sys.argv[3]) if len(sys.argv) > 3 else 512
+    print("relu network, {} layers of width {}, batch of {}".format(
+        depth, width, batch_size))
+    scratch = tempfile.mkdtemp()
+    reference = None
+    for policy in policies:
+        path = os.path.join(scratch, policy + '.npy')
+        result = in_fresh_interpreter(__file__, policy, depth, width,
+                                      batch_size, path)
+        g = onp.load(path)
+        if reference is None:
+            reference = g
+        error = onp.max(onp.abs(g - reference)) / onp.max(onp.abs(reference))
+        print("{:<10} peak RSS: {:8.1f} MB   time: {:8.1f} ms   "
+              "relative error: {:.1e}".format(
+                  policy, result['peak_mb'], result['seconds'] * 1e3, error))
+    shutil.rmtree(scratch)
+
+if __name__ == '__main__':
+    main_or_measure(main, measure)
@@ -0,0 +1,73 @@
+"""Gradients through products with sparse matrices.
+
+Gradient of a tanh layer's squared output on sparse features, with respect to
+its dense weights and with respect to the features themselves. 'dense' converts
+the features to an ndarray first, as was needed before anp.dot() accepted
+scipy.sparse matrices.
+
+Usage:
+  PYTHONPATH=. python benchmarks/bench_sparse.py [n_examples] [n_features] [density]
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+import sys
+import time
+
+import numpy as onp
+import scipy.sparse
+import autograd.numpy as np
+from autograd import grad
+
+from util import peak_rss_mb, in_fresh_interpreter, main_or_measure
+
+n_outputs = 16
+
+def loss(W, features):
+    return np.sum(np.tanh(np.dot(features, W)) ** 2)
+
+def measure(mode, wrt, n_examples, n_features, density):
+    features = scipy.sparse.random(n_examples, n_features, density,
+                                   format='csr', random_state=0)
+    W = onp.random.RandomState(1).randn(n_features, n_outputs)
+    baseline = peak_rss_mb()
+    start = time.time()
+    if mode == 'dense':
+        # Copied, as pages of zeros that are never written take no memory.
+        features = features.toarray().copy()
+    if wrt == 'weights':
+        grad(loss)(W, features)
+    else:
+        grad(loss, 1)(W, features)
+    return {'peak_mb': peak_rss_mb() - baseline,
+            'seconds': time.time() - start}
+
+def check_gradients():
+    """Gradients through np.dot(), np.matmul() and @ with a constant sparse
+    matrix on either side agree with those through its dense copy."""
+    features = scipy.sparse.random(20, 30, 0.1, format='csr', random_state=0)
+    W = onp.random.RandomState(1).randn(30, n_outputs)
+    dense = features.toarray()
+    reference = grad(lambda W: np.sum(np.tanh(np.dot(dense, W)) ** 2))(W)
+    for product in [np.dot, np.matmul, lambda S, W: S @ W]:
+        g = grad(lambda W: np.sum(np.tanh(product(features, W)) ** 2))(W)
+        assert onp.allclose(g, reference)
+    reference = grad(lambda W: np.sum(np.tanh(np.dot(W.T, dense.T)) ** 2))(W)
+    g = grad(lambda W: np.sum(np.tanh(W.T @ features.T) ** 2))(W)
+    assert onp.allclose(g, reference)
+
+def main():
+    check_gradients()
+    n_examples = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    n_features = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    density = float(sys.argv[3]) if len(sys.argv) > 3 else 1e-3
+    print("{} examples, {} features, density {}".format(
+        n_examples, n_features, density))
+    for wrt in ['weights', 'features']:
+        for mode in ['dense', 'sparse']:
+            result = in_fresh_interpreter(__file__, mode, wrt, n_examples,
+                                          n_features, density)
+            print("wrt {:<9} {:<7} peak RSS: {:8.1f} MB   time: {:8.1f} ms".format(
+                wrt, mode, result['peak_mb'], result['seconds'] * 1e3))
+
+if __name__ == '__main__':
+    main_or_measure(main, measure)
@@ -0,0 +1,54 @@
+"""Loss and gradients wrt several arguments: grad() per argument vs value_and_grad().
+
+The loss of an MLP layer with its weights, biases and inputs all being
+differentiated. 'grad' evaluates the loss, then takes grad() wrt each of the
+three arguments: four forward passes and three backward passes.
+'value_and_grad' traces all three at once and gets the same results from one
+forward pass and one backward pass.
+
+Usage:
+  PYTHONPATH=. python benchmarks/bench_value_and_grad.py [width] [batch_size] [depth]
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+import sys
+
+import numpy as onp
+import autograd.numpy as np
+from autograd import grad, value_and_grad
+
+from util import best_of
+
+def loss(W, b, inputs, depth):
+    h = inputs
+    for _ in range(depth):
+        h = np.tanh(np.dot(h, W) + b)
+    return np.sum(h ** 2)
+
+def separate(W, b, inputs, depth):
+    return (loss(W, b, inputs, depth),
+            tuple(grad(loss, argnum)(W, b, inputs, depth)
+                  for argnum in range(3)))
+
+def together(W, b, inputs, depth):
+    return value_and_grad(loss, (0, 1, 2))(W, b, inputs, depth)
+
+def main():
+    width, batch_size, depth = [int(a) for a in sys.argv[1:4]] or [256, 256, 8]
+    print("{} layers of width {}, batch of {}".format(depth, width, batch_size))
+    rs = onp.random.RandomState(0)
+    W = rs.randn(width, width) / width ** 0.5
+    b = rs.randn(width) * 0.1
+    inputs = rs.randn(batch_size, width)
+    reference = None
+    for name, fun in [('grad', separate), ('value_and_grad', together)]:
+        value, grads = fun(W, b, inputs, depth)
+        if reference is None:
+            reference = (value, grads)
+        assert onp.allclose(value, reference[0])
+        assert all(onp.allclose(g, r) for g, r in zip(grads, reference[1]))
+        print("{:<16} {:8.1f} ms".format(
+            name, best_of(lambda: fun(W, b, inputs, depth)) * 1e3))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""Run the benchmark suite and compare against a saved baseline.
+
+Times every case in suite.py and writes the results as JSON. Given a baseline
+(the JSON output of an earlier run), also prints each case's time relative to
+it, and exits with status 1 if any case got slower by more than the threshold.
+
+Usage:
+  PYTHONPATH=. python benchmarks/run.py [--output FILE] [--baseline FILE]
+      [--threshold FRACTION] [--filter SUBSTRING] [--max-chain N]
+
+Typical use: save a baseline on the main branch, then compare a change to it.
+  PYTHONPATH=. python benchmarks/run.py --output baseline.json
+  PYTHONPATH=. python benchmarks/run.py --baseline baseline.json
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+import argparse
+import json
+import platform
+import sys
+import time
+import timeit
+
+import numpy as onp
+
+import suite
+
+def measure(thunk, repeat=5, min_time=0.02):
+    """Best time per call of thunk(), in seconds.
+
+    Calls are batched so that each of the 'repeat' timings takes at least
+    'min_time' seconds, which keeps timer resolution out of the result.
+    """
+    timer = timeit.Timer(thunk)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= min_time:
+            break
+        number *= 10 if elapsed < min_time / 10 else 2
+    times = [elapsed] + timer.repeat(repeat=repeat - 1, number=number)
+    return min(times) / number, number
+
+def run(cases, repeat):
+    results = {}
+    for name, setup in cases:
+        case = setup()
+        if hasattr(case, '__enter__'):
+            with case as thunk:
+                seconds, number = measure(thunk, repeat)
+        else:
+            seconds, number = measure(case, repeat)
+        results[name] = {'seconds': seconds, 'number': number, 'repeat': repeat}
+        print("{:<32} {:>12}".format(name, format_time(seconds)))
+        sys.stdout.flush()
+    return results
+
+def compare(results, baseline, threshold):
+    """Print times relative to the baseline. Returns names of regressions."""
+    regressions = []
+    print("\n{:<32} {:>12} {:>12} {:>8}".format("case", "baseline", "now", "ratio"))
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        old, new = baseline[name]['seconds'], results[name]['seconds']
+        ratio = new / old
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        elif ratio < 1 / (1 + threshold):
+            flag = '  improved'
+        print("{:<32} {:>12} {:>12} {:>7.2f}x{}".format(
+            name, format_time(old), format_time(new), ratio, flag))
+    return regressions
+
+def format_time(seconds):
+    for unit, scale in [('s', 1), ('ms', 1e-3), ('us', 1e-6)]:
+        if seconds >= scale:
+            return "{:.3g} {}".format(seconds / scale, unit)
+    return "{:.3g} ns".format(seconds / 1e-9)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--output', help="write results to this JSON file")
+    parser.add_argument('--baseline', help="JSON file of an earlier run")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="slowdown flagged as a regression (default 0.2)")
+    parser.add_argument('--filter', default='',
+                        help="only run cases whose name contains this")
+    parser.add_argument('--max-chain', type=int, default=max(suite.CHAIN_LENGTHS),
+                        help="longest chain to trace (default 1e6 nodes)")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    # Cases are set up one at a time and dropped after timing, so that only
+    # one large graph is alive at a time.
+    cases = ((name, setup) for name, setup in suite.all_cases(args.max_chain)
+             if args.filter in name)
+    results = run(cases, args.repeat)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'metadata': {'python': platform.python_version(),
+                                    'numpy': onp.__version__,
+                                    'machine': platform.platform(),
+                                    'time': time.strftime('%Y-%m-%dT%H:%M:%S')},
+                       'results': results}, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print("\n{} regression(s) above {:.0%}".format(
+                len(regressions), args.threshold))
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
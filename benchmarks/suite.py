@@ -0,0 +1,117 @@
+"""Benchmark cases for run.py.
+
+Each case is a (name, setup) pair. setup() builds the inputs (and, where that
+is not what's being measured, the graph) and returns a thunk; run.py times
+calls to thunk(). Cases that must undo something once timed return a context
+manager instead, whose value is the thunk. Names are stable identifiers, since
+they key the saved baselines.
+
+Cases:
+  primitive/<op>/untraced     One call of <op> on a small, unboxed array.
+  primitive/<op>/traced       The same call on a boxed array. The difference
+                              is the per-op cost of tracing.
+  chain/{trace,backward}/<n>  A chain of n scalar multiplications, traced
+                              with make_vjp and then differentiated.
+  fanout/<k>                  grad of a function that uses its input k times,
+                              so add_outgrads sums k contributions.
+  mlp/width<w>                grad of a 3-layer MLP wrt its first layer.
+  tanh/order<k>               k-th nested grad of tanh from examples/tanh.py.
+  taylor/order<k>             Derivatives of tanh up to order k with taylor().
+"""
+from __future__ import absolute_import
+from contextlib import contextmanager
+
+import numpy as onp
+
+import autograd.numpy as np
+from autograd import grad, taylor
+from autograd.core import make_vjp
+from autograd.tracer import trace_stack, new_box, Node
+
+CHAIN_LENGTHS = [10, 100, 1000, 10000, 100000, 1000000]
+
+def primitive_cases():
+    x = onp.linspace(0.1, 1.0, 10)
+    A = onp.eye(10)
+    ops = [
+        ('negative', lambda x: -x),
+        ('exp', np.exp),
+        ('add', lambda x: x + x),
+        ('multiply', lambda x: x * 2.0),
+        ('dot', lambda x: np.dot(A, x)),
+        ('sum', np.sum),
+        ('getitem', lambda x: x[3]),
+    ]
+    for name, op in ops:
+        yield 'primitive/{}/untraced'.format(name), lambda op=op: lambda: op(x)
+        yield 'primitive/{}/traced'.format(name), lambda op=op: traced(op, x)
+
+@contextmanager
+def traced(op, x):
+    # Box 'x' once and time only the op itself. The trace stays open while the
+    # case is timed, and only then.
+    with trace_stack.new_trace() as trace_id:
+        boxed = new_box(x, trace_id, Node.new_root())
+        yield lambda: op(boxed)
+
+def chain(x, n):
+    for _ in range(n):
+        x = x * 1.0000001
+    return x
+
+def chain_cases(max_length):
+    for n in [n for n in CHAIN_LENGTHS if n <= max_length]:
+        yield ('chain/trace/{}'.format(n),
+               lambda n=n: lambda: make_vjp(lambda x: chain(x, n), 1.0))
+        yield 'chain/backward/{}'.format(n), lambda n=n: chain_backward(n)
+
+def chain_backward(n):
+    vjp, _ = make_vjp(lambda x: chain(x, n), 1.0)
+    return lambda: vjp(1.0, retain_graph=True)
+
+def fanout(x, k):
+    total = 0.0
+    for i in range(k):
+        total = total + np.sum(x * float(i))
+    return total
+
+def fanout_cases():
+    x = onp.linspace(-1, 1, 1000)
+    for k in [10, 100, 1000, 10000]:
+        yield ('fanout/{}'.format(k),
+               lambda k=k: lambda: grad(lambda x: fanout(x, k))(x))
+
+def mlp(W1, W2, W3, inputs):
+    hiddens = np.tanh(np.dot(inputs, W1))
+    hiddens = np.tanh(np.dot(hiddens, W2))
+    return np.sum(np.dot(hiddens, W3) ** 2)
+
+def mlp_cases():
+    rs = onp.random.RandomState(0)
+    for width in [10, 100, 1000]:
+        args = (rs.randn(20, width), rs.randn(width, width), rs.randn(width, 1),
+                rs.randn(32, 20))
+        yield 'mlp/width{}'.format(width), lambda args=args: grad_mlp(*args)
+
+def grad_mlp(W1, W2, W3, inputs):
+    g = grad(lambda W1: mlp(W1, W2, W3, inputs))
+    return lambda: g(W1)
+
+def tanh(x):
+    return (1.0 - np.exp(-x))  / (1.0 + np.exp(-x))
+
+def tanh_cases():
+    x = np.linspace(-7, 7, 200)
+    f = tanh
+    for order in range(1, 7):
+        f = grad(f)
+        yield 'tanh/order{}'.format(order), lambda f=f: lambda: f(x)
+    for order in range(1, 7):
+        yield ('taylor/order{}'.format(order),
+               lambda order=order: lambda: taylor(tanh, order)(x))
+
+def all_cases(max_chain_length=max(CHAIN_LENGTHS)):
+    for cases in [primitive_cases(), chain_cases(max_chain_length),
+                  fanout_cases(), mlp_cases(), tanh_cases()]:
+        for case in cases:
+            yield case
@@ -0,0 +1,60 @@
+"""Helpers shared by the benchmark scripts.
+
+Timings are the best of several runs (best_of()), which keeps the noise of
+other processes out of them.
+
+Memory benchmarks report the peak resident set size (RSS) of the process, as
+seen by the OS. A process's peak never goes down, so every such measurement
+runs in a fresh interpreter, started by in_fresh_interpreter(), and the peak it
+reports belongs to that measurement alone. A script using it looks like,
+
+```
+def measure(mode, size):
+    ...
+    return {'peak_mb': ...}
+
+def main():
+    for mode in ['before', 'after']:
+        print(in_fresh_interpreter(__file__, mode, size))
+
+if __name__ == '__main__':
+    main_or_measure(main, measure)
+```
+"""
+from __future__ import absolute_import
+import json
+import resource
+import subprocess
+import sys
+import time
+
+def best_of(f, repeat=5):
+    """Shortest time of 'repeat' calls of f(), in seconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MB."""
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+def in_fresh_interpreter(script, *args):
+    """Result of measure(*args) of a benchmark script, run in a new process.
+
+    Arguments and results must be JSON-serializable.
+    """
+    out = subprocess.check_output(
+        [sys.executable, script, '--measure', json.dumps(args)])
+    return json.loads(out.decode())
+
+def main_or_measure(main, measure):
+    """Entry point of a script using in_fresh_interpreter(): run measure() if
+    the script was started by it, main() otherwise."""
+    if sys.argv[1:2] == ['--measure']:
+        print(json.dumps(measure(*json.loads(sys.argv[2]))))
+    else:
+        main()